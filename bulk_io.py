@@ -0,0 +1,118 @@
+"""Bulk import/export of BASIC data files.
+
+Formats (one record per line):
+    CSV          - comma separated, quoted as needed
+    JSONL        - a JSON array per line, types preserved
+    FIXED:w,w,.. - fixed-width columns of the given widths
+
+Rows are laid out as FileManager.import_rows()/export_rows() expect: the
+key first for DIRECT/SORT/INDEXED files, only the values for SERIAL files.
+Input and output are streamed; the file is written once.
+"""
+import csv
+import json
+import re
+import time
+
+PROGRESS_EVERY = 10000
+_NUMBER = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?$')
+
+
+def parse_format(fmt):
+    """'CSV', 'JSONL' or 'FIXED:10,20' -> (name, widths)."""
+    name, _, widths = str(fmt).upper().partition(':')
+    if name not in ('CSV', 'JSONL', 'FIXED'):
+        raise ValueError(f"Unknown bulk format: {fmt}")
+    if name == 'FIXED':
+        try:
+            widths = [int(w) for w in widths.split(',')]
+        except ValueError:
+            raise ValueError("FIXED needs column widths, e.g. FIXED:10,20,5")
+        return name, widths
+    return name, None
+
+
+def _value(field):
+    # Text formats carry no types: numbers written by BASIC come back as numbers
+    if _NUMBER.match(field):
+        return float(field) if '.' in field else int(field)
+    return field
+
+
+def parse_values(fields):
+    """Text fields as BASIC values: "10" is the number 10, "010" stays text."""
+    return [_value(f) for f in fields]
+
+
+def read_rows(f, fmt):
+    """Yields rows (lists of fields) from an open text file in the given format."""
+    name, widths = parse_format(fmt)
+    if name == 'CSV':
+        for row in csv.reader(f):
+            if row:
+                yield row
+    elif name == 'JSONL':
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield row if isinstance(row, list) else [row]
+    else:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            row, start = [], 0
+            for w in widths:
+                row.append(line[start:start + w].rstrip())
+                start += w
+            yield row
+
+
+def write_rows(f, rows, fmt):
+    """Writes rows to an open text file in the given format."""
+    name, widths = parse_format(fmt)
+    if name == 'CSV':
+        writer = csv.writer(f, lineterminator='\n')
+        for row in rows:
+            writer.writerow(row)
+    elif name == 'JSONL':
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+    else:
+        for row in rows:
+            f.write(''.join(str(v)[:w].ljust(w) for v, w in zip(row, widths)).rstrip() + '\n')
+
+
+def _counted(rows, stats, progress):
+    for row in rows:
+        stats['records'] += 1
+        if progress and stats['records'] % PROGRESS_EVERY == 0:
+            progress(stats['records'], time.monotonic() - stats['started'])
+        yield row
+
+
+def _finish(stats):
+    stats['seconds'] = time.monotonic() - stats.pop('started')
+    stats['rate'] = stats['records'] / stats['seconds'] if stats['seconds'] > 0 else float(stats['records'])
+    return stats
+
+
+def import_file(fm, filename, source, fmt='CSV', progress=None):
+    """Loads `source` (a path) into data file `filename` in one pass.
+
+    progress(records, seconds) is called every PROGRESS_EVERY records.
+    Returns {'records', 'seconds', 'rate'} (rate in records per second).
+    """
+    stats = {'records': 0, 'started': time.monotonic()}
+    convert = list if parse_format(fmt)[0] == 'JSONL' else parse_values
+    with open(source, 'r', newline='', encoding='utf-8') as f:
+        fm.import_rows(filename, _counted(read_rows(f, fmt), stats, progress), convert)
+    return _finish(stats)
+
+
+def export_file(fm, filename, dest, fmt='CSV', progress=None):
+    """Streams data file `filename` to `dest` (a path); see import_file()."""
+    stats = {'records': 0, 'started': time.monotonic()}
+    with open(dest, 'w', newline='', encoding='utf-8') as f:
+        write_rows(f, _counted(fm.export_rows(filename), stats, progress), fmt)
+    return _finish(stats)
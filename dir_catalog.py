@@ -0,0 +1,171 @@
+"""Cached directory listings for finding data files and programs.
+
+OPEN, ERASE and friends used to stat every disk for each lookup, CALL/RUN up
+to three name variants per PATH entry. The catalog lists a directory once
+(os.scandir) and keeps the names of its files; the listing is reused until
+the directory's mtime changes, and within `ttl` seconds of the last check it
+is trusted without even a stat. Files created or erased through this
+process update the catalog directly.
+
+Only hits take the stat-free path: a name that is not in the listing is
+always rechecked against the directory's mtime, so a file another process
+just created is found at once. A file another process erased (or created on
+an earlier disk) may be missed for up to `ttl` seconds.
+
+Names are matched exactly first. On a case-insensitive filesystem (macOS,
+Windows) 'menu.bas' also opens MENU.BAS, so a name missing from a fresh
+listing is checked once with os.path.isfile(); a hit is remembered as an
+alias of the listed name until the directory changes.
+"""
+import os
+import threading
+import time
+
+TTL = 1.0
+# Directories changed this recently are relisted on every check: on
+# filesystems with coarse mtimes a second change may not move the mtime
+MTIME_SLACK = 2.0
+
+
+class DirCatalog:
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self._dirs = {} # directory -> {'mtime', 'names', 'aliases', 'checked', 'stable'}
+        self._located = {} # (directories, name) -> path
+        self._real = {} # path -> os.path.realpath(path)
+        self._info = {} # path -> ((mtime, size), value) for info()
+        self._lock = threading.Lock()
+
+    def names(self, directory, force=False):
+        """The set of file names in a directory (empty if it does not exist).
+
+        The set is shared: do not modify it.
+        """
+        directory = os.path.normpath(directory)
+        now = time.monotonic()
+        with self._lock:
+            d = self._dirs.get(directory)
+            if d is not None and not force and now - d['checked'] < self.ttl:
+                return d['names']
+        try:
+            st = os.stat(directory)
+        except OSError:
+            st = None
+        mtime = st.st_mtime_ns if st else None
+        if d is not None and d['stable'] and d['mtime'] == mtime:
+            d['checked'] = now
+            return d['names']
+
+        names = set()
+        if st is not None:
+            try:
+                with os.scandir(directory) as it:
+                    names = {e.name for e in it if e.is_file()}
+            except OSError:
+                pass
+        stable = st is None or time.time() - st.st_mtime > MTIME_SLACK
+        with self._lock:
+            self._dirs[directory] = {'mtime': mtime, 'names': names, 'aliases': {},
+                                     'checked': now, 'stable': stable}
+            self._located.clear()
+            self._real.clear()
+        return names
+
+    def lookup(self, directory, name, force=False):
+        """The name `name` has in a directory's listing, or None. With
+        `force` the directory is relisted, and a name still missing is
+        checked on disk in case the filesystem ignores case."""
+        names = self.names(directory, force)
+        if name in names:
+            return name
+        d = self._dirs.get(os.path.normpath(directory))
+        alias = d['aliases'].get(name) if d is not None else None
+        if alias is not None or not force:
+            return alias
+        if not os.path.isfile(os.path.join(directory, name)):
+            return None
+        folded = name.casefold()
+        alias = next((n for n in names if n.casefold() == folded), name)
+        if d is not None:
+            with self._lock:
+                d['aliases'][name] = alias
+        return alias
+
+    def exists(self, path):
+        """os.path.isfile(path), answered from the listing of its directory."""
+        directory, name = os.path.split(path)
+        directory = directory or '.'
+        return self.lookup(directory, name) is not None or self.lookup(directory, name, force=True) is not None
+
+    def locate(self, directories, name):
+        """Path of `name` in the first of `directories` that has it, or None."""
+        key = (directories, name)
+        path = self._located.get(key)
+        if path is not None and self._fresh(directories):
+            return path
+        for force in (False, True):
+            for directory in directories:
+                found = self.lookup(directory, name, force)
+                if found is not None:
+                    path = os.path.join(directory, found)
+                    with self._lock:
+                        self._located[key] = path
+                    return path
+        return None
+
+    def realpath(self, path):
+        """os.path.realpath(), remembered until a listing changes."""
+        real = self._real.get(path)
+        if real is None:
+            real = self._real[path] = os.path.realpath(path)
+        return real
+
+    def info(self, path, st, load):
+        """load(path), remembered until the file's mtime or size (from the
+        stat result `st`) changes. Used for SELECT's per-file metadata."""
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._info.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        value = load(path)
+        self._info[path] = (stamp, value)
+        return value
+
+    def _fresh(self, directories):
+        now = time.monotonic()
+        for directory in directories:
+            d = self._dirs.get(os.path.normpath(directory))
+            if d is None or now - d['checked'] >= self.ttl:
+                return False
+        return True
+
+    def add(self, path):
+        """Records a file this process created."""
+        self._update(path, True)
+
+    def discard(self, path):
+        """Records a file this process removed."""
+        self._update(path, False)
+
+    def _update(self, path, present):
+        directory, name = os.path.split(path)
+        with self._lock:
+            d = self._dirs.get(os.path.normpath(directory or '.'))
+            if d is not None:
+                d['names'] = d['names'] | {name} if present else d['names'] - {name}
+                if not present:
+                    d['aliases'] = {k: v for k, v in d['aliases'].items() if v != name and k != name}
+            if not present:
+                self._info.pop(path, None)
+            self._located.clear()
+            self._real.clear()
+
+    def clear(self):
+        with self._lock:
+            self._dirs.clear()
+            self._located.clear()
+            self._real.clear()
+            self._info.clear()
+
+
+catalog = DirCatalog()
@@ -0,0 +1,65 @@
+"""External merge sort for building SORT files from large inputs.
+
+The input is read in chunks of `chunk_size` keys; each chunk is sorted in
+memory and spilled to a temporary run file, and the runs are k-way merged
+with heapq.merge. At most one chunk (plus one buffered key per run) is in
+memory, however large the input is.
+"""
+import heapq
+import marshal
+import os
+import tempfile
+from itertools import islice
+
+CHUNK_SIZE = 100000
+BUFFER = 65536
+_START = object()
+
+
+def _write_run(keys, tmp_dir):
+    keys.sort()
+    fd, path = tempfile.mkstemp(prefix='sort_run_', suffix='.tmp', dir=tmp_dir)
+    with os.fdopen(fd, 'wb', buffering=BUFFER) as f:
+        prev = None
+        for key in keys:
+            if key != prev: # Duplicates collapse within a run already
+                marshal.dump(key, f)
+                prev = key
+    return path
+
+
+def _read_run(path):
+    with open(path, 'rb', buffering=BUFFER) as f:
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError:
+                return
+
+
+def sorted_unique(keys, chunk_size=CHUNK_SIZE, tmp_dir=None):
+    """Yields the distinct keys of an iterable in sorted order.
+
+    Inputs that fit in one chunk are sorted in memory without touching disk.
+    """
+    keys = iter(keys)
+    runs = []
+    try:
+        chunk = list(islice(keys, chunk_size))
+        if len(chunk) < chunk_size:
+            merged = sorted(set(chunk))
+        else:
+            while chunk:
+                runs.append(_write_run(chunk, tmp_dir))
+                chunk = list(islice(keys, chunk_size))
+            merged = heapq.merge(*(_read_run(p) for p in runs))
+
+        prev = _START
+        for key in merged:
+            if key != prev: # Runs may share keys
+                yield key
+                prev = key
+    finally:
+        for path in runs:
+            try: os.remove(path)
+            except OSError: pass
@@ -1,5 +1,75 @@
-import json
+import atexit
+import copy
+import fnmatch
+import marshal
 import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import extsort
+import key_codec
+import storage_format
+import record_store
+from record_store import (SerialStore, PagedStore, ShardedStore, StreamStore, KeyIndex, KeyCursor,
+                          CompactKeyIndex, BloomFilter, field_value, index_value)
+from dir_catalog import catalog
+from soundex import soundex
+
+# Process-wide cache of open files, keyed by resolved path.
+# Every channel that opens the same file (in this or any other FileManager,
+# e.g. a CALLed program) shares one entry: one parse on the first OPEN,
+# one flush on the last CLOSE, and writes are visible on all channels.
+_shared_files = {} # realpath -> {path, type, metadata, data, refs, dirty, ...}
+_shared_lock = threading.RLock()
+
+FLUSH_POLICIES = ('CLOSE', 'INTERVAL', 'WRITES', 'EXPLICIT')
+
+# Disk value (IPLINPUT, e.g. D9=:memory:) for a RAM disk: its files are
+# cache entries that are never flushed or retired, only ERASEd. They are
+# shared by every channel and CALLed program in the process, like files on
+# a real disk, and die with it.
+MEMORY_DISK = ':memory:'
+
+# Transaction journal: one file per process in the storage dir. A COMMIT
+# appends one group (length, crc32, marshalled ops) and fsyncs it; the data
+# files themselves are written later by the flush policy. When a file is
+# flushed its ops are dropped from the journal (rewritten without them, or
+# removed once no ops are left), so the journal only ever holds changes the
+# data files lack. A journal left by a process that died is replayed by the
+# next FileManager.
+JOURNAL_GROUP = struct.Struct('<II')
+JOURNAL_NAME = re.compile(r'journal\.(\d+)\.log$')
+_journal_lock = threading.Lock()
+_journal_pending = {} # Cache key -> path of files with committed, unflushed changes
+_journal_groups = [] # The ops of each group in the journal, as written
+_journal_path = [None]
+_recovered_dirs = set()
+
+# I/O statistics, per channel (while open) and per file (for the life of
+# the process, keyed like _shared_files). Times are in seconds; `bytes` is
+# what flushes wrote to the file (files only).
+STAT_FIELDS = ('opens', 'reads', 'hits', 'misses', 'writes', 'removes', 'next_keys', 'flushes', 'bytes',
+               'open_time', 'close_time', 'flush_time')
+_io_stats = {} # cache key -> {'name': ..., field: count, ...}
+
+# Secondary (KNUM/SDX) indexes of files whose last channel closed, reused by
+# the next OPEN as long as the file's mtime and size are what they were at
+# that CLOSE, i.e. nobody changed it since. The oldest file is dropped first.
+_index_cache = {} # cache key -> ((mtime_ns, size), [(definition, KeyIndex), ...])
+INDEX_CACHE_FILES = 32
+
+_KEEP = object() # compact(): leave the compression as it is
+
+TEXT_BLOCK = 8192 # Read buffer size for TEXT channels
+# READ on a TEXT file stops at LF, CR or $8A
+TEXT_TERMINATOR = re.compile(rb'[\n\r\x8a]')
+
+class RecordBusyError(RuntimeError):
+    """A record is locked (EXTRACT) by another channel or session."""
 
 class FileManager:
     def __init__(self):
@@ -7,11 +77,23 @@ class FileManager:
         self.storage_dir = "basic_storage"
         self.disks = {} # D0 -> path, D1 -> path
         self.program_paths = ['.']
+        self.lock_wait = 0 # Seconds EXTRACT waits for a busy record (LOCKWAIT=)
+        # When changed files are written back (FLUSH= in IPLINPUT):
+        # CLOSE on last close, INTERVAL every flush_interval seconds,
+        # WRITES every flush_writes changes, EXPLICIT only via flush().
+        self.flush_policy = 'CLOSE'
+        self.flush_interval = 5.0
+        self.flush_writes = 100
+        self.file_format = 'JSON' # Format for new data files (FORMAT= JSON | BINARY)
+        self.read_ahead = 64 # Records a sequential READ fetches at once (READAHEAD=)
+        self.transaction = None # BEGIN .. COMMIT/ROLLBACK: {'log': [...], 'entries': {...}}
+        self.stats_dump = None # STATS= in IPLINPUT: 'ON' prints the I/O statistics at END, else a file name
         self.load_iplinput()
         
         # Ensure default storage exists if no disks
         if not self.disks and not os.path.exists(self.storage_dir):
             os.makedirs(self.storage_dir)
+        self._recover_journals()
 
     def load_iplinput(self):
         try:
@@ -27,9 +109,40 @@ class FileManager:
                             if key == 'PATH':
                                 # Split by commas, strip, and store
                                 self.program_paths = [p.strip() for p in val.split(',')]
+                            elif key == 'LOCKWAIT':
+                                self.lock_wait = float(val)
+                            elif key == 'READAHEAD':
+                                self.read_ahead = max(1, int(val))
+                            elif key == 'CACHE':
+                                # Page cache budget for BINARY keyed files, e.g. 64M
+                                units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+                                mult = units.get(val[-1:].upper(), 1)
+                                record_store.page_cache.budget = int(float(val.rstrip('kKmMgG')) * mult)
+                            elif key == 'KEYINDEX':
+                                # Key count from which key indexes are front-coded
+                                CompactKeyIndex.min_keys = int(val)
+                            elif key == 'STATS':
+                                self.stats_dump = None if val.upper() == 'OFF' else val
+                            elif key == 'CATALOG':
+                                # Seconds a directory listing is trusted without a stat
+                                catalog.ttl = float(val)
+                            elif key == 'FORMAT':
+                                if val.upper() not in storage_format.FORMATS:
+                                    raise ValueError(f"Unknown FORMAT: {val}")
+                                self.file_format = val.upper()
+                            elif key == 'FLUSH':
+                                # FLUSH = CLOSE | EXPLICIT | WRITES n | INTERVAL sec
+                                parts = val.upper().split()
+                                if parts[0] not in FLUSH_POLICIES:
+                                    raise ValueError(f"Unknown FLUSH policy: {val}")
+                                self.flush_policy = parts[0]
+                                if len(parts) > 1 and parts[0] == 'WRITES':
+                                    self.flush_writes = int(parts[1])
+                                elif len(parts) > 1 and parts[0] == 'INTERVAL':
+                                    self.flush_interval = float(parts[1])
                             else:
                                 self.disks[key] = val
-                                if not os.path.exists(val):
+                                if val != MEMORY_DISK and not os.path.exists(val):
                                     try:
                                         os.makedirs(val)
                                     except: pass # Just warn?
@@ -42,12 +155,17 @@ class FileManager:
         if not filename.lower().endswith('.bas'):
             trial_names.append(filename + ".bas")
             trial_names.append(filename + ".BAS")
-            
-        for path in self.program_paths:
-            for trial in trial_names:
-                full_path = os.path.join(path, trial)
-                if os.path.exists(full_path) and os.path.isfile(full_path):
-                    return full_path
+
+        # First in the listings the catalog has, and only if every path and
+        # name misses there, once more with each directory relisted
+        for force in (False, True):
+            for path in self.program_paths:
+                directory = os.path.dirname(os.path.join(path, filename)) or '.'
+                for trial in trial_names:
+                    full_path = os.path.join(path, trial)
+                    found = catalog.lookup(directory, os.path.basename(full_path), force)
+                    if found is not None:
+                        return os.path.join(os.path.dirname(full_path), found)
         return None
 
     def _get_path(self, filename, disk_num=None, search=False):
@@ -69,20 +187,51 @@ class FileManager:
                  # If explicit disk request fails, maybe default dir?
                  return os.path.join(self.storage_dir, filename + ".json")
 
-        # 2. Search existing (for OPEN)
+        # 2. Search existing (for OPEN), disks in alphabetical order. The
+        # storage dir goes last: found there or not, it is the default anyway
         if search:
-            # Sort disks alphabetically
-            sorted_disks = sorted(self.disks.keys())
-            for key in sorted_disks:
-                path = os.path.join(self.disks[key], filename + ".json")
-                if os.path.exists(path):
+            dirs = tuple(self.disks[key] for key in sorted(self.disks)) + (self.storage_dir,)
+            name = filename + ".json"
+            # A memory disk is a lookup in the cache; each run of real
+            # directories before it is one catalog.locate()
+            real = []
+            for directory in dirs:
+                if directory != MEMORY_DISK:
+                    real.append(directory)
+                    continue
+                path = catalog.locate(tuple(real), name) if real else None
+                if path is not None:
+                    return path
+                real = []
+                path = os.path.join(MEMORY_DISK, name)
+                if path in _shared_files:
                     return path
+            path = catalog.locate(tuple(real), name) if real else None
+            if path is not None:
+                return path
         
         # 3. Default (current dir or standard storage)
         return os.path.join(self.storage_dir, filename + ".json")
 
-    def create(self, filename, file_type, rec_len=None, key_len=None, disk_num=None):
+    @staticmethod
+    def _exists(path):
+        """True if a data file exists (on disk, or on a memory disk)."""
+        if path.startswith(MEMORY_DISK):
+            return path in _shared_files
+        return catalog.exists(path)
+
+    def create(self, filename, file_type, rec_len=None, key_len=None, disk_num=None, compress=None):
+        """Creates an empty data file. compress ('zlib' or 'lzma') stores the
+        record values of a BINARY file compressed; see compact()."""
         path = self._get_path(filename, disk_num=disk_num, search=False)
+        storage_format.check_compression(compress)
+
+        if path.startswith(MEMORY_DISK):
+            if file_type == 'TEXT':
+                raise ValueError("TEXT files cannot be created on a memory disk")
+            data = SerialStore() if file_type == 'SERIAL' else {}
+            self._create_memory(path, self._new_metadata(file_type, rec_len, key_len, compress), data)
+            return
         
         if file_type == 'TEXT':
              # Create empty raw text file
@@ -101,24 +250,88 @@ class FileManager:
              # It acts as "system text file".
              # Let's strip .json for TEXT files to be "compatible with system text files".
              if path.endswith('.json'): path = path[:-5]
+             self._drop_cached(path)
              
              with open(path, 'w') as f:
                  f.write("")
+             catalog.add(path)
              return
 
         # Use a structure that includes metadata
-        file_content = {
-            "_metadata": {
-                "type": file_type,
-                "rec_len": rec_len,
-                "key_len": key_len
-            },
-            "records": {}
+        self._drop_cached(path)
+        storage_format.dump(path, self._new_metadata(file_type, rec_len, key_len, compress), {}, self.file_format)
+        catalog.add(path)
+
+    def _new_metadata(self, file_type, rec_len, key_len, compress=None):
+        metadata = {
+            "type": file_type,
+            "rec_len": rec_len,
+            "key_len": key_len
         }
-        with open(path, 'w') as f:
-            json.dump(file_content, f, indent=2)
+        if compress:
+            metadata['compress'] = compress
+        if file_type in ('DIRECT', 'SORT', 'INDEXED'):
+            # New keyed files get typed, order-preserving keys; older files
+            # (no key_codec) keep str(key)
+            metadata['key_codec'] = key_codec.TYPED
+        return metadata
+
+    def _drop_cached(self, path):
+        """Forgets the cached entry of a file create() replaces, so OPEN loads
+        the new one; unflushed changes of the old file are dropped."""
+        key = _cache_key(path)
+        with _shared_lock:
+            old = _shared_files.get(key)
+            if old is not None:
+                if old['refs'] > 0 or old.get('hold'):
+                    raise RuntimeError(f"File {path} is in use")
+                del _shared_files[key]
+            _index_cache.pop(key, None)
+        if old is not None:
+            self._close_file(old)
+        _journal_checkpoint(key) # Committed ops of the old file must not replay into the new one
+
+    def _create_memory(self, path, metadata, data):
+        """Creates (or replaces) a file on a memory disk."""
+        with _shared_lock:
+            old = _shared_files.get(path)
+            if old is not None and (old['refs'] > 0 or old.get('hold')):
+                raise RuntimeError(f"File {path} is in use")
+            entry = self._init_entry({'path': path, 'type': metadata['type'], 'metadata': metadata,
+                                      'data': data, 'format': 'JSON', 'memory': True}, path)
+            _shared_files[path] = entry
 
     def open(self, channel, filename, file_type=None, rec_len=None):
+        started = time.perf_counter()
+        entry = self._acquire(filename, file_type, rec_len)
+
+        # Re-opening a busy channel implicitly closes it first
+        if channel in self.channels:
+            self.close(channel)
+
+        self.channels[channel] = {
+            'type': entry['type'],
+            'filename': filename,
+            'path': entry['path'],
+            'data': entry['data'], # Shared with every channel on this file
+            'metadata': entry['metadata'],
+            'shared': entry,
+            'dirty': False, # This channel changed the file since its last flush
+            'pos': 0,
+            'last_key': None, # Track last accessed key for REMOVE without KEY
+            'stats': dict.fromkeys(STAT_FIELDS, 0)
+        }
+        if entry['type'] in ('DIRECT', 'SORT', 'INDEXED'):
+            self._bloom(entry) # Built once per load, shared by all channels
+        chan = self.channels[channel]
+        self._count(chan, 'opens')
+        self._count(chan, 'open_time', time.perf_counter() - started)
+
+    def _acquire(self, filename, file_type=None, rec_len=None):
+        """Returns the shared cache entry for a file, loading it on first use.
+
+        Every _acquire() must be paired with a _release().
+        """
         path = self._get_path(filename, search=True) # Search disks
         
         # Check if we should treat as TEXT (explicit opt or existing file check?)
@@ -134,78 +347,483 @@ class FileManager:
              # Try without .json
              if path.endswith('.json'):
                  base_path = path[:-5]
-                 if os.path.exists(base_path):
+                 if self._exists(base_path):
                      real_path = base_path
-                 elif not os.path.exists(path):
+                 elif not self._exists(path):
                      # If neither exists
                      raise FileNotFoundError(f"File not found: {filename}")
         
-        if not os.path.exists(real_path):
+        if not self._exists(real_path):
             raise FileNotFoundError(f"File not found: {filename}")
-        
-        if is_text:
-            with open(real_path, 'r', encoding='latin-1') as f: # binary-safeish string
-                data = f.read()
-            
-            self.channels[channel] = {
-                'type': 'TEXT',
-                'filename': filename,
-                'path': real_path,
-                'data': data,
-                'metadata': {},
-                'pos': 0,
-                'last_key': None
-            }
-            return
+        return self._acquire_path(real_path, is_text, file_type, rec_len)
 
-        with open(real_path, 'r') as f:
-            try:
-                file_content = json.load(f)
-            except json.JSONDecodeError:
-                # Handle empty or corrupted file gracefully if needed, or re-raise
-                # For now assuming valid JSON if file exists
-                file_content = {"records": {}} # Fallback?
-
-        # If the file uses the old format (no metadata), migrate it or handle it
-        if "_metadata" not in file_content:
-            metadata = {
-                "type": file_type or "SERIAL",
-                "rec_len": rec_len,
-                "key_len": None
-            }
-            records = file_content
+    def _acquire_path(self, real_path, is_text=False, file_type=None, rec_len=None):
+        shared_key = _cache_key(real_path)
+        with _shared_lock:
+            entry = _shared_files.get(shared_key)
+            if entry is None:
+                entry = self._init_entry(self._load_file(real_path, is_text, file_type, rec_len), shared_key)
+                self._reuse_indexes(entry)
+                _shared_files[shared_key] = entry
+            entry['refs'] += 1
+        return entry
+
+    @staticmethod
+    def _init_entry(entry, key):
+        """Adds the sharing state to a freshly loaded (or created) file."""
+        with _shared_lock:
+            stats = _io_stats.get(key)
+            if stats is None:
+                stats = _io_stats[key] = dict.fromkeys(STAT_FIELDS, 0)
+                stats['name'] = os.path.basename(entry['path']).rsplit('.json', 1)[0]
+        entry.update({
+            'key': key, 'refs': 0, 'locks': {}, 'index': None, 'secondary': {}, 'generation': 0,
+            'mutex': threading.RLock(), # Check-and-write of one record (insert_if_absent)
+            'dirty': False, 'writes': 0, 'flushed_at': time.monotonic(), 'stats': stats
+        })
+        return entry
+
+    @staticmethod
+    def _count(chan, field, n=1):
+        """Adds to an I/O counter of a channel and of its file."""
+        stats = chan.get('stats')
+        if stats is not None: # Not on virtual channels (SELECT)
+            stats[field] += n
+            chan['shared']['stats'][field] += n
+
+    def io_stats(self, channel=None):
+        """I/O counters of an open channel, or of every file used by this
+        process when no channel is given ({cache key: counters})."""
+        if channel is not None:
+            if channel not in self.channels:
+                raise RuntimeError(f"Channel {channel} not open")
+            return dict(self.channels[channel].get('stats') or dict.fromkeys(STAT_FIELDS, 0))
+        with _shared_lock:
+            return {key: dict(stats) for key, stats in _io_stats.items()}
+
+    def io_stats_rows(self):
+        """The statistics as records, busiest files first: per file
+        [name, -1, counters...], then per open channel [name, channel,
+        counters...]. Times in milliseconds (CALL "*IOSTATS")."""
+        def row(name, chn, stats):
+            return [name, chn] + [round(stats[f] * 1000, 3) if f.endswith('_time') else stats[f]
+                                  for f in STAT_FIELDS]
+        files = sorted(self.io_stats().values(), key=lambda s: (-(s['reads'] + s['writes'] + s['removes']), s['name']))
+        rows = [row(s['name'], -1, s) for s in files]
+        for chn in sorted(self.channels):
+            chan = self.channels[chn]
+            if chan.get('stats') is not None:
+                rows.append(row(chan['filename'], chn, chan['stats']))
+        return rows
+
+    def stats_report(self):
+        """The per-file statistics as a text table."""
+        lines = ["%-20s %6s %8s %8s %8s %8s %8s %8s %6s %10s %9s %9s %9s" % (
+            'FILE', 'OPENS', 'READS', 'HITS', 'MISSES', 'WRITES', 'REMOVES', 'NEXTKEY', 'FLUSH', 'BYTES',
+            'OPEN_MS', 'CLOSE_MS', 'FLUSH_MS')]
+        for r in self.io_stats_rows():
+            if r[1] == -1:
+                lines.append("%-20s %6d %8d %8d %8d %8d %8d %8d %6d %10d %9.1f %9.1f %9.1f" % (r[0], *r[2:]))
+        return '\n'.join(lines)
+
+    def dump_stats(self):
+        """STATS=ON prints the report, STATS=file appends it to that file."""
+        if not self.stats_dump:
+            return
+        if self.stats_dump.upper() == 'ON':
+            print(self.stats_report())
         else:
-            metadata = file_content["_metadata"]
-            records = file_content["records"]
-        
+            with open(self.stats_dump, 'a') as f:
+                f.write(time.strftime('# %Y-%m-%d %H:%M:%S\n') + self.stats_report() + '\n')
+
+    def _load_file(self, real_path, is_text, file_type=None, rec_len=None):
+        """Parses a file from disk into a (not yet shared) cache entry."""
+        if is_text:
+            # TEXT files are not loaded: reads and writes go through one
+            # shared handle at each channel's position (latin-1, byte per char)
+            handle = open(real_path, 'r+b')
+            size = handle.seek(0, os.SEEK_END)
+            return {'path': real_path, 'type': 'TEXT', 'metadata': {}, 'data': None,
+                    'handle': handle, 'size': size}
+
+        # JSON or binary, whichever the file was written in; it is saved back the same way
+        fmt = storage_format.detect(real_path)
+        if fmt == 'BINARY':
+            with open(real_path, 'rb') as f:
+                metadata = storage_format.read_header(f)
+            # Streamed / paged from disk, never loaded as a whole
+            if metadata.get('partition'):
+                store = self._load_shards(real_path, metadata)
+            elif metadata['type'] == 'SERIAL':
+                store = SerialStore.from_binary(real_path)
+            else:
+                store = PagedStore.from_binary(real_path)
+            return {'path': real_path, 'type': metadata['type'], 'metadata': metadata, 'data': store, 'format': fmt}
+
+        metadata, records, fmt = storage_format.load(real_path, file_type, rec_len)
+        if metadata.get('partition'):
+            records = self._load_shards(real_path, metadata)
+        elif metadata['type'] == 'SERIAL':
+            records = SerialStore.from_records(records, metadata.pop('slots', 0))
+        return {'path': real_path, 'type': metadata['type'], 'metadata': metadata, 'data': records, 'format': fmt}
+
+    # --- Partitioned files ---
+    # A partitioned keyed file is a root file (NAME.json, metadata only) whose
+    # metadata lists the disks of its shards: NAME.p0.json on the first disk,
+    # NAME.p1.json on the second, ... Records are spread over the shards by
+    # key hash or by key range (ShardedStore); channels see one file.
+
+    def _shard_paths(self, root_path, metadata):
+        name = os.path.basename(root_path)[:-5]
+        return [os.path.join(self.disks[disk] if disk in self.disks else os.path.dirname(root_path),
+                             f"{name}.p{i}.json")
+                for i, disk in enumerate(metadata['partition']['disks'])]
+
+    def _load_shards(self, root_path, metadata):
+        partition = metadata['partition']
+        store = ShardedStore.load(self._shard_paths(root_path, metadata), partition['method'],
+                                  partition.get('bounds'))
+        store.saved_metadata = copy.deepcopy(metadata)
+        return store
+
+    def partition(self, filename, disks, bounds=None, convert=list):
+        """Spreads keyed file `filename` over shard files on `disks` (disk
+        names, e.g. ['D0', 'D1', 'D2']): by key hash, or by key range when
+        `bounds` (one fewer than disks; shard i gets the keys below
+        bounds[i]) is given. Also repartitions an already partitioned file.
+
+        For files with typed keys `convert` turns the bounds into keys, as
+        in import_rows() (bulk_io.parse_values for bounds typed as text).
+
+        The file must not be open. The shards are written in parallel, the
+        root file last. Returns the number of records per shard.
+        """
+        if self.is_open(filename):
+            raise RuntimeError(f"File {filename} is in use")
+        disks = [d.strip().upper() for d in disks]
+        for disk in disks:
+            if disk not in self.disks or self.disks[disk] == MEMORY_DISK:
+                raise ValueError(f"Not a disk for a partition: {disk}")
+        if bounds and len(bounds) != len(disks) - 1:
+            raise ValueError("A range partition needs one bound fewer than disks")
+
+        entry = self._acquire(filename)
+        try:
+            if entry['type'] not in ('DIRECT', 'SORT', 'INDEXED') or entry.get('memory'):
+                raise ValueError(f"Only keyed files on disk can be partitioned: {filename}")
+            if bounds and entry['metadata'].get('key_codec') == key_codec.TYPED:
+                bounds = convert(bounds)
+            bounds = sorted(self._skey(entry, b) for b in bounds) if bounds else None
+            self._flush_file(entry) # Pending changes go along
+            path, fmt = entry['path'], entry['format']
+            metadata = dict(entry['metadata'])
+            old_paths = entry['data'].paths if isinstance(entry['data'], ShardedStore) else []
+            metadata['partition'] = {'method': 'RANGE' if bounds else 'HASH', 'disks': disks}
+            if bounds:
+                metadata['partition']['bounds'] = bounds
+            shards = [{} for _ in disks]
+            for key, values in entry['data'].items():
+                shards[ShardedStore.shard_of_key(key, metadata['partition']['method'], bounds or [],
+                                                 len(disks))][key] = values
+            paths = self._shard_paths(path, metadata)
+            store = ShardedStore(shards, paths, [self.file_format] * len(disks),
+                                 metadata['partition']['method'], bounds)
+            store.dirty = set(range(len(disks)))
+            store.save(path, metadata, fmt)
+        finally:
+            self._release(entry)
+
+        stale = self._cached_entry(filename)
+        if stale is not None:
+            with _shared_lock:
+                _shared_files.pop(stale['key'], None) # Next OPEN loads the shards
+            self._close_file(stale)
+        for p in paths:
+            catalog.add(p)
+        for p in set(old_paths) - set(paths):
+            if catalog.exists(p):
+                os.remove(p)
+                catalog.discard(p)
+        return [len(s) for s in shards]
+
+    def open_list(self, channel, filename, records):
+        """Opens a read-only, memory-only SERIAL channel over a list of records,
+        or over a callable returning a fresh iterator of them (streamed)."""
+        if channel in self.channels:
+            self.close(channel)
         self.channels[channel] = {
-            'type': metadata['type'],
+            'type': 'SERIAL',
             'filename': filename,
-            'path': path, # Store the actual path
-            'data': records,
-            'metadata': metadata,
+            'data': StreamStore(records) if callable(records) else SerialStore(records),
+            'metadata': {"type": "SERIAL", "rec_len": 128, "key_len": None},
             'pos': 0,
-            'last_key': None # Track last accessed key for REMOVE without KEY
+            'last_key': None
         }
 
-    def close(self, channel):
-        if channel in self.channels:
+    def select(self, channel, pattern='*'):
+        """SELECT: lists the data files on all disks on a virtual SERIAL channel.
+
+        The list is produced as the channel is read, see select_files().
+        """
+        self.open_list(channel, f"_SELECT_{channel}", lambda: self.select_files(pattern))
+
+    def select_files(self, pattern='*'):
+        """Yields [name, disk, type, rec_len, key_len, records, size] for every
+        data file matching `pattern`, disk by disk (D0, D1, ..., then the
+        storage dir, whose disk is ""), by name within a disk.
+
+        Only the names of one directory are held at a time. The type, lengths
+        and record count come from the open file if it is open, else from a
+        cache kept per file version (mtime and size) filled from the metadata
+        (JSON files store their record count), so a file is read once, not on
+        every SELECT.
+        """
+        dirs = [(key, self.disks[key]) for key in sorted(self.disks)] + [('', self.storage_dir)]
+        seen = set()
+        for disk, directory in dirs:
+            real = _cache_key(directory)
+            if real in seen:
+                continue
+            seen.add(real)
+            if directory == MEMORY_DISK:
+                with _shared_lock:
+                    found = sorted((entry['path'], self._info_row(entry)) for entry in _shared_files.values()
+                                   if entry.get('memory'))
+                for path, info in found:
+                    name = os.path.basename(path)[:-5]
+                    if fnmatch.fnmatch(name, pattern):
+                        yield [name, disk] + info + [0]
+                continue
+            try:
+                with os.scandir(directory) as it:
+                    found = sorted((e for e in it if e.name.endswith('.json')
+                                    and fnmatch.fnmatch(e.name[:-5], pattern)), key=lambda e: e.name)
+            except OSError:
+                continue # Disk not mounted / not created yet
+            for e in found:
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue # Erased meanwhile
+                if not e.is_file():
+                    continue
+                yield [e.name[:-5], disk] + self._file_info(e.path, st) + [st.st_size]
+
+    def _file_info(self, path, st):
+        """[type, rec_len, key_len, records] of a data file."""
+        with _shared_lock:
+            entry = _shared_files.get(catalog.realpath(path))
+            if entry is not None: # Open or cached here: the live state, flushed or not
+                return self._info_row(entry)
+        return list(catalog.info(path, st, self._scan_info))
+
+    def _scan_info(self, path):
+        try:
+            metadata = storage_format.read_metadata(path)
+        except (ValueError, OSError, EOFError):
+            return ('', 0, 0, 0) # Not a data file
+        if isinstance(metadata, dict) and 'count' in metadata and not metadata.get('partition'):
+            # JSON files carry their record count: no need to parse the records
+            return (metadata.get('type') or '', metadata.get('rec_len') or 0,
+                    metadata.get('key_len') or 0, metadata['count'])
+        try:
+            entry = self._load_file(path, False)
+        except (ValueError, OSError, EOFError):
+            return ('', 0, 0, 0) # Not a data file
+        try:
+            return tuple(self._info_row(entry))
+        finally:
+            self._close_file(entry)
+
+    @staticmethod
+    def _info_row(entry):
+        metadata, data = entry['metadata'], entry['data']
+        if isinstance(data, SerialStore):
+            count = sum(1 for v in data.mem if v is not None) + data.disk_count - len(data.disk_removed)
+        else:
+            count = len(data)
+        return [metadata.get('type') or '', metadata.get('rec_len') or 0, metadata.get('key_len') or 0, count]
+
+    @staticmethod
+    def _flush_file(entry):
+        """Writes a cache entry back to disk, if anything changed."""
+        if not entry['dirty'] or entry.get('hold') or entry.get('memory'):
+            return # Unchanged, changes of an open transaction, or nowhere to write to
+        started, written = time.perf_counter(), storage_format.bytes_written
+        if entry['type'] == 'TEXT':
+            entry['handle'].flush() # Writes were positional; nothing to rewrite
+        elif isinstance(entry['data'], (SerialStore, PagedStore, ShardedStore)):
+            entry['data'].save(entry['path'], entry['metadata'], entry['format'])
+        else:
+            storage_format.dump(entry['path'], entry['metadata'], entry['data'], entry['format'])
+        entry['dirty'] = False
+        entry['writes'] = 0
+        if entry['key'] in _journal_pending:
+            _journal_checkpoint(entry['key'])
+        entry['flushed_at'] = time.monotonic()
+        stats = entry.get('stats')
+        if stats is not None:
+            stats['flushes'] += 1
+            stats['flush_time'] += time.perf_counter() - started
+            stats['bytes'] += storage_format.bytes_written - written
+
+    def _mark_dirty(self, chan):
+        """Records a real change to the file and applies the flush policy."""
+        chan['dirty'] = True
+        entry = chan.get('shared')
+        if entry is None:
+            return
+        entry['dirty'] = True
+        entry['writes'] += 1
+        entry['generation'] += 1 # Read buffers and read-ahead of all channels are stale
+        if self._flush_due(entry):
+            chan['dirty'] = False
+
+    def _flush_due(self, entry):
+        """Flushes an entry if the WRITES/INTERVAL policy says so; True if it did."""
+        if entry.get('hold'):
+            return False
+        if (self.flush_policy == 'WRITES' and entry['writes'] >= self.flush_writes) or \
+           (self.flush_policy == 'INTERVAL' and time.monotonic() - entry['flushed_at'] >= self.flush_interval):
+            self._flush_file(entry)
+            return True
+        return False
+
+    def _flush_overdue(self, chan):
+        """FLUSH=INTERVAL: any I/O on a channel (not just a write) writes back
+        changes to its file that have waited longer than the interval."""
+        entry = chan.get('shared')
+        if self.flush_policy == 'INTERVAL' and entry is not None and entry['dirty'] and self._flush_due(entry):
+            chan['dirty'] = False
+
+    def flush(self, channel=None):
+        """Writes back the file open on `channel`, or every changed file when None.
+
+        Files kept in memory after their last CLOSE (FLUSH=EXPLICIT) are
+        released from the cache once written.
+        """
+        if channel is not None:
+            if channel not in self.channels:
+                raise RuntimeError(f"Channel {channel} not open")
             chan = self.channels[channel]
-            path = chan.get('path') or self._get_path(chan['filename'])
-            
-            if chan['type'] == 'TEXT':
-                with open(path, 'w', encoding='latin-1') as f:
-                    f.write(chan['data'])
-                del self.channels[channel]
-                return
+            if chan.get('shared'):
+                self._flush_file(chan['shared'])
+            chan['dirty'] = False
+            return
+        _flush_all()
+        for chan in self.channels.values():
+            chan['dirty'] = False
+
+    def cache_stats(self):
+        """Page cache counters (hits, misses, evictions, spills) and usage."""
+        return record_store.page_cache.stats()
+
+    def is_open(self, filename):
+        """True if the file is open on any channel in this process."""
+        return self._cached_entry(filename, open_only=True) is not None
+
+    def _cached_entry(self, filename, open_only=False):
+        path = _cache_key(self._get_path(filename, search=True))
+        text_path = path[:-5] if path.endswith('.json') else path
+        with _shared_lock:
+            entry = _shared_files.get(path) or _shared_files.get(text_path)
+            if entry is not None and open_only and entry['refs'] == 0:
+                return None
+            return entry
+
+    def close(self, channel):
+        chan = self.channels.pop(channel, None)
+        if chan is None:
+            return
+        entry = chan.get('shared')
+        if entry is None:
+            return # Virtual channel (e.g. SELECT), nothing on disk
+
+        started = time.perf_counter()
+        self._unlock_record(channel, chan)
+        self._flush_overdue(chan) # Files still open on other channels
+        self._release(entry)
+        entry['stats']['close_time'] += time.perf_counter() - started
+
+    def _release(self, entry):
+        """Drops one reference to a cache entry; the last one flushes it."""
+        with _shared_lock:
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                return # Still open elsewhere; the last CLOSE flushes
+        self._retire(entry)
+
+    def _retire(self, entry):
+        """Drops an entry that no channel has open from the cache, flushing it."""
+        with _shared_lock:
+            if entry['refs'] > 0 or entry.get('hold'):
+                return # Open again, or part of a transaction (COMMIT/ROLLBACK retires it)
+            if self.flush_policy == 'EXPLICIT' and entry['dirty']:
+                return # Stays cached (and reusable by OPEN) until flush()
+            if _shared_files.get(entry['key']) is not entry or entry.get('memory'):
+                return # Already gone (ERASE), or lives until ERASE (memory disk)
+            del _shared_files[entry['key']]
+        self._flush_file(entry)
+        self._keep_indexes(entry)
+        self._close_file(entry)
+
+    @staticmethod
+    def _close_file(entry):
+        """Releases the OS handles of a cache entry that left the cache."""
+        if entry.get('handle'):
+            entry['handle'].close()
+        if isinstance(entry['data'], (SerialStore, PagedStore, ShardedStore)):
+            entry['data'].close()
+
+    # --- Record locking (EXTRACT) ---
+    # Locks live in the shared entry's lock table, so they are seen by every
+    # channel and session in the process. They do not reach other processes:
+    # each process writes back whole files from its own copy, so two
+    # processes writing one file lose each other's changes, locks or not.
+
+    def _try_lock(self, entry, key, owner):
+        with _shared_lock:
+            holder = entry['locks'].get(key)
+            if holder is not None:
+                return holder == owner
+            entry['locks'][key] = owner
+            return True
+
+    def _is_locked(self, entry, key, owner):
+        """True if the key is locked by anyone other than owner."""
+        with _shared_lock:
+            holder = entry['locks'].get(key)
+            # Our own transaction's locks don't count
+            return holder is not None and holder not in (owner, (owner[0], None))
+
+    def _check_record(self, channel, chan, key):
+        """Raises RecordBusyError if another channel holds a lock on key."""
+        entry = chan.get('shared')
+        if entry is None or key is None:
+            return
+        if self._is_locked(entry, str(key), (id(self), channel)):
+            raise RecordBusyError(f"ERR=0: Record busy: {key}")
+
+    def _lock_record(self, channel, chan, key, wait=None):
+        entry = chan['shared']
+        owner = (id(self), channel)
+        deadline = time.monotonic() + (self.lock_wait if wait is None else wait)
+        while not self._try_lock(entry, key, owner):
+            if time.monotonic() >= deadline:
+                raise RecordBusyError(f"ERR=0: Record busy: {key}")
+            time.sleep(0.05)
+        chan['locked_key'] = key
+
+    def _unlock_record(self, channel, chan):
+        """Releases the record lock held by this channel, if any."""
+        key = chan.pop('locked_key', None)
+        if key is not None:
+            self._unlock_key(chan['shared'], key, (id(self), channel))
 
-            file_content = {
-                "_metadata": chan['metadata'],
-                "records": chan['data']
-            }
-            with open(path, 'w') as f:
-                json.dump(file_content, f, indent=2)
-            del self.channels[channel]
+    def _unlock_key(self, entry, key, owner):
+        with _shared_lock:
+            if entry['locks'].get(key) == owner:
+                del entry['locks'][key]
 
     def write(self, channel, key=None, ind=None, values=None):
         if channel not in self.channels:
@@ -213,35 +831,36 @@ class FileManager:
         
         chan = self.channels[channel]
         data = chan['data']
-        # print(f"DEBUG: WRITE ch={channel} key={key} ind={ind}")
+        if (chan['type'] == 'INDEXED' and ind is not None) or (chan['type'] in ('DIRECT', 'SORT') and key is not None):
+            self.upsert(channel, key, ind, values)
+            return
+
+        self._check_record(channel, chan, self._record_key(chan, key, ind))
+        self._unlock_record(channel, chan) # Any I/O on the channel releases its lock
         
-        if chan['type'] == 'INDEXED' and ind is not None:
-            data[str(ind)] = values
-            chan['last_key'] = str(ind)
-        elif chan['type'] in ('DIRECT', 'SORT') and key is not None:
-            data[str(key)] = values
-            chan['last_key'] = str(key)
-        elif chan['type'] == 'SERIAL':
-            idx = str(len(data))
-            data[idx] = values
-            chan['last_key'] = idx
+        self._count(chan, 'writes')
+        if chan['type'] == 'SERIAL':
+            # Always appended: a new record never reuses a removed slot
+            chan['last_key'] = str(data.append(values))
+            self._txn_lock(chan, chan['last_key'])
+            self._txn_log(chan, 'PUT', chan['last_key'], None, values)
+            self._mark_dirty(chan)
         elif chan['type'] == 'TEXT':
             # values should be a string to write
-            # ind is valid. If None, use current pos?
             # "A WRITE RECORD directive simply writes ... starting at the current position or the position specified by the IND="
-            vals = str(values)
+            vals = str(values).encode('latin-1', 'replace')
             start = ind if ind is not None else chan.get('pos', 0)
+            entry = chan['shared']
+            f = entry['handle'] # Shared by all channels on the file
             
-            # Extend string if needed
-            current_len = len(data)
-            if start > current_len:
-                data += "\0" * (start - current_len)
-            
-            # Overwrite logic
-            # data is string. Strings are immutable in Python.
-            pre = data[:start]
-            post = data[start+len(vals):]
-            chan['data'] = pre + vals + post
+            # Writing past the end fills the gap with $00
+            if start > entry['size']:
+                f.seek(entry['size'])
+                f.write(b"\0" * (start - entry['size']))
+            f.seek(start)
+            f.write(vals)
+            entry['size'] = max(entry['size'], start + len(vals))
+            self._mark_dirty(chan) # Also invalidates the read buffers of every channel
             
             # Update position (usually after write)
             chan['pos'] = start + len(vals)
@@ -249,80 +868,261 @@ class FileManager:
         else:
             raise RuntimeError(f"Invalid write operation on {chan['type']} file")
 
-    def read(self, channel, key=None, ind=None, advance_pointer=True, update_ptr_on_error=True):
+    def upsert(self, channel, key=None, ind=None, values=None):
+        """Inserts or replaces a keyed record in one step. True if it was new."""
+        return self._put(channel, key, ind, values, replace=True)
+
+    def insert_if_absent(self, channel, key=None, ind=None, values=None):
+        """WRITE ... DOM=: stores the record only if its key is free.
+
+        Returns False, changing nothing, if the record exists. The check and
+        the write happen under the file's mutex, so of two sessions writing
+        the same new key exactly one succeeds.
+        """
+        return self._put(channel, key, ind, values, replace=False)
+
+    def _put(self, channel, key, ind, values, replace):
         if channel not in self.channels:
             raise RuntimeError(f"Channel {channel} not open")
-        
         chan = self.channels[channel]
+        if chan['type'] not in ('DIRECT', 'SORT', 'INDEXED') or (ind if chan['type'] == 'INDEXED' else key) is None:
+            raise RuntimeError(f"Invalid write operation on {chan['type']} file")
+        s_key = self._skey(chan, ind if chan['type'] == 'INDEXED' else key, write=True)
+        entry = chan['shared']
+        self._count(chan, 'writes')
+        with entry['mutex']:
+            self._check_record(channel, chan, s_key)
+            self._unlock_record(channel, chan) # Any I/O on the channel releases its lock
+            chan['last_key'] = s_key
+            old = self._get_record(entry, s_key)
+            if old is not None and not replace:
+                return False
+            if old != values:
+                self._txn_lock(chan, s_key)
+                if old is None:
+                    self._bloom_add(entry, s_key)
+                    if entry['index'] is not None:
+                        entry['index'].add(s_key)
+                chan['data'][s_key] = values
+                self._update_indexes(entry, s_key, old, values)
+                self._txn_log(chan, 'PUT', s_key, old, values)
+                self._mark_dirty(chan)
+        return old is None
+
+    def _skey(self, chan, key, write=False):
+        """The stored form of a record key (of a channel or shared entry).
+
+        Only writes check the key length: a longer key is simply not found.
+        """
+        metadata = chan['metadata']
+        if metadata.get('key_codec') == key_codec.TYPED:
+            return key_codec.encode(key, metadata.get('key_len') if write else None)
+        return str(key)
+
+    def _ukey(self, chan, key):
+        """A stored key as the program wrote it."""
+        if chan['metadata'].get('key_codec') == key_codec.TYPED:
+            return key_codec.decode(key)
+        return key
+
+    def _record_key(self, chan, key=None, ind=None):
+        """The record key a KEY=/IND= access targets (used for locking)."""
+        if chan.get('knum'):
+            return None # KEY= is an alternate key; the record is known after the read
+        if chan['type'] == 'INDEXED' and ind is not None:
+            return self._skey(chan, ind)
+        if chan['type'] in ('DIRECT', 'SORT') and key is not None:
+            return self._skey(chan, key)
+        if chan['type'] == 'SERIAL' and ind is not None:
+            return str(ind)
+        return None
+
+    def read(self, channel, key=None, ind=None, advance_pointer=True, update_ptr_on_error=True, knum=None):
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+
+        chan = self.channels[channel]
+        self._unlock_record(channel, chan)
+        self._set_knum(chan, knum)
+        self._check_record(channel, chan, self._record_key(chan, key, ind))
+        val = self._read(chan, key, ind, advance_pointer, update_ptr_on_error)
+        self._count(chan, 'reads')
+        self._count(chan, 'misses' if val is None else 'hits')
+        self._flush_overdue(chan)
+        if val is not None and chan.get('knum'):
+            self._check_record(channel, chan, chan['last_key'])
+        return val
+
+    def _set_knum(self, chan, knum):
+        """KNUM= selects the key chain (0 = primary key) for this and later accesses."""
+        if knum is None:
+            return
+        knum = int(knum)
+        if knum and knum > len(chan['metadata'].get('indexes', [])):
+            raise RuntimeError(f"Invalid KNUM={knum} for {chan['filename']}")
+        chan['knum'] = knum
+
+    def _read(self, chan, key=None, ind=None, advance_pointer=True, update_ptr_on_error=True):
         data = chan['data']
+        knum = chan.get('knum')
         
-        if chan['type'] == 'INDEXED' and ind is not None:
-            s_key = str(ind)
-            if s_key in data:
+        if knum and key is not None:
+            # KEY= on a secondary index: first record with that alternate key
+            index = self._secondary_index(chan['shared'], knum)
+            s_key = str(key)
+            i = index.bisect_left((s_key,))
+            if i < len(index) and index.keys[i][0] == s_key:
+                pair = index.keys[i]
+                chan['last_ikey'], chan['last_key'] = pair, pair[1]
+                return data.get(pair[1])
+            if update_ptr_on_error: chan['last_ikey'] = index.before((s_key,))
+            return None
+
+        elif (chan['type'] == 'INDEXED' and ind is not None) or (chan['type'] in ('DIRECT', 'SORT') and key is not None):
+            s_key = self._skey(chan, ind if chan['type'] == 'INDEXED' else key)
+            values = self._get_record(chan['shared'], s_key)
+            if values is not None:
                 chan['last_key'] = s_key
-                return data.get(s_key)
+                return values
             else:
                 if update_ptr_on_error: chan['last_key'] = s_key
                 return None
-                
-        elif chan['type'] in ('DIRECT', 'SORT') and key is not None:
-            s_key = str(key)
-            if s_key in data:
+
+        elif chan['type'] in ('DIRECT', 'SORT', 'INDEXED'):
+            # READ (ch) without KEY=/IND=: the next record in key order
+            # (of the secondary index selected with KNUM=, if any)
+            cursor = self._key_cursor(chan)
+            if advance_pointer:
+                item = cursor.next()
+            else:
+                key = cursor.peek()
+                item = None if key is None else (key, cursor.fetch(key))
+            if item is None:
+                return None # EOF
+            s_key = item[0][1] if knum else item[0]
+            if advance_pointer:
                 chan['last_key'] = s_key
-                return data.get(s_key)
+                if knum: chan['last_ikey'] = item[0]
             else:
-                if update_ptr_on_error: chan['last_key'] = s_key
-                return None
-                
-            if val is not None and advance_pointer:
-                chan['pos'] += 1
+                chan['peeked_key'] = s_key # EXTRACT locks it without moving
+            return item[1]
+
+        elif chan['type'] == 'SERIAL':
+            # Sequential READ continues after the last record read; the
+            # per-channel cursor lets the store stream on-disk records
+            cursor = chan.setdefault('cursor', {})
+            if ind is not None:
+                i = int(ind)
+                val = data.record(i, cursor)
+                if val is None:
+                    if update_ptr_on_error: chan['last_key'] = str(i)
+                    return None
+            else:
+                found = data.next_record(chan['pos'], cursor)
+                if found is None:
+                    return None # EOF
+                i, val = found
+            chan['last_key'] = str(i)
+            if advance_pointer:
+                chan['pos'] = i + 1
             return val
             
         elif chan['type'] == 'TEXT':
-             # TEXT file read
-             # Need start (ind) and length (siz)
-             # "The actual READ is terminated by an End of File... or SIZ... or separator"
-             # If SIZ is not provided, max string size.
-             # Logic is complex, handled partly here.
-             # Return raw string from position?
-             # Let's implement a direct 'read_chunk' logic or handle it via returned object?
-             # Interpreter calls read().
-             # interpreter.py expects read() to return a value.
-             # For READ (SERIAL/INDEXED), it returns a record (list/dict/string).
-             # For TEXT, we return a string Chunk?
-             # We need 'siz' parameter here or handle it in interpreter.
-             # The arguments to read() are key/ind.
-             # We should probably extend read() to accept 'siz' or handle slicing in interpreter if read() returns full tail?
-             # Returning full tail is inefficient.
-             # Let's rely on 'ind' being passed. If 'siz' is needed, maybe passed as key? Or a new arg?
-             # For now, let's return the whole string from 'ind' and let Interpreter slice/scan it?
-             # Or better: Add 'siz' arg to read().
-             start = ind if ind is not None else chan.get('pos', 0)
-             
-             # If siz not passed, we don't know how much to read.
-             # But existing read() signature doesn't have siz.
-             # Let's return the rest of the string for now, and let interpreter process it.
-             # Or we can update read signature later.
-             # Wait, I can access 'data' directly in interpreter if I need complex logic, 
-             # but better to abstract it.
-             # I'll return the string from start.
-             
-             # Interpreter logic for TEXT file will likely need to scan for delimiters.
-             # So giving subsequent string is appropriate.
-             if start >= len(data):
-                 return None # EOF
-             
-             res = data[start:]
-             # Note: pos update happens in interpreter based on consumption?
-             # TEXT file pos tracking is tricky if we scan.
-             # We'll leave pos update to caller or default to not advancing here implies caller manages it?
-             # For now, return remaining data.
-             return res
+            # Rest of the file from IND= (or the current position); use
+            # read_text() to read up to a terminator or SIZ= instead
+            start = ind if ind is not None else chan.get('pos', 0)
+            return self._text_read(chan, start, None, record=True)[0]
         
         return None
 
-    def extract(self, channel, key=None, ind=None):
-        return self.read(channel, key=key, ind=ind, advance_pointer=False)
+    def read_text(self, channel, ind=None, siz=None, record=False):
+        """READ / READ RECORD on a TEXT channel.
+
+        READ returns the data up to the next terminator (LF, CR or $8A; an
+        LF/CR pair counts as one) without it; READ RECORD returns up to SIZ=
+        characters, or the rest of the file. Reading starts at IND= or the
+        channel position, which advances past the data when IND= is not given.
+        Returns None at end of file.
+        """
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+        chan = self.channels[channel]
+        if chan['type'] != 'TEXT':
+            raise RuntimeError(f"Channel {channel} is not a TEXT file")
+
+        start = ind if ind is not None else chan.get('pos', 0)
+        val, consumed = self._text_read(chan, start, siz, record)
+        self._count(chan, 'reads')
+        self._count(chan, 'misses' if val is None else 'hits')
+        self._flush_overdue(chan)
+        if val is not None and ind is None:
+            chan['pos'] = start + consumed
+        return val
+
+    def _text_block(self, chan, offset):
+        """Bytes of the channel's read buffer from offset on, refilled as needed."""
+        entry = chan['shared']
+        buf = chan.get('rbuf')
+        at = chan.get('rbuf_at', 0)
+        if buf is None or chan.get('rbuf_gen') != entry['generation'] or not (at <= offset < at + len(buf)):
+            f = entry['handle']
+            f.seek(offset)
+            buf = f.read(TEXT_BLOCK)
+            chan['rbuf'], chan['rbuf_at'], chan['rbuf_gen'] = buf, offset, entry['generation']
+            at = offset
+        return buf[offset - at:]
+
+    def _text_read(self, chan, start, siz=None, record=False):
+        """Returns (string, bytes consumed), or (None, 0) at end of file."""
+        if start >= chan['shared']['size']:
+            return None, 0 # EOF
+
+        out = bytearray()
+        offset = start
+        while siz is None or len(out) < siz:
+            block = self._text_block(chan, offset)
+            if not block:
+                break
+            if siz is not None:
+                block = block[:siz - len(out)]
+            match = None if record else TEXT_TERMINATOR.search(block)
+            if match:
+                out += block[:match.start()]
+                stop = block[match.start()]
+                offset += match.end()
+                # "combination of one line feed and one carriage return"
+                pair = self._text_block(chan, offset)[:1]
+                if (stop, pair) in ((0x0A, b'\r'), (0x0D, b'\n')):
+                    offset += 1
+                break
+            out += block
+            offset += len(block)
+        return out.decode('latin-1'), offset - start
+
+    def extract(self, channel, key=None, ind=None, wait=None, knum=None):
+        """READ that also locks the record until the next I/O on the channel.
+
+        A record locked by another channel or session raises RecordBusyError
+        (ERR=0) once `wait` seconds (default: LOCKWAIT) have passed.
+        """
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+
+        chan = self.channels[channel]
+        self._unlock_record(channel, chan)
+        self._set_knum(chan, knum)
+        target = self._record_key(chan, key, ind)
+        if target is not None:
+            self._lock_record(channel, chan, target, wait)
+        val = self._read(chan, key, ind, advance_pointer=False)
+        self._count(chan, 'reads')
+        self._count(chan, 'misses' if val is None else 'hits')
+        self._flush_overdue(chan)
+        if target is None and chan.get('shared'):
+            target = chan.pop('peeked_key', None) or chan.get('last_key')
+            if target is not None:
+                self._lock_record(channel, chan, target, wait)
+        return val
 
     def remove(self, channel, key=None):
         if channel not in self.channels:
@@ -331,66 +1131,739 @@ class FileManager:
         chan = self.channels[channel]
         data = chan['data']
         target_key = None
+        self._check_record(channel, chan, self._skey(chan, key) if key is not None else chan.get('last_key'))
+        self._unlock_record(channel, chan)
+        self._count(chan, 'removes')
 
         if key is not None:
-            target_key = str(key)
+            target_key = self._skey(chan, key)
         else:
             if chan['last_key'] is None:
                 raise RuntimeError("No current record to remove")
             target_key = chan['last_key']
         
         if target_key in data:
+            self._txn_lock(chan, target_key)
+            old = data[target_key]
             del data[target_key]
+            if chan.get('shared') and chan['shared']['index'] is not None:
+                chan['shared']['index'].discard(target_key)
+            if chan.get('shared'):
+                self._update_indexes(chan['shared'], target_key, old, None)
+                self._txn_log(chan, 'DELETE', target_key, old, None)
+            self._mark_dirty(chan)
         else:
-            raise FileNotFoundError(f"Key {target_key} not found")
+            raise FileNotFoundError(f"Key {self._ukey(chan, target_key)} not found")
 
     def erase(self, filename):
+        if self.is_open(filename):
+            raise RuntimeError(f"File {filename} is in use")
+        entry = self._cached_entry(filename)
+        if entry is not None:
+            with _shared_lock:
+                _shared_files.pop(entry['key'], None) # Unflushed changes die with the file
+            self._close_file(entry)
+            _journal_checkpoint(entry['key'])
         path = self._get_path(filename, search=True)
-        if os.path.exists(path):
-            os.remove(path)
+        if path.startswith(MEMORY_DISK):
+            return # Dropping the entry was all there is to it
+        with _shared_lock:
+            _index_cache.pop(_cache_key(path), None)
+        shards = []
+        if catalog.exists(path):
+            try:
+                metadata = storage_format.read_metadata(path)
+            except (ValueError, OSError, EOFError):
+                metadata = {} # Not a data file (e.g. TEXT)
+            if isinstance(metadata, dict) and metadata.get('partition'):
+                shards = self._shard_paths(path, metadata)
+        for name in [path] + shards:
+            if catalog.exists(name): # discard() also drops SELECT's cached metadata
+                os.remove(name)
+                catalog.discard(name)
+
+    def build_sort(self, filename, source, field=0, pos=None, length=None, key_len=None,
+                   disk_num=None, chunk_size=extsort.CHUNK_SIZE):
+        """Builds (or replaces) SORT file `filename` from the records of `source`.
+
+        `source` is a data file name (typically a large SERIAL extract) or any
+        iterable of records; the key of each record is chosen as for
+        define_index(). The keys go through an external merge sort and are
+        written to the target in one streamed pass, so memory stays bounded by
+        `chunk_size` keys. Returns the number of distinct keys written.
+        """
+        if self.is_open(filename):
+            raise RuntimeError(f"File {filename} is in use")
+        definition = {'field': int(field)}
+        if pos: definition['pos'] = int(pos)
+        if length: definition['len'] = int(length)
+
+        entry = self._acquire(source) if isinstance(source, str) else None
+        try:
+            if entry is None:
+                records = source
+            elif isinstance(entry['data'], SerialStore):
+                records = (v for _, v in entry['data'].items()) # Streams BINARY files
+            else:
+                records = entry['data'].values()
+            keys = (self._sort_key(definition, v, key_len) for v in records if v is not None)
+
+            path = self._get_path(filename, search=True)
+            if not self._exists(path):
+                path = self._get_path(filename, disk_num=disk_num, search=False)
+            metadata = self._new_metadata("SORT", 0, key_len)
+            if path.startswith(MEMORY_DISK):
+                records = {k: [] for k in extsort.sorted_unique(keys, chunk_size)}
+                self._create_memory(path, metadata, records)
+                return len(records)
+            tmp_dir = os.path.dirname(path) # Runs next to the target, not in a small /tmp
+            count = storage_format.dump_items(
+                path, metadata, ((k, []) for k in extsort.sorted_unique(keys, chunk_size, tmp_dir)),
+                self.file_format)
+            catalog.add(path)
+        finally:
+            if entry is not None:
+                self._release(entry)
+
+        stale = self._cached_entry(filename)
+        if stale is not None:
+            with _shared_lock:
+                _shared_files.pop(stale['key'], None) # Next OPEN sees the new file
+            self._close_file(stale)
+        return count
+
+    @staticmethod
+    def _sort_key(definition, values, key_len):
+        """The stored (typed) key build_sort() writes for a record: a numeric
+        field stays a number, so the file sorts 2 before 10; a substring of
+        it is text."""
+        value = field_value(definition, values)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                'pos' not in definition and 'len' not in definition:
+            return key_codec.encode(value)
+        value = index_value(definition, values)
+        return key_codec.encode(value[:int(key_len)] if key_len else value)
+
+    # --- Bulk import/export (bulk_io.py) ---
+    # Rows are lists of fields: [key, value, ...] for DIRECT/SORT/INDEXED
+    # files (INDEXED: the record index), the record values for SERIAL files.
+
+    def import_rows(self, filename, rows, convert=list):
+        """Stores all rows in one pass and writes the file once, at release.
 
-    def get_next_key(self, channel):
+        `convert` turns the value fields of a row into the record values,
+        and for files with typed keys the key field into a key (CSV "10" is
+        the number 10, as WRITE KEY=10 stores it). Existing records with the
+        same key are replaced. Returns the count.
+
+        An import is not part of a transaction and cannot be rolled back, so
+        it is refused inside one, and while any record of the file is locked
+        (EXTRACT or another session's transaction).
+        """
+        if self.transaction is not None:
+            raise RuntimeError("Invalid bulk import inside a transaction")
+        entry = self._acquire(filename)
+        try:
+            data = entry['data']
+            typed = entry['metadata'].get('key_codec') == key_codec.TYPED
+            if entry['type'] == 'TEXT':
+                raise RuntimeError(f"Invalid bulk import on TEXT file {filename}")
+            with entry['mutex']:
+                if entry['locks'] or entry.get('hold'):
+                    raise RecordBusyError(f"ERR=0: File {filename} has locked records")
+                count = 0
+                if isinstance(data, SerialStore):
+                    for row in rows:
+                        data.append(convert(row))
+                        count += 1
+                else:
+                    for row in rows:
+                        key = self._skey(entry, convert(row[:1])[0] if typed else row[0], write=True)
+                        data[key] = convert(row[1:])
+                        self._bloom_add(entry, key)
+                        count += 1
+                    # Built indexes are rebuilt once instead of updated per record
+                    if entry['index'] is not None:
+                        entry['index'].reset(data.keys())
+                    for knum, index in entry['secondary'].items():
+                        definition = entry['metadata']['indexes'][knum - 1]
+                        index.reset((index_value(definition, v), k) for k, v in data.items())
+                if count:
+                    entry['dirty'] = True
+                    entry['generation'] += 1
+            return count
+        finally:
+            self._release(entry)
+
+    def export_rows(self, filename):
+        """Yields every record as a row, in key order (SERIAL: record order)."""
+        entry = self._acquire(filename)
+        try:
+            data = entry['data']
+            if entry['type'] == 'TEXT':
+                raise RuntimeError(f"Invalid bulk export on TEXT file {filename}")
+            if isinstance(data, SerialStore):
+                for _, values in data.items():
+                    yield list(values) if isinstance(values, list) else [values]
+                return
+            if entry['index'] is None:
+                entry['index'] = self._new_key_index(data)
+            for key in entry['index'].range():
+                values = data.get(key)
+                if values is not None: # Removed while exporting
+                    yield [self._ukey(entry, key)] + (values if isinstance(values, list) else [values])
+        finally:
+            self._release(entry)
+
+    def compact(self, filename, compress=_KEEP):
+        """Rewrites a data file without dead space; see compact_path().
+
+        A partitioned file is compacted shard by shard; the report adds up.
+        """
+        path = self._get_path(filename, search=True)
+        if not catalog.exists(path): # Memory files have no dead space to drop
+            raise FileNotFoundError(f"File not found: {filename}")
+        metadata = storage_format.read_metadata(path)
+        report = self.compact_path(path, compress)
+        if metadata.get('partition'):
+            for shard in self._shard_paths(path, metadata):
+                r = self.compact_path(shard, compress)
+                for k in ('records', 'old_size', 'new_size', 'old_load', 'new_load', 'seconds'):
+                    report[k] += r[k]
+        return report
+
+    def compact_path(self, path, compress=_KEEP):
+        """Streams a data file into a fresh copy and swaps it in atomically.
+
+        Overwritten and removed records and DELETE entries of BINARY files
+        are dropped and keyed records are written in key order, so paged key
+        scans read the file front to back. SERIAL record numbers are kept.
+        `compress` ('zlib', 'lzma' or None) changes the compression of the
+        record values on the way; it applies to BINARY files (JSON files
+        only record it). The file must not be open on any channel. Returns
+        a report with sizes, the time OPEN needs to load the file before
+        and after, and the total time taken.
+        """
+        if compress is not _KEEP:
+            storage_format.check_compression(compress)
+        started = time.monotonic()
+        key = catalog.realpath(path)
+        with _shared_lock:
+            entry = _shared_files.get(key)
+            if entry is not None and (entry['refs'] > 0 or entry.get('hold')):
+                raise RuntimeError(f"File {path} is in use")
+            if entry is not None:
+                del _shared_files[key] # Reloaded from the compacted file on the next OPEN
+        if entry is not None:
+            self._flush_file(entry)
+            self._close_file(entry)
+
+        old_size = os.path.getsize(path)
+        load_started = time.monotonic()
+        if storage_format.detect(path) == 'BINARY':
+            with open(path, 'rb') as f:
+                metadata = storage_format.read_header(f)
+            _set_compression(metadata, compress)
+            if metadata['type'] == 'SERIAL':
+                store = SerialStore.from_binary(path)
+                store.rewrite = True
+            else:
+                store = PagedStore.from_binary(path)
+            old_load = time.monotonic() - load_started
+            count = len(store)
+            try:
+                if metadata['type'] == 'SERIAL':
+                    store.save(path, metadata, 'BINARY')
+                else:
+                    storage_format.dump_items(path, metadata, ((k, store.get(k)) for k in sorted(store.offsets)), 'BINARY')
+            finally:
+                store.close()
+        else:
+            metadata, records, _ = storage_format.load(path)
+            old_load = time.monotonic() - load_started
+            _set_compression(metadata, compress)
+            if metadata.get('type') != 'SERIAL':
+                records = dict(sorted(records.items()))
+            count = len(records)
+            storage_format.dump(path, metadata, records, 'JSON')
+
+        load_started = time.monotonic()
+        self._close_file(self._load_file(path, False))
+        new_load = time.monotonic() - load_started
+        return {'path': path, 'records': count, 'old_size': old_size, 'new_size': os.path.getsize(path),
+                'old_load': old_load, 'new_load': new_load, 'seconds': time.monotonic() - started}
+
+    def get_next_key(self, channel, knum=None):
         if channel not in self.channels:
             raise RuntimeError(f"Channel {channel} not open") # Interpreted as ERR=13 usually
 
         chan = self.channels[channel]
+        self._set_knum(chan, knum)
         # Only valid for DIRECT / SORT / INDEXED? Docs say DIRECT or SORT.
         if chan['type'] not in ('DIRECT', 'SORT', 'INDEXED'):
             raise RuntimeError("Invalid file type for KEY function") 
+        self._count(chan, 'next_keys')
+        self._flush_overdue(chan)
 
-        data = chan['data']
-        if not data:
+        if not chan['data']:
             raise EOFError("File is empty") # ERR=2
 
-        keys = sorted(data.keys())
-        
-        last_key = chan.get('last_key')
-        
-        if last_key is None:
-            # If no record accessed yet, return first key?
-            return keys[0]
-        
-        # Binary search or simple index lookup
+        key = self._key_cursor(chan).peek()
+        if key is None:
+            raise EOFError("End of file")
+        return key[0] if chan.get('knum') else self._ukey(chan, key)
+
+    def seek(self, channel, key):
+        """Positions a keyed channel so the next READ (ch) / KEY(ch) gives the
+        first record whose key is >= key (partial keys work as a prefix)."""
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+        chan = self.channels[channel]
+        if chan['type'] not in ('DIRECT', 'SORT', 'INDEXED'):
+            raise RuntimeError("Invalid file type for KEY function")
+        chan['last_key'] = self._key_index(chan).before(self._skey(chan, key))
+
+    def scan(self, channel, start=None, end=None, prefix=None):
+        """Yields (key, values) in key order for start <= key < end, or for
+        all keys starting with prefix, using the sorted index: O(log n + k).
+        Does not move the channel's position."""
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+        chan = self.channels[channel]
+        if chan['type'] not in ('DIRECT', 'SORT', 'INDEXED'):
+            raise RuntimeError("Invalid file type for KEY function")
+        data = chan['data']
+        start = None if start is None else self._skey(chan, start)
+        end = None if end is None else self._skey(chan, end)
+        for key in self._key_index(chan).range(start, end, None if prefix is None else str(prefix)):
+            yield self._ukey(chan, key), data.get(key)
+
+    def _key_index(self, chan):
+        entry = chan['shared']
+        if entry['index'] is None:
+            # Built on the first ordered access, then kept up to date by WRITE/REMOVE
+            entry['index'] = self._new_key_index(entry['data'])
+        return entry['index']
+
+    def _new_key_index(self, data):
+        # Front-coded for large files (KEYINDEX=), a plain sorted list otherwise
+        if len(data) >= CompactKeyIndex.min_keys:
+            return CompactKeyIndex(data.keys())
+        return KeyIndex(data.keys())
+
+    def key_footprint(self, filename):
+        """Memory held by the key set of a keyed file: {'keys', 'index',
+        'index_bytes', 'directory', 'directory_bytes', 'plain_bytes'}.
+
+        index is the sorted key index (built if needed), directory what the
+        record store keeps per key. plain_bytes is what a sorted list of the
+        full key strings would take on its own, for comparison.
+        """
+        entry = self._acquire(filename)
         try:
-             # Find current position
-            if last_key in keys:
-                idx = keys.index(last_key)
-                if idx + 1 < len(keys):
-                    return keys[idx + 1]
+            if entry['type'] not in ('DIRECT', 'SORT', 'INDEXED'):
+                raise RuntimeError(f"Invalid key footprint on {entry['type']} file {filename}")
+            with entry['mutex']:
+                if entry['index'] is None:
+                    entry['index'] = self._new_key_index(entry['data'])
+                index = entry['index']
+                directory, directory_bytes = record_store.key_footprint(entry['data'])
+                plain = sys.getsizeof([None] * len(index)) + sum(sys.getsizeof(k) for k in index.range())
+                return {'keys': len(index),
+                        'index': 'compact' if isinstance(index, CompactKeyIndex) else 'list',
+                        'index_bytes': index.footprint(),
+                        'directory': directory, 'directory_bytes': directory_bytes,
+                        'plain_bytes': plain}
+        finally:
+            self._release(entry)
+
+    def _key_cursor(self, chan):
+        """The channel's cursor in key order, positioned after last_key."""
+        entry = chan['shared']
+        knum = chan.get('knum', 0)
+        cursors = chan.setdefault('key_cursors', {}) # One per key chain
+        cursor = cursors.get(knum)
+        if cursor is None:
+            data = chan['data']
+            if knum:
+                cursor = KeyCursor(self._secondary_index(entry, knum), lambda pair: data.get(pair[1]), self.read_ahead)
+            else:
+                cursor = KeyCursor(self._key_index(chan), data.get, self.read_ahead)
+            cursors[knum] = cursor
+        # A KEY= access or a write anywhere repositions / refreshes the cursor
+        cursor.sync(chan.get('last_ikey') if knum else chan.get('last_key'), entry['generation'])
+        return cursor
+
+    # --- Transactions (BEGIN / COMMIT / ROLLBACK) ---
+    # Changes are applied to the shared stores right away (so every channel
+    # reads them) but the files they touch are held: no flush policy writes
+    # them until COMMIT, which makes the whole group durable with a single
+    # journal append and fsync. ROLLBACK undoes the changes in memory.
+    # TEXT files are not transactional.
+
+    def begin(self):
+        if self.transaction is not None:
+            raise RuntimeError("Transaction already active")
+        self.transaction = {'log': [], 'entries': {}, 'locks': set()}
+
+    def _txn_join(self, txn, entry):
+        if id(entry) not in txn['entries']:
+            txn['entries'][id(entry)] = entry
+            entry['hold'] = entry.get('hold', 0) + 1
+            if isinstance(entry['data'], (PagedStore, ShardedStore)):
+                entry['data'].hold += 1
+
+    def _txn_lock(self, chan, key):
+        """Locks a record the transaction changes until COMMIT/ROLLBACK.
+
+        Other channels and sessions get ERR=0 on it, so they never read an
+        uncommitted value and ROLLBACK never undoes a change of theirs.
+        """
+        txn = self.transaction
+        entry = chan.get('shared')
+        if txn is None or entry is None or (id(entry), key) in txn['locks']:
+            return
+        self._txn_join(txn, entry)
+        if not self._try_lock(entry, key, (id(self), None)):
+            raise RecordBusyError(f"ERR=0: Record busy: {key}")
+        txn['locks'].add((id(entry), key))
+
+    def _txn_log(self, chan, op, key, old, values):
+        txn = self.transaction
+        entry = chan.get('shared')
+        if txn is None or entry is None:
+            return
+        self._txn_join(txn, entry)
+        txn['log'].append((entry, op, key, old, values))
+
+    def commit(self):
+        """Makes the transaction's changes durable: one journal append, one fsync."""
+        txn = self.transaction
+        if txn is None:
+            raise RuntimeError("No active transaction")
+        # Memory files are not journalled: they would not survive a crash anyway
+        ops = [(entry['path'], op, key, values) for entry, op, key, old, values in txn['log']
+               if not entry.get('memory')]
+        if ops:
+            payload = marshal.dumps(ops)
+            with _journal_lock:
+                path = _journal_path[0] or os.path.join(self.storage_dir, f"journal.{os.getpid()}.log")
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                with open(path, 'ab') as f:
+                    f.write(JOURNAL_GROUP.pack(len(payload), zlib.crc32(payload)) + payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                _journal_path[0] = path
+                _journal_groups.append(ops)
+                _journal_pending.update((entry['key'], entry['path']) for entry in txn['entries'].values()
+                                        if not entry.get('memory'))
+        self.transaction = None
+        self._end_transaction(txn)
+
+    def rollback(self):
+        """Undoes the transaction's changes."""
+        txn = self.transaction
+        if txn is None:
+            raise RuntimeError("No active transaction")
+        for entry, op, key, old, values in reversed(txn['log']):
+            data = entry['data']
+            if isinstance(data, SerialStore):
+                if op == 'PUT':
+                    data.remove(int(key)) # Leaves an empty slot, like REMOVE
                 else:
-                    raise EOFError("End of file")
+                    data.restore(int(key), old)
             else:
-                # Last key might have been deleted or we jumped to a key that doesn't exist?
-                # If last_key not in keys (e.g. random READ with non-existent key?), 
-                # we should probably look for the next key *after* the value of last_key
-                # even if last_key itself isn't there.
-                # Let's fallback to finding insertion point.
-                import bisect
-                idx = bisect.bisect_right(keys, last_key)
-                if idx < len(keys):
-                    return keys[idx]
+                if old is None:
+                    del data[key]
+                    if entry['index'] is not None:
+                        entry['index'].discard(key)
                 else:
-                    raise EOFError("End of file")
-                    
-        except ValueError:
-            raise EOFError("End of file")
+                    data[key] = old
+                    if op == 'DELETE' and entry['index'] is not None:
+                        entry['index'].add(key)
+                self._update_indexes(entry, key, values, old)
+            entry['generation'] += 1 # Read-ahead of every channel is stale
+        self.transaction = None
+        self._end_transaction(txn)
+
+    def _end_transaction(self, txn):
+        for entry_id, key in txn['locks']:
+            self._unlock_key(txn['entries'][entry_id], key, (id(self), None))
+        for entry in txn['entries'].values():
+            entry['hold'] -= 1
+            if isinstance(entry['data'], (PagedStore, ShardedStore)):
+                entry['data'].hold -= 1
+            if entry['dirty']:
+                self._flush_due(entry) # Catch up on flushes held back by the transaction
+            self._retire(entry) # If it was closed during the transaction
+
+    def _recover_journals(self):
+        """Replays the committed groups of journals left by dead processes."""
+        with _journal_lock:
+            storage_dir = os.path.abspath(self.storage_dir)
+            if storage_dir in _recovered_dirs or not os.path.isdir(storage_dir):
+                return
+            _recovered_dirs.add(storage_dir)
+        for name in sorted(os.listdir(self.storage_dir)):
+            m = JOURNAL_NAME.match(name)
+            if not m or int(m.group(1)) == os.getpid():
+                continue
+            try:
+                os.kill(int(m.group(1)), 0)
+                continue # Still running: its journal is live
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue # Exists, but not ours to signal
+            path = os.path.join(self.storage_dir, name)
+            groups = self._replay_journal(path)
+            os.remove(path)
+            if groups:
+                print(f"Recovered {groups} committed transaction(s) from {path}")
+
+    def _replay_journal(self, path):
+        entries = {}
+        groups = 0
+        try:
+            with open(path, 'rb') as f:
+                while True:
+                    head = f.read(JOURNAL_GROUP.size)
+                    if len(head) < JOURNAL_GROUP.size:
+                        break
+                    length, crc = JOURNAL_GROUP.unpack(head)
+                    payload = f.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        break # Torn last group: that COMMIT never completed
+                    for fpath, op, key, values in marshal.loads(payload):
+                        if fpath not in entries:
+                            if not os.path.exists(fpath):
+                                continue # Erased since
+                            entries[fpath] = self._acquire_path(fpath)
+                        entry = entries[fpath]
+                        data = entry['data']
+                        # The journal only holds ops of files not flushed since,
+                        # and ops are absolute (SERIAL ops name their slot)
+                        if isinstance(data, SerialStore):
+                            i = int(key)
+                            if op == 'PUT' and i >= len(data):
+                                data.restore(i, values)
+                            elif op == 'DELETE' and key in data:
+                                data.remove(i)
+                        elif op == 'PUT':
+                            data[key] = values
+                        elif key in data:
+                            del data[key]
+                        entry['dirty'] = True
+                    groups += 1
+        finally:
+            for entry in entries.values():
+                self._flush_file(entry)
+                self._release(entry)
+        return groups
+
+    # --- Secondary indexes (KNUM=) ---
+    # Definitions live in the file metadata ('indexes', KNUM 1, 2, ...); the
+    # indexes themselves are built on first use and kept current by WRITE/REMOVE.
+
+    def define_index(self, filename, field=0, pos=None, length=None, sdx=False):
+        """Adds a secondary index to a DIRECT/SORT/INDEXED file; returns its KNUM.
+
+        The alternate key is record field `field` (0-based), optionally the
+        `length` characters from position `pos` (1-based) within it. An `sdx`
+        index keys on the Soundex code of that value instead (find_similar).
+        """
+        entry = self._acquire(filename)
+        try:
+            if entry['type'] not in ('DIRECT', 'SORT', 'INDEXED'):
+                raise RuntimeError(f"Secondary indexes need a keyed file: {filename}")
+            definition = {'field': int(field)}
+            if pos: definition['pos'] = int(pos)
+            if length: definition['len'] = int(length)
+            if sdx: definition['sdx'] = True
+            indexes = entry['metadata'].setdefault('indexes', [])
+            if definition not in indexes:
+                indexes.append(definition)
+                entry['dirty'] = True # Metadata change; saved with the file
+            return indexes.index(definition) + 1
+        finally:
+            self._release(entry)
+
+    def lookup(self, channel, knum, value, prefix=False):
+        """Primary keys of the records whose alternate key (KNUM) equals value,
+        or starts with it: O(log n + k). Does not move the channel."""
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+        chan = self.channels[channel]
+        if not 0 < int(knum) <= len(chan['metadata'].get('indexes', [])):
+            raise RuntimeError(f"Invalid KNUM={knum} for {chan['filename']}")
+        index = self._secondary_index(chan['shared'], int(knum))
+        value = str(value)
+        found = []
+        for ikey, pkey in index.range(start=(value,)):
+            if not (ikey.startswith(value) if prefix else ikey == value):
+                break
+            found.append(self._ukey(chan, pkey))
+        return found
+
+    def find_similar(self, channel, name, knum=None):
+        """Primary keys of records whose name sounds like `name`: one probe of
+        an SDX index (the first one, unless knum is given). The index is built
+        once and kept across OPENs like any KNUM index (_keep_indexes)."""
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+        if knum is None:
+            indexes = self.channels[channel]['metadata'].get('indexes', [])
+            knum = next((n for n, d in enumerate(indexes, 1) if d.get('sdx')), None)
+            if knum is None:
+                raise RuntimeError(f"No SDX index on {self.channels[channel]['filename']}")
+        return self.lookup(channel, knum, soundex(name))
+
+    # --- Bloom filters ---
+    # Every keyed file gets one when it is loaded by OPEN; WRITE adds to it,
+    # so lookups of keys that do not exist (READ KEY= ... DOM=, the DOM=
+    # check of WRITE) mostly return without asking the record store.
+
+    def _bloom(self, entry):
+        bloom = entry.get('bloom')
+        if bloom is None:
+            bloom = entry['bloom'] = BloomFilter.from_keys(entry['data'].keys(), len(entry['data']))
+        return bloom
+
+    def _bloom_add(self, entry, key):
+        bloom = self._bloom(entry)
+        if bloom.full():
+            # Rebuilt larger from the live keys; also forgets removed keys
+            old = bloom
+            bloom = entry['bloom'] = BloomFilter.from_keys(entry['data'].keys(), len(entry['data']))
+            bloom.checks, bloom.negatives, bloom.false_positives = old.checks, old.negatives, old.false_positives
+        bloom.add(key)
+
+    def _get_record(self, entry, key):
+        """Values of a keyed record, or None if it does not exist."""
+        bloom = self._bloom(entry)
+        if not bloom.might_contain(key):
+            return None
+        values = entry['data'].get(key)
+        if values is None:
+            bloom.false_positives += 1
+        return values
+
+    def bloom_stats(self, channel):
+        """Bloom filter counters of the keyed file on `channel`, including the
+        observed false-positive rate (fp_rate) and the expected one."""
+        if channel not in self.channels:
+            raise RuntimeError(f"Channel {channel} not open")
+        chan = self.channels[channel]
+        if chan['type'] not in ('DIRECT', 'SORT', 'INDEXED'):
+            raise RuntimeError(f"No Bloom filter on {chan['type']} file")
+        return self._bloom(chan['shared']).stats()
+
+    def _secondary_index(self, entry, knum):
+        index = entry['secondary'].get(knum)
+        if index is None:
+            definition = entry['metadata']['indexes'][knum - 1]
+            index = entry['secondary'][knum] = KeyIndex(
+                (index_value(definition, v), k) for k, v in entry['data'].items())
+        return index
+
+    @staticmethod
+    def _file_stamp(entry):
+        if entry.get('memory') or entry['metadata'].get('partition'):
+            return None # Memory files stay cached; shards change behind the root file
+        try:
+            st = os.stat(entry['path'])
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _keep_indexes(self, entry):
+        """Remembers the built secondary indexes of a file leaving the cache."""
+        if not entry['secondary']:
+            return
+        stamp = self._file_stamp(entry)
+        if stamp is None:
+            return
+        indexes = entry['metadata']['indexes']
+        with _shared_lock:
+            _index_cache.pop(entry['key'], None)
+            while len(_index_cache) >= INDEX_CACHE_FILES:
+                del _index_cache[next(iter(_index_cache))]
+            _index_cache[entry['key']] = (stamp, [(indexes[knum - 1], index)
+                                                  for knum, index in entry['secondary'].items()])
+
+    def _reuse_indexes(self, entry):
+        """Takes back the indexes _keep_indexes() saved, if the file is unchanged."""
+        with _shared_lock:
+            cached = _index_cache.pop(entry['key'], None)
+        if cached is None or cached[0] != self._file_stamp(entry):
+            return
+        indexes = entry['metadata'].get('indexes', [])
+        for definition, index in cached[1]:
+            if definition in indexes:
+                entry['secondary'][indexes.index(definition) + 1] = index
+
+    def _update_indexes(self, entry, key, old, new):
+        """Moves a record's entries in the built secondary indexes."""
+        for knum, index in entry['secondary'].items():
+            definition = entry['metadata']['indexes'][knum - 1]
+            if old is not None:
+                index.discard((index_value(definition, old), key))
+            if new is not None:
+                index.add((index_value(definition, new), key))
+
+
+def _cache_key(path):
+    """Key of a file in _shared_files: its resolved path (memory files: as is)."""
+    return path if path.startswith(MEMORY_DISK) else catalog.realpath(path)
+
+def _set_compression(metadata, compress):
+    if compress is _KEEP:
+        return
+    if compress:
+        metadata['compress'] = compress
+    else:
+        metadata.pop('compress', None)
+
+def _flush_all():
+    """Writes back every changed file in the process-wide cache."""
+    with _shared_lock:
+        entries = list(_shared_files.values())
+    for entry in entries:
+        with _shared_lock:
+            if entry['dirty']:
+                FileManager._flush_file(entry)
+            if entry['refs'] == 0 and not entry.get('hold') and not entry.get('memory'):
+                _shared_files.pop(entry['key'], None)
+                FileManager._close_file(entry)
+
+def _journal_checkpoint(key):
+    """A file with committed changes was flushed: drops its ops from the
+    journal, and the journal itself once no ops are left.
+
+    The journal is rewritten right after the data file, so a crash in
+    between replays those ops once more over the flushed file.
+    """
+    with _journal_lock:
+        if key not in _journal_pending:
+            return
+        path = _journal_pending.pop(key)
+        _journal_groups[:] = [g for g in ([op for op in ops if op[0] != path] for ops in _journal_groups) if g]
+        journal = _journal_path[0]
+        if not journal:
+            return
+        try:
+            if not _journal_groups:
+                os.remove(journal)
+                return
+            with open(journal + '.tmp', 'wb') as f:
+                for ops in _journal_groups:
+                    payload = marshal.dumps(ops)
+                    f.write(JOURNAL_GROUP.pack(len(payload), zlib.crc32(payload)) + payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(journal + '.tmp', journal)
+        except OSError:
+            pass
+
+# FLUSH=EXPLICIT keeps changes in memory; never lose them on interpreter exit
+atexit.register(_flush_all)
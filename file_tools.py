@@ -0,0 +1,245 @@
+"""Maintenance tools for BASIC data files.
+
+Usage:
+    python3 file_tools.py convert [--to BINARY|JSON] [directory ...]
+    python3 file_tools.py index NAME --field N [--pos P --len L] [--sdx]
+    python3 file_tools.py sort TARGET SOURCE [--field N --pos P --len L] [--key-len K]
+    python3 file_tools.py compact [NAME ...] [--compress zlib|lzma|none]
+    python3 file_tools.py compress-bench [NAME] [--records N --reads N]
+    python3 file_tools.py partition NAME --disks D0,D1,.. [--bounds KEY,..]
+    python3 file_tools.py keys NAME [NAME ...]
+    python3 file_tools.py import NAME SOURCE [--format CSV|JSONL|FIXED:w,w,..]
+    python3 file_tools.py export NAME DEST [--format CSV|JSONL|FIXED:w,w,..]
+
+Without directories, every disk from IPLINPUT plus basic_storage is processed.
+"""
+import argparse
+import marshal
+import os
+import random
+import sys
+import tempfile
+import time
+
+import bulk_io
+import extsort
+import storage_format
+from file_manager import FileManager
+from record_store import PagedStore, SerialStore
+
+
+def storage_dirs(fm):
+    """All directories that hold data files, in disk order."""
+    dirs = [fm.disks[k] for k in sorted(fm.disks)] + [fm.storage_dir]
+    return [d for i, d in enumerate(dirs) if d not in dirs[:i] and os.path.isdir(d)]
+
+
+def cmd_convert(args):
+    dirs = args.directories or storage_dirs(FileManager())
+    total_old = total_new = 0
+    for directory in dirs:
+        for name, old_size, new_size in storage_format.convert_directory(directory, args.to):
+            print(f"{os.path.join(directory, name)}: {old_size} -> {new_size} bytes")
+            total_old += old_size
+            total_new += new_size
+    print(f"Total: {total_old} -> {total_new} bytes")
+
+
+def _mb(n):
+    return f"{n / 1024 ** 2:.1f} MB"
+
+
+def cmd_compact(args):
+    fm = FileManager()
+    targets = args.names or [os.path.join(d, n) for d in storage_dirs(fm) for n in sorted(os.listdir(d))
+                             if n.endswith('.json')]
+    total_old = total_new = 0
+    options = {} if args.compress is None else {'compress': None if args.compress == 'none' else args.compress}
+    for target in targets:
+        try:
+            r = fm.compact(target, **options) if args.names else fm.compact_path(target, **options)
+        except (ValueError, OSError, EOFError, RuntimeError) as e:
+            print(f"Warning: skipping {target}: {e}")
+            continue
+        print(f"{r['path']}: {r['old_size']} -> {r['new_size']} bytes, open {r['old_load']:.3f}s -> "
+              f"{r['new_load']:.3f}s, {r['records']} records ({r['seconds']:.2f}s)")
+        total_old += r['old_size']
+        total_new += r['new_size']
+    print(f"Total: {total_old} -> {total_new} bytes")
+
+
+SAMPLE_WORDS = ('cursus', 'module', 'docent', 'examen', 'lesgroep', 'studiejaar', 'lidnummer', 'verslag',
+                'controle', 'opmerking', 'planning', 'lokaal', 'periode', 'resultaat', 'aanwezigheid', 'inschrijving')
+
+
+def _sample_records(n):
+    """Keyed records with a text blob each, like course descriptions."""
+    rnd = random.Random(1)
+    return {f"C{i % 40:03d}Y{2015 + i % 10}M{i:06d}":
+            [f"Cursus {i}", ' '.join(rnd.choice(SAMPLE_WORDS) for _ in range(rnd.randint(20, 150)))]
+            for i in range(n)}
+
+
+def _bench(directory, metadata, records, compress, reads):
+    path = os.path.join(directory, f"bench_{compress or 'none'}.json")
+    metadata = {k: v for k, v in metadata.items() if k not in ('compress', 'partition', 'indexes')}
+    if compress:
+        metadata['compress'] = compress
+    start = time.perf_counter()
+    storage_format.dump(path, metadata, records, 'BINARY')
+    written = time.perf_counter() - start
+    serial = metadata.get('type') == 'SERIAL'
+    keys = list(records)
+    sample = random.Random(2).sample(keys, min(reads, len(keys)))
+    store = SerialStore.from_binary(path) if serial else PagedStore.from_binary(path)
+    try:
+        start = time.perf_counter()
+        for _ in store.items():
+            pass
+        scanned = time.perf_counter() - start
+        start = time.perf_counter()
+        for key in sample:
+            store.record(int(key)) if serial else store.get(key)
+        looked_up = time.perf_counter() - start
+    finally:
+        store.close()
+    return os.path.getsize(path), written, scanned, looked_up, len(sample)
+
+
+def cmd_compress_bench(args):
+    if args.name:
+        fm = FileManager()
+        found = next(iter(fm.select_files(args.name)), None)
+        if found is None:
+            sys.exit(f"File not found: {args.name}")
+        path = os.path.join(fm.disks.get(found[1], fm.storage_dir), args.name + '.json')
+        metadata, records, _ = storage_format.load(path)
+    else:
+        metadata, records = {'type': 'DIRECT', 'rec_len': 0, 'key_len': 20}, _sample_records(args.records)
+    payload = sum(len(marshal.dumps(v)) for v in records.values()) / 1024 ** 2
+    print(f"{args.name or 'sample'}: {len(records)} records, {payload:.1f} MB of values")
+    print(f"{'compress':<9}{'size':>10}{'ratio':>7}{'write':>9}{'scan MB/s':>11}{'scan rec/s':>12}{'random/s':>10}")
+    with tempfile.TemporaryDirectory(dir=args.tmp) as directory:
+        base = None
+        for compress in (None,) + storage_format.COMPRESSION:
+            try:
+                storage_format.check_compression(compress)
+            except ValueError as e:
+                print(f"{compress:<9}{e}")
+                continue
+            size, written, scanned, looked_up, n = _bench(directory, metadata, records, compress, args.reads)
+            base = base or size
+            print(f"{compress or 'none':<9}{_mb(size):>10}{size / base:>7.2f}{written:>8.2f}s"
+                  f"{payload / scanned:>11.1f}{len(records) / scanned:>12.0f}{n / looked_up:>10.0f}")
+
+
+def cmd_index(args):
+    fm = FileManager()
+    knum = fm.define_index(args.name, args.field, args.pos, args.len, args.sdx)
+    fm.flush()
+    print(f"{args.name}: KNUM={knum}")
+
+
+def cmd_sort(args):
+    start = time.monotonic()
+    count = FileManager().build_sort(args.target, args.source, args.field, args.pos, args.len,
+                                     args.key_len, chunk_size=args.chunk)
+    print(f"{args.target}: {count} keys in {time.monotonic() - start:.1f}s")
+
+
+def cmd_partition(args):
+    start = time.monotonic()
+    bounds = args.bounds.split(',') if args.bounds else None
+    counts = FileManager().partition(args.name, args.disks.split(','), bounds, bulk_io.parse_values)
+    shards = ', '.join(f"{d}: {n}" for d, n in zip(args.disks.upper().split(','), counts))
+    print(f"{args.name}: {sum(counts)} records over {shards} ({time.monotonic() - start:.1f}s)")
+
+
+def cmd_keys(args):
+    fm = FileManager()
+    for name in args.names:
+        r = fm.key_footprint(name)
+        print(f"{name}: {r['keys']} keys, index ({r['index']}) {_mb(r['index_bytes'])}, "
+              f"directory ({r['directory']}) {_mb(r['directory_bytes'])}; "
+              f"as full strings {_mb(r['plain_bytes'])}")
+
+
+def _progress(records, seconds):
+    print(f"\r{records} records ({records / seconds if seconds else 0:.0f}/s)", end='', flush=True)
+
+
+def cmd_import(args):
+    stats = bulk_io.import_file(FileManager(), args.name, args.source, args.format, _progress)
+    print(f"\r{args.name}: {stats['records']} records imported in {stats['seconds']:.1f}s ({stats['rate']:.0f}/s)")
+
+
+def cmd_export(args):
+    stats = bulk_io.export_file(FileManager(), args.name, args.dest, args.format, _progress)
+    print(f"\r{args.name}: {stats['records']} records exported in {stats['seconds']:.1f}s ({stats['rate']:.0f}/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintenance tools for BASIC data files")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('convert', help="Convert data files between JSON and BINARY format")
+    p.add_argument('--to', default='BINARY', type=str.upper, choices=storage_format.FORMATS)
+    p.add_argument('directories', nargs='*')
+    p.set_defaults(func=cmd_convert)
+
+    p = sub.add_parser('compact', help="Rewrite data files without dead space (files must not be open)")
+    p.add_argument('names', nargs='*', help="file names; default: every data file on every disk")
+    p.add_argument('--compress', type=str.lower, choices=storage_format.COMPRESSION + ('none',),
+                   help="change the compression of the record values (BINARY files)")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser('compress-bench', help="Compare file size and read speed without and with compression")
+    p.add_argument('name', nargs='?', help="data file to copy; default: generated sample records")
+    p.add_argument('--records', type=int, default=100000, help="number of sample records")
+    p.add_argument('--reads', type=int, default=10000, help="random reads per run")
+    p.add_argument('--tmp', help="directory for the copies (default: the system temp dir)")
+    p.set_defaults(func=cmd_compress_bench)
+
+    p = sub.add_parser('index', help="Add a secondary index (READ ... KNUM=n) to a keyed file")
+    p.add_argument('name')
+    p.add_argument('--field', type=int, default=0, help="record field, 0-based")
+    p.add_argument('--pos', type=int, help="start of the key within the field, 1-based")
+    p.add_argument('--len', type=int, help="key length")
+    p.add_argument('--sdx', action='store_true', help="index the Soundex code (similar-sounding names)")
+    p.set_defaults(func=cmd_index)
+
+    p = sub.add_parser('sort', help="Build a SORT file from the records of another file (external merge sort)")
+    p.add_argument('target')
+    p.add_argument('source')
+    p.add_argument('--field', type=int, default=0, help="record field holding the key, 0-based")
+    p.add_argument('--pos', type=int, help="start of the key within the field, 1-based")
+    p.add_argument('--len', type=int, help="key length within the field")
+    p.add_argument('--key-len', type=int, help="key_len of the SORT file (longer keys are cut)")
+    p.add_argument('--chunk', type=int, default=extsort.CHUNK_SIZE, help="keys sorted in memory per run")
+    p.set_defaults(func=cmd_sort)
+
+    p = sub.add_parser('partition', help="Spread a keyed file over several disks (file must not be open)")
+    p.add_argument('name')
+    p.add_argument('--disks', required=True, help="disks of the shards, e.g. D0,D1,D2")
+    p.add_argument('--bounds', help="range partition: keys below the 1st bound on the 1st disk, ...; "
+                                    "default: by key hash")
+    p.set_defaults(func=cmd_partition)
+
+    p = sub.add_parser('keys', help="Report the memory taken by the key set of keyed files")
+    p.add_argument('names', nargs='+')
+    p.set_defaults(func=cmd_keys)
+
+    for name, target, help_text in (('import', 'source', "Load a CSV/JSONL/fixed-width file into a data file"),
+                                    ('export', 'dest', "Write a data file as CSV/JSONL/fixed-width")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('name')
+        p.add_argument(target)
+        p.add_argument('--format', default='CSV', help="CSV, JSONL or FIXED:w,w,... (column widths)")
+        p.set_defaults(func=cmd_import if name == 'import' else cmd_export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
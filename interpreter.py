@@ -8,8 +8,10 @@ import subprocess
 from datetime import datetime
 
 
+import bulk_io
 from file_manager import FileManager
 from lexer import Lexer, Token
+from soundex import soundex
 
 class ExecutionFinished(Exception): pass
 class EscapeInterruption(Exception): pass
@@ -70,10 +72,23 @@ class ThoroughbredBasicInterpreter:
         self.escape_return_idx = None
 
         # Reset files
+        if self.file_manager.transaction is not None:
+            try: self.file_manager.rollback() # Left open by an aborted run
+            except: pass
         for chn in list(self.file_manager.channels.keys()):
             try: self.file_manager.close(chn)
             except: pass
 
+    def _end_program(self):
+        """END of the main program (also STOP, top-level EXIT and running off
+        the last line): rolls back an open transaction and closes all files."""
+        self.trace_enabled = False
+        if self.file_manager.transaction is not None:
+            self.file_manager.rollback() # Never committed
+        for chn in list(self.file_manager.channels.keys()): self.file_manager.close(chn)
+        self.file_manager.dump_stats()
+        self.setesc_line = 0
+
     def signal_escape(self):
         """Signals that the Escape key was pressed."""
         self.escape_trapped = True
@@ -104,6 +119,34 @@ class ThoroughbredBasicInterpreter:
             raise ExecutionFinished()
         return False
 
+    SYSTEM_PROGRAMS = {'*IMPORT': '_sys_import', '*EXPORT': '_sys_export', '*IOSTATS': '_sys_iostats'}
+
+    def _sys_import(self, args):
+        """CALL "*IMPORT", file$, source$ [, format$, count, rate]"""
+        return self._sys_bulk(bulk_io.import_file, args)
+
+    def _sys_export(self, args):
+        """CALL "*EXPORT", file$, dest$ [, format$, count, rate]"""
+        return self._sys_bulk(bulk_io.export_file, args)
+
+    def _sys_iostats(self, args):
+        """CALL "*IOSTATS", chn: the I/O statistics as a SERIAL list on chn"""
+        if not args:
+            raise RuntimeError("ERR=26: Invalid parameter: channel required")
+        chn = int(args[0])
+        rows = self.file_manager.io_stats_rows() # Taken before chn is (re)opened
+        self.file_manager.open_list(chn, f"_IOSTATS_{chn}", rows)
+        return []
+
+    def _sys_bulk(self, run, args):
+        if len(args) < 2:
+            raise RuntimeError("ERR=26: Invalid parameter: file name and path required")
+        fmt = str(args[2]) if len(args) > 2 and args[2] else 'CSV'
+        try:
+            stats = run(self.file_manager, str(args[0]), str(args[1]), fmt)
+        except FileNotFoundError as e:
+            raise RuntimeError(f"ERR=12: {e}")
+        return [None, None, None, stats['records'], round(stats['rate'])]
 
     def _push_context(self, program, line_numbers, variables=None, passed_args=None):
         self.context_stack.append({
@@ -395,7 +438,7 @@ class ThoroughbredBasicInterpreter:
                 end_line = int(options.get('END')) if 'END' in options else None
 
                 try:
-                    return self.file_manager.get_next_key(chn)
+                    return self.file_manager.get_next_key(chn, knum=options.get('KNUM'))
                 except EOFError:
                     if end_line: raise BasicErrorJump(end_line)
                     if err_line: raise BasicErrorJump(err_line)
@@ -477,60 +520,7 @@ class ThoroughbredBasicInterpreter:
                                 if arg_toks[0].type == 'ERR':
                                     err_line = int(self.evaluate_expression(arg_toks[2:]))
 
-                        s = str(val1).upper()
-                        if not s: raise ValueError("Empty string for SDX")
-
-                        # Soundex mapping
-                        mapping = {
-                            'B': '1', 'F': '1', 'P': '1', 'V': '1',
-                            'C': '2', 'G': '2', 'J': '2', 'K': '2', 'Q': '2', 'S': '2', 'X': '2', 'Z': '2',
-                            'D': '3', 'T': '3',
-                            'L': '4',
-                            'M': '5', 'N': '5',
-                            'R': '6'
-                        }
-                        
-                        # 1. Find the first alphanumeric character
-                        first_char = ""
-                        for char in s:
-                            if char.isalnum():
-                                first_char = char
-                                break
-                        if not first_char: return "    "
-                        
-                        # 2. Build the codes
-                        res = [first_char]
-                        prev_code = mapping.get(first_char, "0")
-                        
-                        # Skip characters until we have 3 digits
-                        for char in s[s.find(first_char)+1:]:
-                            if len(res) >= 4: break
-                            
-                            code = mapping.get(char)
-                            if code:
-                                if code != prev_code:
-                                    res.append(code)
-                                    prev_code = code
-                                else:
-                                    # Same code as previous literal character?
-                                    # Rule: If two letters with same code are adjacent, only first is retained.
-                                    # If they are separated by A,E,I,O,U,Y, both are used.
-                                    # If they are separated by H,W, only first is used.
-                                    # This is complex. Standard Soundex usually ignores H/W separation effect.
-                                    # Let's follow the standard rule where adjacency means "consecutive characters in source".
-                                    pass 
-                            elif char in "HW":
-                                # H and W are ignored but prevent adjacency merge? 
-                                # No, they are usually skipped entirely in modern Soundex.
-                                # But some versions say they DON'T separate.
-                                pass
-                            else:
-                                # Vowels/Others: reset prev_code so next same-code letter is included
-                                prev_code = "0"
-                        
-                        # Padding
-                        while len(res) < 4: res.append("0")
-                        return "".join(res[:4])
+                        return soundex(val1)
                         
                     except Exception as e:
                         if 'err_line' in locals() and err_line: raise BasicErrorJump(err_line)
@@ -943,10 +933,10 @@ class ThoroughbredBasicInterpreter:
         return 0
 
     def _handle_file_error(self, err_type, options):
-        """Helper to route execution based on ERR= or DOM= options."""
-        if err_type == 'DOM' and 'DOM' in options:
+        """Helper to route execution based on ERR=, DOM= or END= options."""
+        if err_type in ('DOM', 'END') and err_type in options:
             try:
-                target = int(float(options['DOM']))
+                target = int(float(options[err_type]))
                 if target in self.line_numbers:
                     self.retry_index = self.current_line_idx
                     self.seterr_saved = self.seterr_line
@@ -1010,6 +1000,7 @@ class ThoroughbredBasicInterpreter:
                         self.current_line_idx += 1
                         continue
                     else:
+                        self._end_program()
                         break # End of main program
 
                 current_line_num = ctx['line_numbers'][ctx['current_line_idx']]
@@ -1851,13 +1842,23 @@ class ThoroughbredBasicInterpreter:
                                   if v is not None:
                                       values.append(v)
 
-                              # Check DOM
-                              if key is not None or ind is not None:
+                              stored = False
+                              is_keyed = channel in self.file_manager.channels and \
+                                  self.file_manager.channels[channel]['type'] in ('DIRECT', 'SORT', 'INDEXED')
+                              if is_keyed and (key is not None or ind is not None):
+                                  # One check-and-write: with DOM= only a new record is written
+                                  if 'DOM' in options:
+                                      if not self.file_manager.insert_if_absent(channel, key=key, ind=ind, values=values):
+                                          if self._handle_file_error('DOM', options): jumped = True
+                                  else:
+                                      self.file_manager.upsert(channel, key=key, ind=ind, values=values)
+                                  stored = True
+                              elif 'DOM' in options and (key is not None or ind is not None):
                                   existing = self.file_manager.read(channel, key=key, ind=ind)
-                                  if existing is not None and 'DOM' in options:
+                                  if existing is not None:
                                        if self._handle_file_error('DOM', options): jumped = True
-                              
-                              if not jumped:
+
+                              if not jumped and not stored:
                                   if is_text:
                                       # WRITE: Add delimiter after each variable
                                       # WRITE RECORD: Join variables? Manual says "writes the named variable... for the number of bytes contained"
@@ -1877,63 +1878,27 @@ class ThoroughbredBasicInterpreter:
                              update_ptr = True
                              if cmd in ('FIND', 'FINDRECORD'): update_ptr = False
 
-                             if cmd in ('EXTRACT', 'EXTRACTRECORD'):
-                                 # Locking logic? Not implemented.
-                                 val = self.file_manager.extract(channel, key=key, ind=ind)
-                             else:
-                                 val = self.file_manager.read(channel, key=key, ind=ind, update_ptr_on_error=update_ptr)
+                             is_text = False
+                             try:
+                                 if self.file_manager.channels[channel]['type'] == 'TEXT':
+                                     is_text = True
+                             except: pass
 
-                             # TEXT File Logic
-                             if val is not None and self.file_manager.channels[channel]['type'] == 'TEXT':
-                                 # val is the rest of the string starting from IND
-                                 # SIZ Logic
-                                 siz_limit = len(val)
+                             if is_text:
+                                 # READ stops at a terminator (or SIZ=), READ RECORD at SIZ= or EOF;
+                                 # the channel position advances unless IND= was given
+                                 siz = None
                                  if options.get('SIZ'):
-                                     try: siz_limit = int(options['SIZ'])
+                                     try: siz = int(options['SIZ'])
                                      except: pass
-                                 
-                                 limit = min(len(val), siz_limit)
-                                 consumed = 0
-                                 
-                                 if 'RECORD' not in cmd:
-                                     # READ: Stop at delimiter or SIZ
-                                     # Delimiters: 0A, 0D, 8A
-                                     # We search in val[:limit]
-                                     chunk = val[:limit]
-                                     # Find first terminator
-                                     # Regex for LF, CR, $8A (\x8a)
-                                     match = re.search(r'[\n\r\x8a]', chunk)
-                                     if match:
-                                         end_idx = match.start()
-                                         # Consume terminator(s)
-                                         # Check for CRLF/LFCR?
-                                         # Simple: consume match char. If followed by other...
-                                         # Manual: "combination of one line feed and one carriage return"
-                                         stop_char = chunk[match.start()]
-                                         consumed = match.end()
-                                         
-                                         # Look ahead for pair
-                                         if consumed < len(val):
-                                             next_char = val[consumed]
-                                             if (stop_char == '\n' and next_char == '\r') or (stop_char == '\r' and next_char == '\n'):
-                                                 consumed += 1
-                                         
-                                         # Returned data does NOT contain terminator
-                                         val = [chunk[:end_idx]]
-                                     else:
-                                         # No terminator found within limit (SIZ or EOF)
-                                         # If SIZ was limiting, we stop there.
-                                         val = [chunk]
-                                         consumed = limit
-                                 else:
-                                     # READ RECORD: Terminated by EOF or SIZ
-                                     chunk = val[:limit]
-                                     val = [chunk] # Return as list for assignment logic
-                                     consumed = limit
-                                 
-                                 # Update Channel Position Manually (since file_manager doesn't know how much we consumed)
-                                 if ind is None:
-                                     self.file_manager.channels[channel]['pos'] += consumed
+                                 val = self.file_manager.read_text(channel, ind=ind, siz=siz, record='RECORD' in cmd)
+                                 if val is not None: val = [val] # Return as list for assignment logic
+                             elif cmd in ('EXTRACT', 'EXTRACTRECORD'):
+                                 # Locks the record; TIM= overrides how long to wait for a busy record
+                                 wait = float(options['TIM']) if 'TIM' in options else None
+                                 val = self.file_manager.extract(channel, key=key, ind=ind, wait=wait, knum=options.get('KNUM'))
+                             else:
+                                 val = self.file_manager.read(channel, key=key, ind=ind, update_ptr_on_error=update_ptr, knum=options.get('KNUM'))
 
                              # Special case: FIND on SORT file does not transfer data
                              if cmd in ('FIND', 'FINDRECORD'):
@@ -1951,6 +1916,9 @@ class ThoroughbredBasicInterpreter:
                              if val is None:
                                   if 'DOM' in options:
                                       if self._handle_file_error('DOM', options): jumped = True
+                                  if not jumped and key is None and ind is None and 'END' in options:
+                                      # Sequential READ ran past the last record
+                                      if self._handle_file_error('END', options): jumped = True
                                   if not jumped:
                                       # EOF
                                       if not self._handle_file_error('ERR', options): # ERR=2 usually
@@ -2009,28 +1977,11 @@ class ThoroughbredBasicInterpreter:
                     idx += 1
 
                 try:
-                    # Implementation of SELECT: list files in basic_storage
-                    files = [f.replace('.json', '') for f in os.listdir(self.file_manager.storage_dir) if f.endswith('.json')]
-                    if pattern != "*":
-                        import fnmatch
-                        files = fnmatch.filter(files, pattern)
-
-                    # Create a virtual "SERIAL" file with the file list
-                    path = self.file_manager._get_path(f"_SELECT_{chn}")
-                    file_content = {
-                        "_metadata": {"type": "SERIAL", "rec_len": 128, "key_len": None},
-                        "records": {str(i): [f] for i, f in enumerate(sorted(files))}
-                    }
-                    # We don't actually save this to disk, or maybe we do temporarily?
-                    # Thoroughbred SELECT creates a list that can be READ.
-                    # Let's just mock it in FileManager as an open channel.
-                    self.file_manager.channels[chn] = {
-                        'type': 'SERIAL',
-                        'filename': f"_SELECT_{chn}",
-                        'data': file_content["records"],
-                        'metadata': file_content["_metadata"],
-                        'pos': 0
-                    }
+                    # Thoroughbred SELECT creates a list that can be READ: a
+                    # memory-only SERIAL channel over the files on all disks,
+                    # one record (name, disk, type, rec_len, key_len, records,
+                    # size) per file, produced as it is read
+                    self.file_manager.select(chn, pattern)
                     self.current_line_idx += 1
                 except Exception as e:
                     if not self._handle_file_error('ERR', options): raise e
@@ -2087,6 +2038,21 @@ class ThoroughbredBasicInterpreter:
 
                     args.append({'value': val, 'var_name': var_name, 'is_all': is_all})
 
+            # System programs ("*NAME") run in Python and return their results
+            # in the passed variables
+            system_program = self.SYSTEM_PROGRAMS.get(str(prog_name).upper())
+            if system_program:
+                try:
+                    results = getattr(self, system_program)([a['value'] for a in args])
+                except Exception:
+                    if not self._handle_file_error('ERR', options): raise
+                    return
+                for a, value in zip(args, results):
+                    if a['var_name'] and value is not None:
+                        self.variables[a['var_name']] = value
+                self.current_line_idx += 1
+                return
+
             # Search for program
             resolved_path = self.file_manager.find_program(prog_name)
             if not resolved_path:
@@ -2264,6 +2230,22 @@ class ThoroughbredBasicInterpreter:
             self.trace_enabled = False
             self.current_line_idx += 1
 
+        elif cmd in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+            # Transactions: BEGIN, then WRITE/REMOVE on any channels, then
+            # COMMIT (one durable step) or ROLLBACK [, ERR=line]
+            options = {}
+            idx = 1
+            while idx < len(tokens):
+                if tokens[idx].type == 'ERR':
+                    idx += 2; options['ERR'] = tokens[idx].value
+                idx += 1
+            try:
+                {'BEGIN': self.file_manager.begin, 'COMMIT': self.file_manager.commit,
+                 'ROLLBACK': self.file_manager.rollback}[cmd]()
+                self.current_line_idx += 1
+            except Exception:
+                if not self._handle_file_error('ERR', options): raise
+
         elif cmd == 'SETESC':
             try:
                 val = self.evaluate_expression(tokens[1:])
@@ -2419,10 +2401,12 @@ class ThoroughbredBasicInterpreter:
             # print("STOP") # Optional
             if len(self.context_stack) > 1: self.context_stack.pop(); self.current_line_idx += 1; return # STOP in sub? usually HALT.
             # STOP forces end of execution usually.
+            self._end_program()
             raise ExecutionFinished()
 
         elif cmd == 'EXIT':
             if len(self.context_stack) <= 1:
+                self._end_program()
                 raise ExecutionFinished() # Top-level EXIT acts like END
             
             curr = self.context_stack.pop()
@@ -2448,8 +2432,7 @@ class ThoroughbredBasicInterpreter:
                 self.current_line_idx += 1
                 return
                 
-            for chn in list(self.file_manager.channels.keys()): self.file_manager.close(chn)
-            self.setesc_line = 0
+            self._end_program()
             raise ExecutionFinished()
 
         else:
@@ -0,0 +1,50 @@
+"""Typed record keys for DIRECT/SORT/INDEXED files.
+
+Older files store every key as str(key): numeric keys then sort as text
+("10" < "9") and KEY=5 and KEY=5.0 are different records. Files created
+with metadata 'key_codec': 'typed' store keys encoded so that plain string
+comparison (the sorted key index, range scans, RANGE partitions) gives the
+logical order:
+
+    numbers - NUM_TAG + the IEEE 754 double as 8 chars (one per byte,
+              U+0000..U+00FF), sign bit flipped for positives and all bits
+              inverted for negatives. Fixed length; numbers sort before all
+              strings. 5 and 5.0 encode the same.
+    strings - unchanged, but at most key_len characters. Thoroughbred pads
+              keys to key_len with NULs; since a NUL-padded key sorts exactly
+              like the bare one, the padding is implied rather than stored.
+
+Integers beyond 2**53 lose precision, as they do in a BASIC variable.
+"""
+import struct
+
+TYPED = 'typed'
+NUM_TAG = '\x00'
+
+_DOUBLE = struct.Struct('>d')
+_U64 = struct.Struct('>Q')
+_SIGN = 1 << 63
+_MASK = (1 << 64) - 1
+
+
+def encode(key, key_len=None):
+    """The stored form of a key; raises ValueError for a string key longer
+    than key_len."""
+    if isinstance(key, (int, float)) and not isinstance(key, bool):
+        bits = _U64.unpack(_DOUBLE.pack(float(key) + 0.0))[0] # + 0.0: -0.0 -> 0.0
+        bits = bits ^ _MASK if bits & _SIGN else bits | _SIGN
+        return NUM_TAG + _U64.pack(bits).decode('latin-1')
+    key = str(key)
+    if key_len and len(key) > int(key_len):
+        raise ValueError(f"Invalid key: longer than key length {key_len}: {key}")
+    return key
+
+
+def decode(stored):
+    """The key as the program wrote it: a number or a string."""
+    if len(stored) == 9 and stored[0] == NUM_TAG and max(stored) <= '\xff':
+        bits = _U64.unpack(stored[1:].encode('latin-1'))[0]
+        bits = bits ^ _SIGN if bits & _SIGN else bits ^ _MASK
+        value = _DOUBLE.unpack(_U64.pack(bits))[0]
+        return int(value) if value.is_integer() else value
+    return stored
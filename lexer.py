@@ -46,7 +46,7 @@ class Lexer:
             'SETTRACE', 'ENDTRACE', 'SET', 'TRACEMODE', 'STOP', 'DTN',
             'ATH', 'HTA', 'MAX', 'MIN', 'NUM', 'KEY', 'IOLIST', 'IOL',
                                                                         'SETERR', 'RETRY', 'FIND', 'READRECORD', 'FINDRECORD', 'RECORD', 'BIN', 'DEC', 'FILL', 'RUN', 'SDX', 'SETESC',
-            'SYSTEM', 'TEXT'
+            'SYSTEM', 'TEXT', 'BEGIN', 'COMMIT', 'ROLLBACK'
         }
 
     def tokenize(self, text):
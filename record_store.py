@@ -0,0 +1,1121 @@
+"""In-memory and disk-backed record stores used by FileManager."""
+import bisect
+import copy
+import heapq
+import itertools
+import marshal
+import math
+import os
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import storage_format
+from soundex import soundex
+from storage_format import RECORD, OP_DELETE
+
+
+class SerialStore:
+    """Append-only record log for SERIAL files.
+
+    Records are numbered 0, 1, 2, ... in write order and never renumbered;
+    REMOVE leaves an empty slot, so a later WRITE can never overwrite an
+    existing record. For BINARY files the records already on disk are not
+    loaded: they are read on demand through a buffered handle, sequentially
+    from a per-channel cursor, and new records are appended at flush time.
+    """
+    CHECKPOINT = 1024 # Keep the file offset of every Nth record for IND= access
+    BUFFER = 65536
+
+    def __init__(self, records=None):
+        self.mem = list(records or []) # Records after the on-disk part; None = removed
+        self.path = None # BINARY file holding records [0, disk_count)
+        self.disk_count = 0
+        self.disk_removed = set()
+        self.pending_removed = set() # Removed on disk, DELETE not yet written
+        self.checkpoints = array('Q')
+        self.rewrite = True # Next save() must write the whole file
+        self._f = None
+
+    @classmethod
+    def from_records(cls, records, count=0):
+        """Builds a store from a {"0": values, "1": ...} record dict (JSON files).
+
+        count is the number of slots saved with the file, so removed records
+        at the end still hold their numbers.
+        """
+        slots = {}
+        for k, v in records.items():
+            try: slots[int(k)] = v
+            except ValueError: continue # Not a serial position; skip
+        mem = [None] * max(max(slots) + 1 if slots else 0, count)
+        for i, v in slots.items():
+            mem[i] = v
+        return cls(mem)
+
+    @classmethod
+    def from_binary(cls, path):
+        """Opens a BINARY serial file without loading its records.
+
+        One pass over the record headers counts the records, notes removed
+        ones and remembers checkpoint offsets; memory use does not depend
+        on the file size.
+        """
+        store = cls()
+        with open(path, 'rb', buffering=cls.BUFFER) as f:
+            storage_format.read_header(f)
+            offset = f.tell()
+            while True:
+                raw = f.read(RECORD.size)
+                if len(raw) < RECORD.size:
+                    break
+                op, klen, vlen = RECORD.unpack(raw)
+                key = f.read(klen).decode('utf-8', 'surrogatepass')
+                if op == OP_DELETE:
+                    store.disk_removed.add(int(key))
+                elif key != str(store.disk_count):
+                    # Not written by this class (e.g. converted out of order): load it all
+                    _, records, _ = storage_format.load(path)
+                    return cls.from_records(records)
+                else:
+                    if store.disk_count % cls.CHECKPOINT == 0:
+                        store.checkpoints.append(offset)
+                    store.disk_count += 1
+                f.seek(vlen, os.SEEK_CUR)
+                offset += RECORD.size + klen + vlen
+        store.path = path
+        store.rewrite = False
+        return store
+
+    def __len__(self):
+        return self.disk_count + len(self.mem)
+
+    def _file(self):
+        if self._f is None:
+            self._f = open(self.path, 'rb', buffering=self.BUFFER)
+        return self._f
+
+    def _read_disk(self, i, cursor):
+        # Continue from the channel's cursor when reading forward, else from a checkpoint
+        if cursor and cursor.get('index') is not None and cursor['index'] <= i:
+            idx, offset = cursor['index'], cursor['offset']
+        else:
+            cp = i // self.CHECKPOINT
+            idx, offset = cp * self.CHECKPOINT, self.checkpoints[cp]
+        f = self._file()
+        f.seek(offset)
+        while True:
+            op, klen, vlen = RECORD.unpack(f.read(RECORD.size))
+            if op != OP_DELETE and idx == i:
+                f.seek(klen, os.SEEK_CUR)
+                values = storage_format.decode_values(op, f.read(vlen))
+                if cursor is not None:
+                    cursor['index'], cursor['offset'] = i + 1, f.tell()
+                return values
+            f.seek(klen + vlen, os.SEEK_CUR)
+            if op != OP_DELETE:
+                idx += 1
+
+    def record(self, i, cursor=None):
+        """Values of record i, or None if it does not exist or was removed."""
+        if i < 0 or i >= len(self):
+            return None
+        if i >= self.disk_count:
+            return self.mem[i - self.disk_count]
+        if i in self.disk_removed:
+            return None
+        return self._read_disk(i, cursor)
+
+    def next_record(self, i, cursor=None):
+        """(index, values) of the first record at or after i, or None at EOF."""
+        while i < len(self):
+            values = self.record(i, cursor)
+            if values is not None:
+                return i, values
+            i += 1
+        return None
+
+    def append(self, values):
+        self.mem.append(values)
+        return len(self) - 1
+
+    def remove(self, i):
+        """Empties slot i. Returns False if there was no record."""
+        if self.record(i) is None:
+            return False
+        if i >= self.disk_count:
+            self.mem[i - self.disk_count] = None
+        else:
+            self.disk_removed.add(i)
+            self.pending_removed.add(i)
+        return True
+
+    def restore(self, i, values):
+        """Puts record i back: ROLLBACK of a REMOVE or APPEND, journal replay."""
+        if i >= len(self):
+            self.mem.extend([None] * (i - len(self)))
+            self.mem.append(values)
+        elif i >= self.disk_count:
+            self.mem[i - self.disk_count] = values
+        elif i in self.pending_removed: # The DELETE was never written
+            self.pending_removed.discard(i)
+            self.disk_removed.discard(i)
+        else:
+            raise ValueError(f"Record {i} was removed on disk")
+
+    # Key-style access, so REMOVE can treat all file types alike
+    def __contains__(self, key):
+        try: return self.record(int(key)) is not None
+        except ValueError: return False
+
+    def get(self, key, default=None):
+        try: values = self.record(int(key))
+        except ValueError: return default
+        return default if values is None else values
+
+    def __getitem__(self, key):
+        values = self.get(key)
+        if values is None:
+            raise KeyError(key)
+        return values
+
+    def __delitem__(self, key):
+        if not self.remove(int(key)):
+            raise KeyError(key)
+
+    def items(self):
+        """Yields (key, values) for every record, streaming from disk."""
+        cursor = {}
+        i = 0
+        while True:
+            found = self.next_record(i, cursor)
+            if found is None:
+                return
+            i, values = found
+            yield str(i), values
+            i += 1
+
+    def save(self, path, metadata, fmt):
+        """Writes the store back: an append for BINARY files, else a full rewrite."""
+        if fmt != 'BINARY':
+            # Removed slots are not written; 'slots' keeps the numbering past them
+            storage_format.dump(path, dict(metadata, slots=len(self)), dict(self.items()), fmt)
+            return
+        if self.rewrite or self.path != path:
+            self._rewrite(path, metadata)
+            return
+
+        with open(path, 'ab') as f:
+            offset = start = f.tell()
+            for n, values in enumerate(self.mem):
+                if (self.disk_count + n) % self.CHECKPOINT == 0:
+                    self.checkpoints.append(offset)
+                # Removed slots are kept (as None) so numbering stays stable
+                rec = storage_format.encode_record(str(self.disk_count + n), values,
+                                                   compress=metadata.get('compress'))
+                f.write(rec)
+                offset += len(rec)
+            for i in sorted(self.pending_removed):
+                f.write(storage_format.encode_record(str(i), None, OP_DELETE))
+            storage_format.count_written(f.tell() - start)
+        self.disk_count += len(self.mem)
+        self.mem = []
+        self.pending_removed.clear()
+
+    def _rewrite(self, path, metadata):
+        tmp = path + '.tmp'
+        checkpoints = array('Q')
+        with open(tmp, 'wb') as f:
+            f.write(storage_format.encode_header(metadata))
+            cursor = {}
+            for i in range(len(self)):
+                if i % self.CHECKPOINT == 0:
+                    checkpoints.append(f.tell())
+                f.write(storage_format.encode_record(str(i), self.record(i, cursor),
+                                                     compress=metadata.get('compress')))
+            storage_format.count_written(f.tell())
+        self.close()
+        os.replace(tmp, path)
+        self.disk_count, self.mem = len(self), []
+        self.disk_removed = set() # Removed slots were written as None
+        self.pending_removed.clear()
+        self.checkpoints = checkpoints
+        self.path = path
+        self.rewrite = False
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class StreamStore:
+    """Read-only SERIAL store over records produced on demand (SELECT).
+
+    `source` is a callable returning a fresh iterator of records. Only the
+    last record produced is kept: sequential READs cost one step each, going
+    back (IND= before the last record read) starts the iterator over.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._it = None
+        self._next = 0 # Index of the record _it produces next
+        self._last = None # (index, values) of the last record produced
+
+    def record(self, i, cursor=None):
+        """Values of record i, or None past the end."""
+        if i < 0:
+            return None
+        if self._last is not None and self._last[0] == i:
+            return self._last[1]
+        if self._it is None or i < self._next:
+            self._it, self._next = iter(self.source()), 0
+        for values in self._it:
+            self._last = (self._next, values)
+            self._next += 1
+            if self._last[0] == i:
+                return values
+        return None
+
+    def next_record(self, i, cursor=None):
+        """(index, values) of record i, or None at EOF; there are no gaps."""
+        values = self.record(i)
+        return None if values is None else (i, values)
+
+    def get(self, key, default=None):
+        try: values = self.record(int(key))
+        except ValueError: return default
+        return default if values is None else values
+
+    def items(self):
+        for i, values in enumerate(self.source()):
+            yield str(i), values
+
+    def close(self):
+        self._it = self._last = None
+
+
+class PageCache:
+    """Process-wide LRU cache of file pages for PagedStore, within a memory budget.
+
+    Unsaved changes of all stores count against the same budget. When
+    evicting clean pages is not enough, the store that is writing spills
+    its changes to disk.
+    """
+    PAGE_SIZE = 16384
+
+    def __init__(self, budget=64 * 1024 * 1024):
+        self.budget = budget
+        self.pages = OrderedDict() # (store id, page number) -> bytes, oldest first
+        self.used = 0 # Bytes held in pages
+        self.dirty = 0 # Bytes of unsaved changes, all stores
+        self.hits = self.misses = self.evictions = self.spills = 0
+        self.lock = threading.Lock()
+
+    def get(self, store, page_no):
+        key = (store.cache_id, page_no)
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.hits += 1
+                self.pages.move_to_end(key)
+                return page
+            self.misses += 1
+            page = store.read_page(page_no)
+            self.pages[key] = page
+            self.used += len(page)
+            self._evict()
+            return page
+
+    def _evict(self):
+        while self.used + self.dirty > self.budget and len(self.pages) > 1:
+            _, page = self.pages.popitem(last=False)
+            self.used -= len(page)
+            self.evictions += 1
+
+    def charge(self, nbytes):
+        """Accounts for changed bytes; True if the budget is still exceeded."""
+        with self.lock:
+            self.dirty += nbytes
+            self._evict()
+            return self.used + self.dirty > self.budget
+
+    def drop(self, store, page_nos=None):
+        """Forgets the pages of a store (all, or the given page numbers)."""
+        with self.lock:
+            if page_nos is None:
+                page_nos = [n for sid, n in self.pages if sid == store.cache_id]
+            for n in page_nos:
+                page = self.pages.pop((store.cache_id, n), None)
+                if page is not None:
+                    self.used -= len(page)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'budget': self.budget, 'pages': len(self.pages), 'bytes': self.used, 'dirty': self.dirty,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'spills': self.spills,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+page_cache = PageCache()
+_store_ids = itertools.count(1)
+_DELETED = object()
+
+
+class PagedStore:
+    """Records of a keyed BINARY file, read on demand through the page cache.
+
+    Only a key -> file offset directory is kept in memory (front-coded for
+    large files, see CompactKeyIndex), so the file does not have to fit in RAM. Changes are held in an overlay until save(), or
+    until the page cache runs out of budget, and are then appended to the
+    record log. Supports the dict operations FileManager uses.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = {} # key -> offset of its latest PUT record
+        self.overlay = {} # key -> values or _DELETED, not yet on disk
+        self.overlay_bytes = 0
+        self.count = 0
+        self.size = 0
+        self.saved_metadata = None # A metadata change needs a rewrite (header)
+        self.hold = 0 # > 0 while a transaction holds the changes in memory
+        self.cache_id = next(_store_ids)
+        self._f = None
+
+    @classmethod
+    def from_binary(cls, path):
+        """Builds the key directory in one pass over the record headers."""
+        store = cls(path)
+        with open(path, 'rb', buffering=SerialStore.BUFFER) as f:
+            store.saved_metadata = storage_format.read_header(f)
+            offset = f.tell()
+            while True:
+                raw = f.read(RECORD.size)
+                if len(raw) < RECORD.size:
+                    break
+                op, klen, vlen = RECORD.unpack(raw)
+                key = f.read(klen).decode('utf-8', 'surrogatepass')
+                if op != OP_DELETE:
+                    store.offsets[key] = offset
+                else:
+                    store.offsets.pop(key, None)
+                f.seek(vlen, os.SEEK_CUR)
+                offset += RECORD.size + klen + vlen
+        store.size = offset
+        store.count = len(store.offsets)
+        store.offsets = _directory(store.offsets)
+        return store
+
+    def read_page(self, page_no):
+        if self._f is None:
+            self._f = open(self.path, 'rb', buffering=0) # The page cache is the buffer
+        self._f.seek(page_no * PageCache.PAGE_SIZE)
+        return self._f.read(PageCache.PAGE_SIZE)
+
+    def _read(self, offset, n):
+        parts = []
+        while n > 0:
+            page_no, start = divmod(offset, PageCache.PAGE_SIZE)
+            chunk = page_cache.get(self, page_no)[start:start + n]
+            if not chunk:
+                raise EOFError(f"Truncated data file: {self.path}")
+            parts.append(chunk)
+            n -= len(chunk)
+            offset += len(chunk)
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def get(self, key, default=None):
+        if key in self.overlay:
+            values = self.overlay[key]
+            return default if values is _DELETED else values
+        offset = self.offsets.get(key)
+        if offset is None:
+            return default
+        op, klen, vlen = RECORD.unpack(self._read(offset, RECORD.size))
+        return storage_format.decode_values(op, self._read(offset + RECORD.size + klen, vlen))
+
+    def __getitem__(self, key):
+        values = self.get(key, _DELETED)
+        if values is _DELETED:
+            raise KeyError(key)
+        return values
+
+    def __contains__(self, key):
+        if key in self.overlay:
+            return self.overlay[key] is not _DELETED
+        return key in self.offsets
+
+    def _change(self, key, values, nbytes):
+        self.overlay[key] = values
+        self.overlay_bytes += nbytes
+        if page_cache.charge(nbytes) and not self.hold:
+            self.spill() # Over budget: write the changes back now
+
+    def __setitem__(self, key, values):
+        if key not in self:
+            self.count += 1
+        self._change(key, values, RECORD.size + len(key) + len(marshal.dumps(values)))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.count -= 1
+        self._change(key, _DELETED, RECORD.size + len(key))
+
+    def __len__(self):
+        return self.count
+
+    def keys(self):
+        for key in self.offsets:
+            if key not in self.overlay:
+                yield key
+        for key, values in list(self.overlay.items()):
+            if values is not _DELETED:
+                yield key
+
+    __iter__ = keys
+
+    def items(self):
+        for key in self.keys():
+            values = self.get(key, _DELETED)
+            if values is not _DELETED:
+                yield key, values
+
+    def values(self):
+        for _, values in self.items():
+            yield values
+
+    def _discard_overlay(self):
+        page_cache.charge(-self.overlay_bytes)
+        self.overlay.clear()
+        self.overlay_bytes = 0
+
+    def spill(self):
+        """Appends the unsaved changes to the record log."""
+        if not self.overlay:
+            return
+        compress = (self.saved_metadata or {}).get('compress') # As in the header on disk
+        with open(self.path, 'ab') as f:
+            offset = start = f.tell()
+            for key, values in self.overlay.items():
+                if values is _DELETED:
+                    if self.offsets.pop(key, None) is None:
+                        continue # Never reached the disk
+                    rec = storage_format.encode_record(key, None, OP_DELETE)
+                else:
+                    rec = storage_format.encode_record(key, values, compress=compress)
+                    self.offsets[key] = offset
+                f.write(rec)
+                offset += len(rec)
+        storage_format.count_written(offset - start)
+        page_cache.drop(self, [self.size // PageCache.PAGE_SIZE]) # The old last page grew
+        page_cache.spills += 1
+        self.size = offset
+        self._discard_overlay()
+
+    def save(self, path, metadata, fmt):
+        """Appends the changes, or rewrites the file if its header changed."""
+        if fmt != 'BINARY':
+            storage_format.dump_items(path, metadata, self.items(), fmt)
+            return
+        if path == self.path and metadata == self.saved_metadata:
+            self.spill()
+            return
+
+        tmp = path + '.tmp'
+        offsets = {}
+        with open(tmp, 'wb') as f:
+            f.write(storage_format.encode_header(metadata))
+            for key, values in self.items():
+                offsets[key] = f.tell()
+                f.write(storage_format.encode_record(key, values, compress=metadata.get('compress')))
+            size = f.tell()
+            storage_format.count_written(size)
+        self.close()
+        os.replace(tmp, path)
+        self.path, self.offsets, self.size = path, _directory(offsets), size
+        self.saved_metadata = copy.deepcopy(metadata)
+
+    def close(self):
+        """Releases the handle and cached pages; unsaved changes are dropped."""
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        page_cache.drop(self)
+        self._discard_overlay()
+
+
+def _directory(offsets):
+    """A PagedStore key directory: front-coded once the file is large."""
+    if len(offsets) >= CompactKeyIndex.min_keys:
+        return CompactKeyIndex.from_items(offsets.items())
+    return offsets
+
+
+def key_footprint(store):
+    """(kind, bytes) of what a keyed store holds per key, values aside."""
+    if isinstance(store, ShardedStore):
+        sizes = [key_footprint(shard) for shard in store.shards]
+        kinds = {kind for kind, _ in sizes}
+        return kinds.pop() if len(kinds) == 1 else 'mixed', sum(n for _, n in sizes)
+    if isinstance(store, PagedStore):
+        if isinstance(store.offsets, CompactKeyIndex):
+            return 'compact', store.offsets.footprint()
+        directory = store.offsets
+        return 'dict', sys.getsizeof(directory) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in directory.items())
+    return 'dict', sys.getsizeof(store) + sum(map(sys.getsizeof, store))
+
+
+def _load_shard(path):
+    if storage_format.detect(path) == 'BINARY':
+        return PagedStore.from_binary(path), 'BINARY'
+    return storage_format.load(path)[1], 'JSON'
+
+
+class ShardedStore:
+    """Records of a partitioned keyed file, spread over shard files on several disks.
+
+    Every key lives in exactly one shard: by a stable hash of the key (crc32,
+    so all processes agree) or by range, shard i holding the keys below
+    bounds[i]. Shards are ordinary keyed stores (a dict, or a PagedStore for
+    a BINARY shard file). Shards are loaded in parallel, and only the shards
+    that changed are written back, also in parallel: one thread per shard,
+    so each disk does its own I/O.
+    """
+
+    def __init__(self, shards, paths, formats, method='HASH', bounds=None):
+        self.shards = shards
+        self.paths = paths
+        self.formats = formats
+        self.method = method
+        self.bounds = list(bounds or [])
+        self.dirty = set() # Shards changed since the last save()
+        self.saved_metadata = None
+        self._hold = 0
+
+    @classmethod
+    def load(cls, paths, method='HASH', bounds=None):
+        with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+            loaded = list(pool.map(_load_shard, paths))
+        return cls([s for s, _ in loaded], list(paths), [fmt for _, fmt in loaded], method, bounds)
+
+    @staticmethod
+    def shard_of_key(key, method, bounds, count):
+        if method == 'RANGE':
+            return bisect.bisect_right(bounds, key)
+        return zlib.crc32(key.encode('utf-8', 'surrogatepass')) % count
+
+    def _shard(self, key):
+        return self.shards[self.shard_of_key(key, self.method, self.bounds, len(self.shards))]
+
+    # Transactions hold back the spills of PagedStore shards
+    @property
+    def hold(self):
+        return self._hold
+
+    @hold.setter
+    def hold(self, n):
+        self._hold = n
+        for shard in self.shards:
+            if isinstance(shard, PagedStore):
+                shard.hold = n
+
+    def get(self, key, default=None):
+        return self._shard(key).get(key, default)
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def __setitem__(self, key, values):
+        i = self.shard_of_key(key, self.method, self.bounds, len(self.shards))
+        self.shards[i][key] = values
+        self.dirty.add(i)
+
+    def __delitem__(self, key):
+        i = self.shard_of_key(key, self.method, self.bounds, len(self.shards))
+        del self.shards[i][key]
+        self.dirty.add(i)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def keys(self):
+        """All keys in key order: range shards one after the other, hash
+        shards merged."""
+        runs = (sorted(shard.keys()) for shard in self.shards)
+        if self.method == 'RANGE':
+            return itertools.chain.from_iterable(runs)
+        return heapq.merge(*runs)
+
+    def items(self):
+        """(key, values) shard by shard, not in key order."""
+        return itertools.chain.from_iterable(shard.items() for shard in self.shards)
+
+    def values(self):
+        return itertools.chain.from_iterable(shard.values() for shard in self.shards)
+
+    @staticmethod
+    def shard_metadata(metadata, i, count):
+        """A shard is a plain keyed file: the root's metadata without the
+        partition and index definitions."""
+        meta = {k: v for k, v in metadata.items() if k not in ('partition', 'indexes')}
+        meta['shard'] = f"{i + 1}/{count}"
+        return meta
+
+    def _save_shard(self, i, metadata):
+        shard, path, fmt = self.shards[i], self.paths[i], self.formats[i]
+        meta = self.shard_metadata(metadata, i, len(self.shards))
+        if isinstance(shard, PagedStore):
+            shard.save(path, meta, fmt)
+        else:
+            storage_format.dump(path, meta, shard, fmt)
+
+    def save(self, path, metadata, fmt):
+        """Writes back the changed shards, and the root file (metadata only)
+        if its metadata changed."""
+        changed, self.dirty = sorted(self.dirty), set()
+        if len(changed) > 1:
+            with ThreadPoolExecutor(max_workers=len(changed)) as pool:
+                list(pool.map(lambda i: self._save_shard(i, metadata), changed))
+        elif changed:
+            self._save_shard(changed[0], metadata)
+        if metadata != self.saved_metadata:
+            storage_format.dump(path, metadata, {}, fmt)
+            self.saved_metadata = copy.deepcopy(metadata)
+
+    def close(self):
+        for shard in self.shards:
+            if isinstance(shard, PagedStore):
+                shard.close()
+
+
+class BloomFilter:
+    """Answers "key is certainly not in the file" without touching the store.
+
+    No false negatives; a "maybe" turns out absent at about `error_rate`
+    while the filter is within capacity. Keys cannot be removed, so removed
+    keys keep answering "maybe" until the filter is rebuilt.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1024)
+        self.error_rate = error_rate
+        self.m = int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, int(round(self.m / self.capacity * math.log(2))))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+        self.checks = self.negatives = self.false_positives = 0
+
+    @classmethod
+    def from_keys(cls, keys, count, error_rate=0.01):
+        bloom = cls(count * 2, error_rate) # Room to grow before the next rebuild
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one hash
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def add(self, key):
+        bits = self.bits
+        for p in self._positions(key):
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def might_contain(self, key):
+        self.checks += 1
+        bits = self.bits
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                self.negatives += 1
+                return False
+        return True
+
+    def full(self):
+        return self.count >= self.capacity
+
+    def stats(self):
+        misses = self.negatives + self.false_positives
+        return {'capacity': self.capacity, 'keys': self.count, 'bits': self.m, 'hashes': self.k,
+                'checks': self.checks, 'negatives': self.negatives, 'false_positives': self.false_positives,
+                'fp_rate': self.false_positives / misses if misses else 0.0,
+                'expected_fp_rate': (1 - math.exp(-self.k * self.count / self.m)) ** self.k}
+
+
+def field_value(definition, values):
+    """The record field an index definition picks, as stored ("" if absent)."""
+    field = definition.get('field', 0)
+    if isinstance(values, list):
+        return values[field] if field < len(values) else ""
+    return values if field == 0 and values is not None else ""
+
+
+def index_value(definition, values):
+    """The alternate key a secondary index definition derives from a record.
+
+    `field` picks a value from the record (0-based), `pos`/`len` a substring
+    of it (1-based, as in BASIC). With `sdx` the key is its Soundex code.
+    """
+    value = str(field_value(definition, values))
+    start = definition.get('pos', 1) - 1
+    length = definition.get('len')
+    value = value[start:start + length] if length else value[start:]
+    if definition.get('sdx'):
+        return soundex(value) if value else ""
+    return value
+
+
+class KeyIndex:
+    """Sorted list of a keyed file's keys, kept in step with WRITE and REMOVE.
+
+    Secondary indexes use the same structure with (alternate key, primary
+    key) pairs, so duplicate alternate keys keep a stable order.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = sorted(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def reset(self, keys):
+        """Rebuilds in place (cursors keep their reference), e.g. after a bulk load."""
+        self.keys = sorted(keys)
+
+    def add(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.keys.insert(i, key)
+
+    def discard(self, key):
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+
+    def bisect_left(self, key):
+        return bisect.bisect_left(self.keys, key)
+
+    def bisect_right(self, key):
+        return bisect.bisect_right(self.keys, key)
+
+    def slice(self, start, count):
+        return self.keys[start:start + count]
+
+    def following(self, after, count):
+        """The first `count` keys > after (after None: from the first key)."""
+        start = 0 if after is None else bisect.bisect_right(self.keys, after)
+        return self.keys[start:start + count]
+
+    def before(self, key):
+        """The last key < key, or None: positioning after it lands on key."""
+        i = bisect.bisect_left(self.keys, key)
+        return self.keys[i - 1] if i > 0 else None
+
+    def range(self, start=None, end=None, prefix=None, batch=256):
+        """Yields keys with start <= key < end, or starting with prefix.
+
+        One binary search, then a walk over the matching keys: O(log n + k).
+        """
+        if prefix is not None:
+            start = prefix if start is None else max(start, prefix)
+        i = 0 if start is None else bisect.bisect_left(self.keys, start)
+        while True:
+            keys = self.keys[i:i + batch]
+            if not keys:
+                return
+            for key in keys:
+                if (end is not None and key >= end) or (prefix is not None and not key.startswith(prefix)):
+                    return
+                yield key
+            i += len(keys)
+
+    def footprint(self):
+        """Bytes of memory held by the index. The key strings of a primary
+        index are usually shared with the record store."""
+        return sys.getsizeof(self.keys) + sum(_sizeof(k) for k in self.keys)
+
+
+def _sizeof(key):
+    if isinstance(key, tuple):
+        return sys.getsizeof(key) + sum(map(sys.getsizeof, key))
+    return sys.getsizeof(key)
+
+
+def _front_code(keys):
+    """(rest, shared, ends) of a block of sorted keys. Key j is
+    keys[0][:shared[j]] + rest[ends[j - 1]:ends[j]]: in sorted order the
+    prefix shared with the block's first key only shrinks, so each key is
+    one startswith() or two away from the one before."""
+    first = keys[0]
+    n = min(len(first), 255)
+    shared, parts, ends, end = bytearray(), [], array('I'), 0
+    for key in keys:
+        while not key.startswith(first[:n]):
+            n -= 1
+        shared.append(n)
+        parts.append(key[n:])
+        end += len(key) - n
+        ends.append(end)
+    return ''.join(parts), bytes(shared), ends
+
+
+class CompactKeyIndex:
+    """KeyIndex for large files of long keys: the sorted keys front-coded in blocks.
+
+    A block holds up to 2 * BLOCK keys: the first key in full, in a sparse
+    top-level list that is binary searched to find the block, and for
+    every key the length of the prefix it shares with that first key plus
+    the rest of it, all rests in one string. Keys like course + year +
+    member number then cost a few bytes each instead of a str object. A
+    lookup binary searches its block building only the keys it compares;
+    a block accessed twice in a row is decoded in full and cached, for
+    sequential access.
+
+    With values (the file offsets of a PagedStore) it doubles as a sorted
+    key -> int mapping, the values packed in one array per block.
+    Secondary indexes ((alternate key, primary key) pairs) stay KeyIndexes.
+    """
+    BLOCK = 64
+    min_keys = 1000000 # FileManager uses this class from here on (KEYINDEX=)
+
+    def __init__(self, keys=(), values=None):
+        self.reset(keys, values)
+
+    @classmethod
+    def from_items(cls, items):
+        """A key -> int mapping from (key, value) pairs."""
+        items = sorted(items)
+        return cls([k for k, _ in items], [v for _, v in items])
+
+    def reset(self, keys, values=None):
+        """Rebuilds in place (values: parallel to keys, which must then be sorted)."""
+        keys = sorted(keys) if values is None else list(keys)
+        self.blocks, self.firsts = [], []
+        self.values = None if values is None else []
+        for i in range(0, len(keys), self.BLOCK):
+            chunk = keys[i:i + self.BLOCK]
+            self.blocks.append(_front_code(chunk))
+            self.firsts.append(chunk[0])
+            if values is not None:
+                self.values.append(array('q', values[i:i + self.BLOCK]))
+        self.count = len(keys)
+        self._cache = None
+        self._last = None
+
+    def __len__(self):
+        return self.count
+
+    def _block_of(self, key):
+        return max(bisect.bisect_right(self.firsts, key) - 1, 0)
+
+    def _keys(self, b):
+        cache = self._cache
+        if cache is None or cache[0] != b:
+            first = self.firsts[b]
+            rest, shared, ends = self.blocks[b]
+            keys = [first[:n] + rest[a:e] for n, a, e in zip(shared, itertools.chain((0,), ends), ends)]
+            cache = self._cache = (b, keys)
+        return cache[1]
+
+    def _key(self, b, j):
+        rest, shared, ends = self.blocks[b]
+        return self.firsts[b][:shared[j]] + rest[ends[j - 1] if j else 0:ends[j]]
+
+    def _store(self, b, keys, values):
+        """Replaces block b by keys: split in two if it grew too big, dropped if empty."""
+        self._cache = None
+        if not keys:
+            del self.blocks[b], self.firsts[b]
+            if values is not None:
+                del self.values[b]
+            return
+        if len(keys) <= 2 * self.BLOCK:
+            self.blocks[b], self.firsts[b] = _front_code(keys), keys[0]
+            if values is not None:
+                self.values[b] = values
+            self._cache = (b, keys)
+            return
+        half = len(keys) // 2
+        self.blocks[b:b + 1] = [_front_code(keys[:half]), _front_code(keys[half:])]
+        self.firsts[b:b + 1] = [keys[0], keys[half]]
+        if values is not None:
+            self.values[b:b + 1] = [values[:half], values[half:]]
+
+    def _find(self, key):
+        """(block, position, found) of key."""
+        if not self.blocks:
+            return 0, 0, False
+        b = self._block_of(key)
+        cache = self._cache
+        if (cache is not None and cache[0] == b) or b == self._last:
+            # Second access in a row to this block: sequential, decode it once
+            keys = self._keys(b)
+            i = bisect.bisect_left(keys, key)
+            return b, i, i < len(keys) and keys[i] == key
+        self._last = b
+        n = len(self.blocks[b][2])
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(b, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return b, lo, lo < n and self._key(b, lo) == key
+
+    def add(self, key, value=0):
+        b, i, found = self._find(key)
+        if found:
+            if self.values is not None:
+                self.values[b][i] = value
+            return
+        if not self.blocks:
+            self.reset([key], None if self.values is None else [value])
+            return
+        keys = list(self._keys(b))
+        keys.insert(i, key)
+        values = None
+        if self.values is not None:
+            values = self.values[b]
+            values.insert(i, value)
+        self.count += 1
+        self._store(b, keys, values)
+
+    def _remove(self, key):
+        b, i, found = self._find(key)
+        if not found:
+            return False, None
+        keys = self._keys(b)
+        keys = keys[:i] + keys[i + 1:]
+        values = value = None
+        if self.values is not None:
+            values = self.values[b]
+            value = values.pop(i)
+        self.count -= 1
+        self._store(b, keys, values)
+        return True, value
+
+    def discard(self, key):
+        self._remove(key)
+
+    def _from(self, b, i, count):
+        out = []
+        while b < len(self.blocks) and len(out) < count:
+            out.extend(self._keys(b)[i:i + count - len(out)])
+            b, i = b + 1, 0
+        return out
+
+    def following(self, after, count):
+        """The first `count` keys > after (after None: from the first key)."""
+        if after is None or not self.blocks:
+            return self._from(0, 0, count)
+        b = self._block_of(after)
+        return self._from(b, bisect.bisect_right(self._keys(b), after), count)
+
+    def before(self, key):
+        """The last key < key, or None: positioning after it lands on key."""
+        b, i, _ = self._find(key)
+        if i:
+            return self._key(b, i - 1)
+        return self._key(b - 1, len(self.blocks[b - 1][2]) - 1) if b else None
+
+    def range(self, start=None, end=None, prefix=None, batch=256):
+        """Yields keys with start <= key < end, or starting with prefix."""
+        if prefix is not None:
+            start = prefix if start is None else max(start, prefix)
+        if start is None:
+            keys = self._from(0, 0, batch)
+        else:
+            b, i, _ = self._find(start)
+            keys = self._from(b, i, batch)
+        while keys:
+            for key in keys:
+                if (end is not None and key >= end) or (prefix is not None and not key.startswith(prefix)):
+                    return
+                yield key
+            keys = self.following(keys[-1], batch) # Robust against changes in between
+
+    def footprint(self):
+        """Bytes of memory held by the index."""
+        size = sys.getsizeof(self.blocks) + sys.getsizeof(self.firsts) + sum(map(sys.getsizeof, self.firsts))
+        for block in self.blocks:
+            size += sys.getsizeof(block) + sum(map(sys.getsizeof, block))
+        if self.values is not None:
+            size += sys.getsizeof(self.values) + sum(map(sys.getsizeof, self.values))
+        return size
+
+    # Mapping use (PagedStore.offsets)
+
+    def __iter__(self):
+        for b in range(len(self.blocks)):
+            yield from self._keys(b)
+
+    def __contains__(self, key):
+        return self._find(key)[2]
+
+    def get(self, key, default=None):
+        b, i, found = self._find(key)
+        return self.values[b][i] if found else default
+
+    __setitem__ = add
+
+    def pop(self, key, default=None):
+        found, value = self._remove(key)
+        return value if found else default
+
+
+class KeyCursor:
+    """A channel's position in key order, with read-ahead.
+
+    The cursor sits after `after` (None = before the first key). Once it
+    is moving sequentially, keys are taken from the index `batch` at a time,
+    so a full scan is one ordered pass over the index instead of a search per
+    record. Right after a reposition only one key is taken, which keeps KEY()
+    followed by READ KEY= cheap. Only keys are read ahead: a record is
+    fetched when it is read, so KEY() never loads (or decompresses) one.
+    """
+
+    def __init__(self, index, fetch, batch=64):
+        self.index = index
+        self.fetch = fetch # index key -> record values
+        self.batch = batch
+        self.after = None
+        self.buffer = deque()
+        self.generation = None
+        self.sequential = False
+
+    def sync(self, last_key, generation):
+        """Repositions after last_key; drops read-ahead if the file changed."""
+        if last_key != self.after or generation != self.generation:
+            self.after = last_key
+            self.generation = generation
+            self.buffer.clear()
+            self.sequential = False
+
+    def peek(self):
+        """Index key of the next record without moving, or None at EOF."""
+        if not self.buffer:
+            self.buffer.extend(self.index.following(self.after, self.batch if self.sequential else 1))
+        return self.buffer[0] if self.buffer else None
+
+    def next(self):
+        """(key, values) of the next record, moving past it; None at EOF."""
+        key = self.peek()
+        if key is None:
+            return None
+        self.buffer.popleft()
+        self.after = key
+        self.sequential = True
+        return key, self.fetch(key)
@@ -0,0 +1,36 @@
+"""Soundex (SDX) codes, shared by the SDX function and SDX secondary indexes."""
+
+# Letter -> Soundex digit. H and W are dropped (they do not separate equal
+# codes); digits become '0' so they separate like vowels do.
+_SDX_TABLE = str.maketrans(
+    "BFPVCGJKQSXZDTLMNR0123456789",
+    "1111222222223345560000000000",
+    "HW")
+_CODES = frozenset("123456")
+
+
+def soundex(s):
+    """4-character Soundex value (Odell-Russell) of a string, e.g. SMITH -> S530."""
+    s = str(s).upper()
+    if not s:
+        raise ValueError("Empty string for SDX")
+    for i, first in enumerate(s):
+        if first.isalnum():
+            break
+    else:
+        return "    "
+
+    prev = first.translate(_SDX_TABLE)
+    if prev not in _CODES:
+        prev = "0"
+    res = first
+    for code in s[i + 1:].translate(_SDX_TABLE):
+        if code in _CODES:
+            if code != prev:
+                res += code
+                prev = code
+                if len(res) == 4:
+                    break
+        else:
+            prev = "0" # Vowels and other characters separate equal codes
+    return (res + "000")[:4]
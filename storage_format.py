@@ -0,0 +1,275 @@
+"""On-disk formats for BASIC data files.
+
+JSON   - the original indented {"_metadata": ..., "records": ...} layout.
+BINARY - a compact record log: a fixed header carrying type/rec_len/key_len,
+         the full metadata dict (marshal), then length-prefixed records.
+         A later record for the same key replaces an earlier one and a
+         DELETE record removes it, so changes can be appended.
+         Files with metadata 'compress' ('zlib' or 'lzma') store larger
+         record values compressed (op PUT_ZLIB / PUT_LZMA, header version 2).
+
+load() detects the format from the first bytes, so old JSON files keep working.
+"""
+import json
+import marshal
+import os
+import struct
+import threading
+import zlib
+
+try:
+    import lzma
+except ImportError: # Python built without liblzma
+    lzma = None
+
+MAGIC = b'TBF1'
+VERSION = 2 # Highest version read; files without compression are still written as 1
+
+# magic, version, file type, rec_len, key_len, metadata length
+HEADER = struct.Struct('<4sBBIII')
+# op, key length, value length
+RECORD = struct.Struct('<BII')
+
+OP_PUT = 1
+OP_DELETE = 2
+OP_PUT_ZLIB = 3
+OP_PUT_LZMA = 4
+
+COMPRESSION = ('zlib', 'lzma')
+COMPRESS_MIN = 64 # Smaller values are stored as they are
+
+# Raw LZMA2 without the .xz container (about 60 bytes a record), with a
+# dictionary sized for one record: the default 8 MB costs ~1 ms per call
+_LZMA = lzma and {'format': lzma.FORMAT_RAW,
+                  'filters': [{'id': lzma.FILTER_LZMA2, 'preset': 6, 'dict_size': 1 << 20}]}
+
+
+def _lzma_pack(v):
+    return lzma.compress(v, **_LZMA)
+
+
+def _lzma_unpack(v):
+    return lzma.decompress(v, **_LZMA)
+
+
+_PACK = {'zlib': (OP_PUT_ZLIB, zlib.compress), 'lzma': (OP_PUT_LZMA, lzma and _lzma_pack)}
+_UNPACK = {OP_PUT_ZLIB: zlib.decompress, OP_PUT_LZMA: lzma and _lzma_unpack}
+
+NO_LEN = 0xFFFFFFFF # rec_len/key_len of None
+TYPE_CODES = {'DIRECT': 1, 'SORT': 2, 'INDEXED': 3, 'SERIAL': 4}
+TYPE_NAMES = {v: k for k, v in TYPE_CODES.items()}
+
+FORMATS = ('JSON', 'BINARY')
+
+# Bytes written to data files by this process (FileManager's I/O statistics)
+bytes_written = 0
+_written_lock = threading.Lock()
+
+
+def count_written(n):
+    global bytes_written
+    with _written_lock:
+        bytes_written += n
+
+
+def detect(path):
+    """Returns 'BINARY' or 'JSON' for an existing data file."""
+    with open(path, 'rb') as f:
+        return 'BINARY' if f.read(len(MAGIC)) == MAGIC else 'JSON'
+
+
+def _len_field(n):
+    return NO_LEN if n is None else int(n)
+
+
+def check_compression(compress):
+    """Raises ValueError unless compress is None or a usable codec."""
+    if compress is not None and (compress not in COMPRESSION or _PACK[compress][1] is None):
+        raise ValueError(f"Unknown or unavailable compression: {compress}")
+
+
+def encode_header(metadata):
+    meta = marshal.dumps(metadata)
+    version = 2 if metadata.get('compress') else 1 # Older readers refuse rather than misread
+    return HEADER.pack(MAGIC, version, TYPE_CODES.get(metadata.get('type'), 0),
+                       _len_field(metadata.get('rec_len')), _len_field(metadata.get('key_len')),
+                       len(meta)) + meta
+
+
+def encode_record(key, values, op=OP_PUT, compress=None):
+    k = str(key).encode('utf-8', 'surrogatepass')
+    v = marshal.dumps(values) if op == OP_PUT else b''
+    if compress and len(v) >= COMPRESS_MIN:
+        packed_op, pack = _PACK[compress]
+        packed = pack(v)
+        if len(packed) < len(v):
+            op, v = packed_op, packed
+    return RECORD.pack(op, len(k), len(v)) + k + v
+
+
+def decode_values(op, raw):
+    """Record values from the value bytes of a PUT record of any kind."""
+    if op != OP_PUT:
+        unpack = _UNPACK.get(op)
+        if unpack is None:
+            raise ValueError(f"Unsupported record encoding {op} (lzma not available?)")
+        raw = unpack(raw)
+    return marshal.loads(raw)
+
+
+def read_header(f):
+    """Reads the header from a binary file positioned at 0; returns metadata."""
+    raw = f.read(HEADER.size)
+    magic, version, type_code, rec_len, key_len, meta_len = HEADER.unpack(raw)
+    if magic != MAGIC or version > VERSION:
+        raise ValueError("Not a BASIC binary data file")
+    metadata = marshal.loads(f.read(meta_len))
+    # The fixed fields are authoritative (readable without unmarshalling)
+    metadata['type'] = TYPE_NAMES.get(type_code, metadata.get('type'))
+    metadata['rec_len'] = None if rec_len == NO_LEN else rec_len
+    metadata['key_len'] = None if key_len == NO_LEN else key_len
+    return metadata
+
+
+def iter_records(f):
+    """Yields (op, key, values) for every record from the current position;
+    op is OP_PUT or OP_DELETE (compressed values come back unpacked)."""
+    while True:
+        raw = f.read(RECORD.size)
+        if len(raw) < RECORD.size:
+            return
+        op, klen, vlen = RECORD.unpack(raw)
+        key = f.read(klen).decode('utf-8', 'surrogatepass')
+        if op == OP_DELETE:
+            yield op, key, None
+        else:
+            yield OP_PUT, key, decode_values(op, f.read(vlen))
+
+
+def read_metadata(path):
+    """Metadata of a data file without reading its records (where possible)."""
+    if detect(path) == 'BINARY':
+        with open(path, 'rb') as f:
+            return read_header(f)
+    with open(path, 'r') as f:
+        head = f.read(65536)
+    # dump() and dump_items() write the metadata first
+    start = head.find('"_metadata"')
+    if start != -1:
+        try:
+            colon = head.index(':', start)
+            return json.JSONDecoder().raw_decode(head[colon + 1:].lstrip())[0]
+        except ValueError:
+            pass # Longer than the first block, or not ours
+    return load(path)[0]
+
+
+def load(path, file_type=None, rec_len=None):
+    """Reads a data file in either format. Returns (metadata, records, fmt)."""
+    if detect(path) == 'BINARY':
+        records = {}
+        with open(path, 'rb') as f:
+            metadata = read_header(f)
+            for op, key, values in iter_records(f):
+                if op == OP_PUT:
+                    records[key] = values
+                else:
+                    records.pop(key, None)
+        return metadata, records, 'BINARY'
+
+    with open(path, 'r') as f:
+        try:
+            file_content = json.load(f)
+        except json.JSONDecodeError:
+            # Empty or corrupted file: treat as an old-style file without records
+            file_content = {}
+
+    # If the file uses the old format (no metadata), migrate it or handle it
+    if "_metadata" not in file_content:
+        metadata = {
+            "type": file_type or "SERIAL",
+            "rec_len": rec_len,
+            "key_len": None
+        }
+        records = file_content
+    else:
+        metadata = file_content["_metadata"]
+        records = file_content["records"]
+        metadata.pop('count', None) # Only valid for the file as it was written
+    return metadata, records, 'JSON'
+
+
+def dump(path, metadata, records, fmt='JSON'):
+    """Writes a whole data file, replacing any existing one atomically."""
+    tmp = path + '.tmp'
+    if fmt == 'BINARY':
+        compress = metadata.get('compress')
+        with open(tmp, 'wb') as f:
+            f.write(encode_header(metadata))
+            for key, values in records.items():
+                f.write(encode_record(key, values, compress=compress))
+            count_written(f.tell())
+    else:
+        file_content = {
+            # With the record count, so SELECT can report it from read_metadata()
+            "_metadata": dict(metadata, count=len(records)),
+            "records": records
+        }
+        with open(tmp, 'w') as f:
+            json.dump(file_content, f, indent=2)
+            count_written(f.tell())
+    os.replace(tmp, path)
+
+
+def dump_items(path, metadata, items, fmt='JSON'):
+    """Like dump(), but streams (key, values) pairs from any iterable, so the
+    records never have to be in memory at once. Returns the record count."""
+    tmp = path + '.tmp'
+    count = 0
+    if fmt == 'BINARY':
+        compress = metadata.get('compress')
+        with open(tmp, 'wb') as f:
+            f.write(encode_header(metadata))
+            for key, values in items:
+                f.write(encode_record(key, values, compress=compress))
+                count += 1
+            count_written(f.tell())
+    else:
+        with open(tmp, 'w') as f:
+            f.write('{\n  "_metadata": ' + json.dumps(metadata) + ',\n  "records": {')
+            for key, values in items:
+                f.write((',\n    ' if count else '\n    ') + json.dumps(str(key)) + ': ' + json.dumps(values))
+                count += 1
+            f.write('\n  }\n}\n')
+            count_written(f.tell())
+    os.replace(tmp, path)
+    return count
+
+
+def convert_file(path, fmt):
+    """Rewrites one data file in `fmt`. Returns (old_size, new_size)."""
+    old_size = os.path.getsize(path)
+    metadata, records, current = load(path)
+    if current != fmt:
+        dump(path, metadata, records, fmt)
+    return old_size, os.path.getsize(path)
+
+
+def convert_directory(directory, fmt):
+    """Converts every data file in a storage directory.
+
+    Returns a list of (filename, old_size, new_size); files that cannot be
+    parsed (e.g. stray TEXT files with a .json name) are skipped.
+    """
+    results = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith('.json') or not os.path.isfile(path):
+            continue
+        try:
+            old_size, new_size = convert_file(path, fmt)
+        except (ValueError, OSError, EOFError) as e:
+            print(f"Warning: skipping {path}: {e}")
+            continue
+        results.append((name, old_size, new_size))
+    return results
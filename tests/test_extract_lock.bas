@@ -0,0 +1,25 @@
+10 REM TEST EXTRACT RECORD LOCKING ACROSS CHANNELS
+20 ERASE "test_lock", ERR=30
+30 DIRECT "test_lock", 10, 20
+40 OPEN (1) "test_lock"
+50 OPEN (2) "test_lock"
+60 WRITE (1, KEY="A") "VALUE A"
+70 EXTRACT (1, KEY="A") A$
+80 PRINT "EXTRACTED ON CHANNEL 1: "; A$
+90 READ (2, KEY="A", ERR=120) B$
+100 PRINT "FAIL: LOCKED RECORD READ ON CHANNEL 2"
+110 GOTO 130
+120 PRINT "PASS: RECORD BUSY ON CHANNEL 2"
+130 EXTRACT (2, KEY="A", TIM=0, ERR=160) B$
+140 PRINT "FAIL: SECOND EXTRACT GOT THE LOCK"
+150 GOTO 170
+160 PRINT "PASS: SECOND EXTRACT REFUSED"
+170 WRITE (1, KEY="A") "VALUE A2"
+180 READ (2, KEY="A", ERR=210) B$
+190 PRINT "PASS: WRITE RELEASED LOCK, READ "; B$
+200 GOTO 220
+210 PRINT "FAIL: LOCK NOT RELEASED BY WRITE"
+220 CLOSE (2)
+230 CLOSE (1)
+240 ERASE "test_lock"
+250 END
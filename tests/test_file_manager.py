@@ -0,0 +1,820 @@
+"""Checks of FileManager behaviour that a BASIC program cannot observe
+(system calls, memory use, storage options). Run with: python -m pytest tests"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_io # noqa: E402
+import extsort # noqa: E402
+import record_store # noqa: E402
+import storage_format # noqa: E402
+from dir_catalog import catalog # noqa: E402
+from file_manager import FileManager, RecordBusyError # noqa: E402
+from record_store import CompactKeyIndex # noqa: E402
+from soundex import soundex # noqa: E402
+
+
+@pytest.fixture
+def make_fm(tmp_path, monkeypatch):
+    """Makes FileManagers on fresh disks D0/D1 (and memory disk D9) in
+    tmp_path; keyword arguments add IPLINPUT settings (FORMAT='BINARY')."""
+    monkeypatch.chdir(tmp_path)
+    # IPLINPUT settings that hold for the whole process
+    monkeypatch.setattr(record_store.page_cache, 'budget', record_store.page_cache.budget)
+    monkeypatch.setattr(CompactKeyIndex, 'min_keys', CompactKeyIndex.min_keys)
+    monkeypatch.setattr(catalog, 'ttl', catalog.ttl)
+
+    def make(**settings):
+        lines = [f"D0 = {tmp_path}/d0", f"D1 = {tmp_path}/d1", "D9 = :memory:"]
+        lines += [f"{key} = {value}" for key, value in settings.items()]
+        (tmp_path / 'IPLINPUT').write_text('\n'.join(lines) + '\n')
+        return FileManager()
+    return make
+
+
+@pytest.fixture
+def fm(make_fm):
+    return make_fm()
+
+
+def _count_calls(monkeypatch, module, name):
+    calls = []
+    real = getattr(module, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args[0] if args else None)
+        return real(*args, **kwargs)
+    monkeypatch.setattr(module, name, counted)
+    return calls
+
+
+# --- Record locks (EXTRACT) ---
+
+def test_record_locks_stay_in_the_process(fm, tmp_path, monkeypatch):
+    other = FileManager() # A second session on the same files
+    fm.create('LOCKDISK', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'LOCKDISK')
+    fm.write(1, key='A', values=['x'])
+    other.open(1, 'LOCKDISK')
+    calls = _count_calls(monkeypatch, os.path, 'exists')
+    assert fm.extract(1, key='A') == ['x']
+    with pytest.raises(RecordBusyError):
+        other.read(1, key='A')
+    fm.read(1, key='A') # Releases the lock
+    assert other.read(1, key='A') == ['x']
+    other.close(1)
+    fm.close(1)
+    assert calls == [] # No lock files to look for
+    assert not list(tmp_path.rglob('*.lck'))
+
+
+# --- Flush policies (FLUSH=) ---
+
+def _flushes(fm, name):
+    stats = fm.io_stats()[os.path.realpath(fm._get_path(name, search=True))]
+    return stats['flushes'], stats['bytes']
+
+
+def test_read_only_open_read_close_writes_nothing(fm):
+    fm.create('LOOKUP', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'LOOKUP')
+    fm.write(1, key='A', values=['x'])
+    fm.close(1)
+    before = _flushes(fm, 'LOOKUP')
+    assert before[0] == 1
+    for _ in range(3):
+        fm.open(1, 'LOOKUP')
+        assert fm.read(1, key='A') == ['x']
+        assert fm.read(1, key='B') is None
+        fm.close(1)
+    assert _flushes(fm, 'LOOKUP') == before
+
+
+@pytest.mark.parametrize('policy', ['CLOSE', 'WRITES 2', 'INTERVAL 5', 'EXPLICIT'])
+def test_flush_policies(make_fm, monkeypatch, policy):
+    clock = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    fm = make_fm(FLUSH=policy)
+    fm.create('POLICY', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'POLICY')
+    flushes = []
+    for i in range(3):
+        fm.write(1, key=f'K{i}', values=[i])
+        flushes.append(_flushes(fm, 'POLICY')[0])
+    clock[0] += 10
+    fm.read(1, key='K0') # INTERVAL: changes are overdue, a read writes them
+    flushes.append(_flushes(fm, 'POLICY')[0])
+    fm.close(1)
+    flushes.append(_flushes(fm, 'POLICY')[0])
+    fm.flush()
+    flushes.append(_flushes(fm, 'POLICY')[0])
+    assert flushes == {
+        'CLOSE': [0, 0, 0, 0, 1, 1],
+        'WRITES 2': [0, 1, 1, 1, 2, 2],
+        'INTERVAL 5': [0, 0, 0, 1, 1, 1],
+        'EXPLICIT': [0, 0, 0, 0, 0, 1],
+    }[policy]
+
+
+# --- Transactions (BEGIN/COMMIT/ROLLBACK) ---
+
+def test_transaction_locks_changed_records_until_it_ends(fm):
+    other = FileManager() # A second session on the same files
+    fm.create('TXISO', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'TXISO')
+    other.open(1, 'TXISO')
+    fm.write(1, key='A', values=['committed'])
+    fm.begin()
+    fm.write(1, key='A', values=['dirty'])
+    fm.write(1, key='B', values=['new'])
+    fm.open(2, 'TXISO')
+    assert fm.read(2, key='A') == ['dirty'] # The session sees its own changes
+    for key in ('A', 'B'):
+        with pytest.raises(RecordBusyError):
+            other.read(1, key=key)
+        with pytest.raises(RecordBusyError):
+            other.write(1, key=key, values=['theirs'])
+    fm.rollback()
+    assert other.read(1, key='A') == ['committed']
+    other.write(1, key='B', values=['theirs'])
+    assert fm.read(1, key='B') == ['theirs']
+
+
+
+CRASH_AFTER_FLUSH = """
+import os, sys
+sys.path.insert(0, sys.argv[1])
+from file_manager import FileManager
+fm = FileManager()
+for name in ('TXX', 'TXY'):
+    fm.create(name, 'DIRECT', key_len=10, disk_num=0)
+fm.open(1, 'TXX')
+fm.open(2, 'TXY')
+fm.begin()
+fm.write(1, key='K', values=['a'])
+fm.write(2, key='K', values=['a'])
+fm.commit()
+fm.close(1) # TXX is flushed, TXY stays open and unflushed
+fm.open(1, 'TXX')
+fm.write(1, key='K', values=['c']) # Not in a transaction
+fm.close(1)
+os._exit(0) # Crash: no CLOSE of TXY, no flush at exit
+"""
+
+
+def test_recovery_does_not_undo_changes_flushed_after_the_commit(make_fm, tmp_path):
+    import subprocess
+    make_fm()
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', CRASH_AFTER_FLUSH, repo], cwd=tmp_path, check=True)
+    journals = list((tmp_path / 'basic_storage').glob('journal.*.log'))
+    assert len(journals) == 1 # Only TXY's op is left in it
+    fm = FileManager() # Replays the dead process's journal
+    assert not list((tmp_path / 'basic_storage').glob('journal.*.log'))
+    fm.open(1, 'TXX')
+    fm.open(2, 'TXY')
+    assert fm.read(1, key='K') == ['c']
+    assert fm.read(2, key='K') == ['a'] # Committed, never flushed: recovered
+    fm.close(1)
+    fm.close(2)
+
+# --- Bulk import (*IMPORT) ---
+
+def test_import_stores_numeric_keys_as_numbers(fm, tmp_path):
+    source = tmp_path / 'rows.csv'
+    source.write_text("10,TIEN\n9,NEGEN\n-2.5,MIN\nABC,TEKST\n")
+    fm.create('IMPKEYS', 'DIRECT', key_len=8, disk_num=0)
+    assert bulk_io.import_file(fm, 'IMPKEYS', str(source))['records'] == 4
+    fm.open(1, 'IMPKEYS')
+    assert fm.read(1, key=10) == ['TIEN']
+    assert fm.read(1, key=10.0) == ['TIEN']
+    assert [row[0] for row in fm.export_rows('IMPKEYS')] == [-2.5, 9, 10, 'ABC']
+
+
+# --- Secondary indexes (KNUM=, SDX) ---
+
+def _members(fm, name, sdx=False):
+    fm.create(name, 'DIRECT', key_len=10, disk_num=0)
+    knum = fm.define_index(name, field=0 if sdx else 1, sdx=sdx)
+    fm.open(1, name)
+    fm.write(1, key='M1', values=['JANSEN', 'AMSTERDAM'])
+    fm.write(1, key='M2', values=['PIETERS', 'UTRECHT'])
+    fm.write(1, key='M3', values=['DE VRIES', 'AMSTERDAM'])
+    return knum
+
+
+def test_knum_index_survives_close_and_reopen(fm):
+    knum = _members(fm, 'KNUMKEEP')
+    assert fm.lookup(1, knum, 'AMSTERDAM') == ['M1', 'M3']
+    assert fm.read(1, key='UTRECHT', knum=knum) == ['PIETERS', 'UTRECHT']
+    index = fm.channels[1]['shared']['secondary'][knum]
+    fm.close(1)
+    fm.open(1, 'KNUMKEEP')
+    assert fm.channels[1]['shared']['secondary'][knum] is index # Not rebuilt by a scan
+    fm.write(1, key='M2', values=['PIETERS', 'AMSTERDAM'])
+    assert fm.lookup(1, knum, 'AMSTERDAM') == ['M1', 'M2', 'M3']
+    fm.close(1)
+    fm.open(1, 'KNUMKEEP')
+    assert fm.lookup(1, knum, 'UTRECHT') == []
+
+
+def test_knum_index_rebuilt_when_file_changed_elsewhere(fm):
+    knum = _members(fm, 'KNUMSTALE')
+    assert fm.lookup(1, knum, 'UTRECHT') == ['M2']
+    path = fm.channels[1]['shared']['path']
+    fm.close(1)
+    # Another process rewrites the file
+    metadata, records, fmt = storage_format.load(path)
+    records['M4'] = ['BAKKER', 'UTRECHT']
+    storage_format.dump(path, metadata, records, fmt)
+    fm.open(1, 'KNUMSTALE')
+    assert fm.channels[1]['shared']['secondary'] == {}
+    assert fm.lookup(1, knum, 'UTRECHT') == ['M2', 'M4']
+
+
+def test_find_similar_uses_sdx_index_across_opens(fm):
+    knum = _members(fm, 'SDXKEEP', sdx=True)
+    assert fm.find_similar(1, 'JANSSEN') == ['M1']
+    assert fm.read(1, key=soundex('PETERS'), knum=knum) == ['PIETERS', 'UTRECHT']
+    index = fm.channels[1]['shared']['secondary'][knum]
+    fm.close(1)
+    fm.open(1, 'SDXKEEP')
+    assert fm.channels[1]['shared']['secondary'][knum] is index
+    assert fm.find_similar(1, 'DE FRIES') == ['M3']
+
+
+# --- Disks and the directory catalog ---
+
+def test_open_searches_memory_disk_in_disk_order(fm, monkeypatch):
+    import file_manager
+    fm.create('ONMEM', 'DIRECT', key_len=10, disk_num=9)
+    fm.create('BOTH', 'DIRECT', key_len=10, disk_num=9)
+    fm.create('BOTH', 'DIRECT', key_len=10, disk_num=0)
+    calls = _count_calls(monkeypatch, file_manager.catalog, 'exists')
+    assert fm._get_path('ONMEM', search=True) == ':memory:/ONMEM.json'
+    assert fm._get_path('BOTH', search=True).endswith('/d0/BOTH.json') # D0 comes before D9
+    assert calls == [] # The memory disk is not a directory to list
+
+
+def test_warm_call_lookup_does_not_touch_the_disk(fm, tmp_path, monkeypatch):
+    (tmp_path / 'progs').mkdir()
+    (tmp_path / 'progs' / 'SUB.bas').write_text('10 EXIT\n')
+    fm.program_paths = ['.', 'progs']
+    assert fm.find_program('SUB') == os.path.join('progs', 'SUB.bas')
+    stats = _count_calls(monkeypatch, os, 'stat')
+    listings = _count_calls(monkeypatch, os, 'scandir')
+    for _ in range(10):
+        assert fm.find_program('SUB') == os.path.join('progs', 'SUB.bas')
+    assert stats == [] and listings == []
+    assert fm.find_program('MISSING') is None
+
+
+
+def test_lookups_ignore_case_where_the_filesystem_does(fm, tmp_path, monkeypatch):
+    isfile = os.path.isfile
+
+    def case_insensitive(path): # As on macOS or Windows
+        directory, name = os.path.split(path)
+        try:
+            return any(n.casefold() == name.casefold() and isfile(os.path.join(directory, n))
+                       for n in os.listdir(directory or '.'))
+        except OSError:
+            return False
+    monkeypatch.setattr(os.path, 'isfile', case_insensitive)
+    (tmp_path / 'progs').mkdir()
+    (tmp_path / 'progs' / 'MENU.BAS').write_text('10 EXIT\n')
+    fm.program_paths = ['progs']
+    assert fm.find_program('menu') == os.path.join('progs', 'MENU.BAS')
+    fm.create('KLANT', 'DIRECT', key_len=10, disk_num=1)
+    assert fm._get_path('klant', search=True).endswith('/d1/KLANT.json')
+    assert fm._exists(str(tmp_path / 'd1' / 'Klant.json'))
+    stats = _count_calls(monkeypatch, os, 'stat')
+    assert fm.find_program('menu') == os.path.join('progs', 'MENU.BAS')
+    assert stats == [] # Remembered as an alias
+    assert fm.find_program('nomenu') is None
+
+# --- SELECT ---
+
+def test_select_counts_json_records_from_metadata(fm, monkeypatch):
+    fm.create('SELKEYED', 'DIRECT', key_len=10, disk_num=1)
+    fm.create('SELLOG', 'SERIAL', disk_num=1)
+    fm.open(1, 'SELKEYED')
+    fm.open(2, 'SELLOG')
+    for i in range(5):
+        fm.write(1, key=f'K{i}', values=[i])
+        fm.write(2, values=[i])
+    fm.remove(2, key='1')
+    fm.close(1)
+    fm.close(2)
+
+    def no_parse(*args, **kwargs):
+        raise AssertionError("record data parsed")
+    monkeypatch.setattr(FileManager, '_load_file', no_parse)
+    rows = {row[0]: row for row in fm.select_files('SEL*')}
+    assert rows['SELKEYED'][1:6] == ['D1', 'DIRECT', 0, 10, 5]
+    assert rows['SELLOG'][1:6] == ['D1', 'SERIAL', 0, 0, 4]
+
+
+
+def test_select_lists_each_disk_by_name(fm):
+    for name, disk in [('SORTC', 1), ('SORTA', 1), ('SORTB', 0), ('SORTD', 1), ('SORTE', 0)]:
+        fm.create(name, 'SERIAL', disk_num=disk)
+    assert [row[:2] for row in fm.select_files('SORT?')] == [
+        ['SORTB', 'D0'], ['SORTE', 'D0'], ['SORTA', 'D1'], ['SORTC', 'D1'], ['SORTD', 'D1']]
+
+# --- Partitioned files ---
+
+def _numbered(fm, name, n):
+    fm.create(name, 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, name)
+    for i in range(1, n + 1):
+        fm.write(1, key=i, values=[f'R{i}'])
+    fm.close(1)
+
+
+def test_range_partition_on_numeric_bounds(fm):
+    _numbered(fm, 'PARTNUM', 300)
+    # As file_tools passes them: text from the command line
+    counts = fm.partition('PARTNUM', ['D0', 'D1', 'D0'], ['100', '250'], bulk_io.parse_values)
+    assert counts == [99, 150, 51]
+    fm.open(1, 'PARTNUM')
+    assert fm.read(1, key=150) == ['R150']
+    fm.close(1)
+    fm.open(1, 'PARTNUM')
+    keys = []
+    while True:
+        try:
+            keys.append(fm.get_next_key(1))
+        except EOFError:
+            break
+        fm.read(1)
+    assert keys == list(range(1, 301))
+
+
+def test_hash_partition_keeps_every_record(fm, tmp_path):
+    _numbered(fm, 'PARTHASH', 200)
+    counts = fm.partition('PARTHASH', ['D0', 'D1'])
+    assert sum(counts) == 200 and min(counts) > 0
+    assert (tmp_path / 'd1' / 'PARTHASH.p1.json').exists()
+    fm.open(1, 'PARTHASH')
+    fm.write(1, key=201, values=['R201'])
+    fm.remove(1, key=7)
+    fm.close(1)
+    fm.open(1, 'PARTHASH')
+    assert fm.read(1, key=201) == ['R201']
+    assert fm.read(1, key=7) is None
+
+
+# --- BINARY format ---
+
+def test_binary_files_round_trip_and_convert_back(make_fm, tmp_path):
+    fm = make_fm(FORMAT='BINARY')
+    fm.create('BINKEYED', 'DIRECT', key_len=10, disk_num=0)
+    fm.create('BINLOG', 'SERIAL', disk_num=0)
+    fm.open(1, 'BINKEYED')
+    fm.open(2, 'BINLOG')
+    for i in range(50):
+        fm.write(1, key=f'K{i:02d}', values=[f'naam {i}', i, i / 2])
+        fm.write(2, values=[f'regel {i}'])
+    fm.remove(1, key='K07')
+    fm.close(1)
+    fm.close(2)
+    paths = [str(tmp_path / 'd0' / name) for name in ('BINKEYED.json', 'BINLOG.json')]
+    assert [storage_format.detect(p) for p in paths] == ['BINARY', 'BINARY']
+
+    fm.open(1, 'BINKEYED')
+    assert fm.read(1, key='K12') == ['naam 12', 12, 6.0]
+    assert fm.read(1, key='K07') is None
+    fm.close(1)
+    records = [storage_format.load(p)[1] for p in paths]
+    assert len(records[0]) == 49 and len(records[1]) == 50
+
+    converted = storage_format.convert_directory(str(tmp_path / 'd0'), 'JSON')
+    assert sorted(name for name, _, _ in converted) == ['BINKEYED.json', 'BINLOG.json']
+    assert [storage_format.detect(p) for p in paths] == ['JSON', 'JSON']
+    assert [storage_format.load(p)[1] for p in paths] == records
+    fm.open(2, 'BINLOG')
+    assert fm.read(2, ind=49) == ['regel 49']
+
+
+def test_old_json_files_without_metadata_still_open(fm, tmp_path):
+    (tmp_path / 'd0').mkdir(exist_ok=True)
+    (tmp_path / 'd0' / 'OLDSTYLE.json').write_text('{"0": ["EEN"], "1": ["TWEE"]}')
+    fm.open(1, 'OLDSTYLE', 'SERIAL')
+    assert fm.read(1) == ['EEN']
+    assert fm.read(1) == ['TWEE']
+
+
+# --- TEXT files ---
+
+def test_text_lines_are_read_one_buffer_at_a_time(fm, tmp_path):
+    fm.create('BIGLOG', 'TEXT')
+    fm.open(1, 'BIGLOG', 'TEXT')
+    for i in range(20000):
+        fm.write(1, values=f"regel {i:05d} " + 'x' * 40 + "\n")
+    fm.close(1)
+    path = tmp_path / 'basic_storage' / 'BIGLOG' # OPEN finds TEXT files in the storage dir
+    assert path.stat().st_size == 20000 * 53
+    stamp = path.stat().st_mtime_ns
+
+    fm.open(1, 'BIGLOG', 'TEXT')
+    handle = fm.channels[1]['shared']['handle']
+    assert fm.read_text(1) == "regel 00000 " + 'x' * 40
+    assert handle.tell() <= 8192 # One read buffer, not the rest of the file
+    assert fm.read_text(1, ind=53 * 19999) == "regel 19999 " + 'x' * 40
+    assert fm.read_text(1) == "regel 00001 " + 'x' * 40 # IND= leaves the position alone
+    fm.close(1)
+    assert path.stat().st_mtime_ns == stamp # Nothing written, nothing rewritten
+
+
+def test_text_write_in_the_middle_is_positional(fm):
+    fm.create('PATCHED', 'TEXT')
+    fm.open(1, 'PATCHED', 'TEXT')
+    fm.write(1, values="AAAA\nBBBB\nCCCC\n")
+    fm.write(1, ind=5, values="bbbb")
+    fm.write(1, ind=20, values="EIND")
+    fm.close(1)
+    fm.open(1, 'PATCHED', 'TEXT')
+    assert [fm.read_text(1) for _ in range(3)] == ["AAAA", "bbbb", "CCCC"]
+    assert fm.read_text(1, record=True) == "\0" * 5 + "EIND" # Gap filled with $00
+    assert fm.read_text(1) is None
+
+
+# --- SORT files from large input (external merge sort) ---
+
+def test_sorted_unique_spills_runs_and_cleans_up(tmp_path, monkeypatch):
+    written = _count_calls(monkeypatch, extsort, '_write_run')
+    keys = [f"K{(i * 7919) % 1000:04d}" for i in range(5000)] # Every key 5 times
+    assert list(extsort.sorted_unique(keys, chunk_size=300, tmp_dir=str(tmp_path))) == \
+        sorted(set(keys))
+    assert len(written) == 17 # ceil(5000 / 300) runs on disk
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_build_sort_from_serial_extract(make_fm, tmp_path):
+    for fmt in ('JSON', 'BINARY'):
+        fm = make_fm(FORMAT=fmt)
+        fm.create(f'EXTRACT{fmt}', 'SERIAL', disk_num=0)
+        fm.open(1, f'EXTRACT{fmt}')
+        for i in range(2000):
+            fm.write(1, values=[f"{i}", f"C{(i * 37) % 500:03d}-{i}"])
+        fm.close(1)
+        count = fm.build_sort(f'BYCODE{fmt}', f'EXTRACT{fmt}', field=1, pos=1, length=4,
+                              disk_num=1, chunk_size=128)
+        assert count == 500
+        fm.open(2, f'BYCODE{fmt}')
+        keys = []
+        while True:
+            try:
+                keys.append(fm.get_next_key(2))
+            except EOFError:
+                break
+            fm.read(2)
+        fm.close(2)
+        assert keys == [f"C{i:03d}" for i in range(500)]
+        assert not [p for p in (tmp_path / 'd1').iterdir() if p.name.startswith('sort_run_')]
+
+
+
+def test_build_sort_keeps_numeric_keys_numeric(fm):
+    fm.create('AMOUNTS', 'SERIAL', disk_num=0)
+    fm.open(1, 'AMOUNTS')
+    for amount in [10, 2, 1.5, -3, 100, 2]:
+        fm.write(1, values=['x', amount])
+    fm.close(1)
+    assert fm.build_sort('BYAMOUNT', 'AMOUNTS', field=1, disk_num=1) == 5
+    fm.open(2, 'BYAMOUNT')
+    keys = []
+    while True:
+        try:
+            keys.append(fm.get_next_key(2))
+        except EOFError:
+            break
+        fm.read(2)
+    assert keys == [-3, 1.5, 2, 10, 100]
+    assert fm.read(2, key=10) is not None # Found by a numeric KEY=
+    fm.close(2)
+
+@pytest.mark.parametrize('fmt', ['CSV', 'JSONL', 'FIXED:6,10,5'])
+def test_bulk_export_import_round_trip(fm, tmp_path, monkeypatch, fmt):
+    name = 'BULK' + fmt.split(':')[0]
+    fm.create(name, 'DIRECT', key_len=6, disk_num=0)
+    fm.open(1, name)
+    for i in range(250):
+        fm.write(1, key=f'M{i:04d}', values=[f'Naam {i}', i * 3])
+    fm.close(1)
+    dest = str(tmp_path / 'out.txt')
+    progress = []
+    monkeypatch.setattr(bulk_io, 'PROGRESS_EVERY', 100)
+    stats = bulk_io.export_file(fm, name, dest, fmt, progress=lambda n, s: progress.append(n))
+    assert stats['records'] == 250 and stats['rate'] > 0
+    assert progress == [100, 200]
+
+    fm.create(name + 'IN', 'DIRECT', key_len=6, disk_num=1)
+    assert bulk_io.import_file(fm, name + 'IN', dest, fmt)['records'] == 250
+    assert list(fm.export_rows(name + 'IN')) == list(fm.export_rows(name))
+
+
+def test_bulk_import_appends_to_serial(fm, tmp_path):
+    source = tmp_path / 'log.jsonl'
+    source.write_text('["start", 1]\n\n["stop", 2.5]\n')
+    fm.create('BULKLOG', 'SERIAL', disk_num=0)
+    bulk_io.import_file(fm, 'BULKLOG', str(source), 'JSONL')
+    bulk_io.import_file(fm, 'BULKLOG', str(source), 'JSONL')
+    assert list(fm.export_rows('BULKLOG')) == [['start', 1], ['stop', 2.5]] * 2
+
+
+
+def test_bulk_import_refuses_transactions_and_locked_records(fm):
+    other = FileManager() # A second session on the same files
+    fm.create('IMPLOCK', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'IMPLOCK')
+    fm.write(1, key='A', values=['old'])
+    fm.begin()
+    with pytest.raises(RuntimeError):
+        fm.import_rows('IMPLOCK', [['B', 'new']])
+    fm.rollback()
+    other.open(1, 'IMPLOCK')
+    other.extract(1, key='A')
+    with pytest.raises(RecordBusyError):
+        fm.import_rows('IMPLOCK', [['A', 'new']])
+    other.begin()
+    other.read(1, key='A') # Releases the EXTRACT lock...
+    other.write(1, key='C', values=['txn']) # ...but the transaction holds C
+    with pytest.raises(RecordBusyError):
+        fm.import_rows('IMPLOCK', [['C', 'new']])
+    other.commit()
+    other.close(1)
+    assert fm.import_rows('IMPLOCK', [['A', 'new'], ['C', 'new']]) == 2
+    assert fm.read(1, key='A') == ['new'] and fm.read(1, key='C') == ['new']
+    fm.close(1)
+
+# --- Page cache (BINARY keyed files) ---
+
+def test_paged_file_larger_than_the_cache_budget(make_fm):
+    fm = make_fm(FORMAT='BINARY', CACHE='64K')
+    before = fm.cache_stats()
+    fm.create('PAGED', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'PAGED')
+    for i in range(3000):
+        fm.write(1, key=f'K{i:05d}', values=[f'{i}' * 50]) # ~600 KB in all
+    during = fm.cache_stats()
+    assert during['spills'] > before['spills'] # Changes went to disk before CLOSE
+    assert during['dirty'] <= 64 * 1024
+    fm.close(1)
+
+    fm.open(1, 'PAGED')
+    for i in range(0, 3000, 7):
+        assert fm.read(1, key=f'K{i:05d}') == [f'{i}' * 50]
+    assert fm.read(1, key='K00007') == ['7' * 50]
+    after = fm.cache_stats()
+    assert after['misses'] > during['misses'] and after['hits'] > during['hits']
+    assert after['evictions'] > during['evictions']
+    assert after['bytes'] <= after['budget'] == 64 * 1024
+    fm.close(1)
+
+
+
+def test_key_reads_ahead_keys_only(make_fm, monkeypatch):
+    fm = make_fm(FORMAT='BINARY', CACHE='64K')
+    fm.create('AHEAD', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'AHEAD')
+    for i in range(500):
+        fm.write(1, key=f'K{i:05d}', values=[f'{i}' * 50])
+    fm.close(1)
+    fetched = _count_calls(monkeypatch, record_store.PagedStore, 'get')
+    fm.open(1, 'AHEAD')
+    assert fm.read(1) == ['0' * 50]
+    assert fm.read(1) == ['1' * 50] # Sequential now: keys are read ahead
+    assert len(fetched) == 2
+    assert fm.get_next_key(1) == 'K00002'
+    assert len(fetched) == 2 # KEY() loads no record
+    while fm.get_next_key(1) < 'K00010':
+        fm.read(1)
+    assert len(fetched) == 10 # One per READ
+    fm.close(1)
+
+# --- Bloom filters ---
+
+def test_missing_keys_are_answered_by_the_bloom_filter(make_fm, monkeypatch):
+    fm = make_fm(FORMAT='BINARY')
+    fm.create('BLOOMED', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'BLOOMED')
+    for i in range(2000):
+        fm.write(1, key=f'K{i:05d}', values=[i])
+    fm.close(1)
+    fm.open(1, 'BLOOMED')
+    store_reads = _count_calls(monkeypatch, record_store.PagedStore, 'get')
+    for i in range(2000, 5000):
+        assert fm.read(1, key=f'K{i:05d}') is None
+        assert fm.insert_if_absent(1, key=f'N{i:05d}', values=[i]) # DOM= check, then the write
+    assert len(store_reads) < 150 # Only the false positives reach the store
+    stats = fm.bloom_stats(1)
+    assert stats['negatives'] >= 5850
+    assert stats['fp_rate'] == stats['false_positives'] / (stats['negatives'] + stats['false_positives'])
+    assert stats['fp_rate'] < 0.05 and 0 < stats['expected_fp_rate'] < 0.05
+    assert stats['capacity'] > 4000 # Rebuilt larger when it filled up
+    # Still no false negatives
+    assert all(fm.read(1, key=f'N{i:05d}') == [i] for i in range(2000, 5000))
+    assert all(fm.read(1, key=f'K{i:05d}') == [i] for i in range(2000))
+
+
+# --- WRITE DOM= (insert_if_absent) ---
+
+def test_insert_if_absent_has_one_winner_across_sessions(fm):
+    import threading
+    fm.create('RACE', 'DIRECT', key_len=10, disk_num=0)
+    sessions = [FileManager() for _ in range(8)]
+    for session in sessions:
+        session.open(1, 'RACE')
+    start = threading.Barrier(len(sessions))
+    results = {}
+
+    def writer(n, session):
+        start.wait()
+        results[n] = [session.insert_if_absent(1, key=f'K{k}', values=[n]) for k in range(200)]
+    threads = [threading.Thread(target=writer, args=(n, s)) for n, s in enumerate(sessions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for k in range(200):
+        winners = [n for n in results if results[n][k]]
+        assert len(winners) == 1
+        assert sessions[0].read(1, key=f'K{k}') == [winners[0]]
+    assert sessions[0].upsert(1, key='K0', values=['new']) is False # Replaced, not new
+    assert sessions[1].read(1, key='K0') == ['new']
+
+
+# --- Compaction ---
+
+def test_compact_drops_dead_space_and_keeps_records(make_fm):
+    fm = make_fm(FORMAT='BINARY')
+    fm.create('CHURN', 'DIRECT', key_len=10, disk_num=0)
+    for rnd in range(4): # Every round appends a new version of every record
+        fm.open(1, 'CHURN')
+        for i in range(500):
+            if rnd < 3 or i % 2:
+                fm.write(1, key=f'K{i:04d}', values=[f'ronde {rnd}', i])
+            else:
+                fm.remove(1, key=f'K{i:04d}')
+        fm.close(1)
+    fm.open(1, 'CHURN')
+    with pytest.raises(RuntimeError):
+        fm.compact('CHURN')
+    fm.close(1)
+
+    report = fm.compact('CHURN')
+    assert report['records'] == 250
+    assert report['new_size'] < report['old_size'] / 4
+    assert report['seconds'] >= report['old_load'] + report['new_load']
+    fm.open(1, 'CHURN')
+    assert fm.get_next_key(1) == 'K0001'
+    assert fm.read(1, key='K0001') == ['ronde 3', 1]
+    assert fm.read(1, key='K0002') is None
+    fm.close(1)
+
+
+@pytest.mark.parametrize('fmt', ['JSON', 'BINARY'])
+def test_compact_keeps_serial_record_numbers(make_fm, fmt):
+    fm = make_fm(FORMAT=fmt)
+    fm.create('COMPLOG', 'SERIAL', disk_num=0)
+    fm.open(1, 'COMPLOG')
+    for i in range(6):
+        fm.write(1, values=[f'regel {i}'])
+    for i in (1, 4, 5):
+        fm.remove(1, key=str(i))
+    fm.close(1)
+    assert fm.compact('COMPLOG')['records'] >= 3
+    fm.open(1, 'COMPLOG')
+    assert fm.read(1, ind=3) == ['regel 3']
+    assert fm.read(1, ind=4) is None
+    fm.write(1, values=['nieuw'])
+    assert fm.read(1, ind=6) == ['nieuw'] # Numbers of removed records are not reused
+
+
+# --- Front-coded key index (KEYINDEX=) ---
+
+def test_front_coded_index_above_the_keyindex_threshold(make_fm):
+    fm = make_fm(FORMAT='BINARY', KEYINDEX=500)
+    keys = [f"CURSUS{i % 40:03d}Y{2015 + i % 10}M{i:06d}" for i in range(3000)]
+    fm.create('MANYKEYS', 'DIRECT', key_len=30, disk_num=0)
+    fm.open(1, 'MANYKEYS')
+    for i, key in enumerate(keys):
+        fm.write(1, key=key, values=[i])
+    fm.close(1)
+    fm.create('FEWKEYS', 'DIRECT', key_len=30, disk_num=0)
+    fm.open(1, 'FEWKEYS')
+    for i, key in enumerate(keys[:100]):
+        fm.write(1, key=key, values=[i])
+    fm.close(1)
+
+    report = fm.key_footprint('MANYKEYS')
+    assert (report['keys'], report['index'], report['directory']) == (3000, 'compact', 'compact')
+    assert report['index_bytes'] < report['plain_bytes'] / 2
+    assert fm.key_footprint('FEWKEYS')['index'] == 'list' # Below the threshold
+
+    fm.open(1, 'MANYKEYS')
+    for i in range(0, 3000, 13):
+        assert fm.read(1, key=keys[i]) == [i]
+    fm.write(1, key='CURSUS000Y2015M000000A', values=['tussen'])
+    fm.remove(1, key=keys[40])
+    fm.close(1)
+    fm.open(1, 'MANYKEYS')
+    order = []
+    while True:
+        try:
+            order.append(fm.get_next_key(1))
+        except EOFError:
+            break
+        fm.read(1)
+    expected = sorted(set(keys) - {keys[40]} | {'CURSUS000Y2015M000000A'})
+    assert order == expected
+    assert fm.read(1, key='CURSUS000Y2015M000000A') == ['tussen']
+    fm.close(1)
+
+
+# --- Compression (BINARY files) ---
+
+def _ops(path):
+    with open(path, 'rb') as f:
+        storage_format.read_header(f)
+        ops = []
+        while True:
+            raw = f.read(storage_format.RECORD.size)
+            if len(raw) < storage_format.RECORD.size:
+                return ops
+            op, klen, vlen = storage_format.RECORD.unpack(raw)
+            f.seek(klen + vlen, os.SEEK_CUR)
+            ops.append(op)
+
+
+COMPRESS_OPS = {'zlib': storage_format.OP_PUT_ZLIB, 'lzma': storage_format.OP_PUT_LZMA}
+
+
+@pytest.mark.parametrize('compress', [
+    'zlib', pytest.param('lzma', marks=pytest.mark.skipif(storage_format.lzma is None, reason="no lzma"))])
+def test_compressed_binary_round_trip(make_fm, tmp_path, compress):
+    fm = make_fm(FORMAT='BINARY')
+    text = ' '.join(['cursus', 'docent', 'lokaal', 'week'] * 30)
+    fm.create('PACKED', 'DIRECT', key_len=10, disk_num=0, compress=compress)
+    fm.create('PACKEDLOG', 'SERIAL', disk_num=0, compress=compress)
+    fm.open(1, 'PACKED')
+    fm.open(2, 'PACKEDLOG')
+    for i in range(200):
+        fm.write(1, key=f'K{i:04d}', values=[f'{i}: {text}', i, 'kort'])
+        fm.write(2, values=[f'{i}: {text}'])
+    fm.write(1, key='SMALL', values=['x']) # Below COMPRESS_MIN: stored as is
+    fm.close(1)
+    fm.close(2)
+    path = str(tmp_path / 'd0' / 'PACKED.json')
+    ops = _ops(path)
+    assert ops.count(COMPRESS_OPS[compress]) == 200 and ops.count(storage_format.OP_PUT) == 1
+    assert set(_ops(str(tmp_path / 'd0' / 'PACKEDLOG.json'))) == {COMPRESS_OPS[compress]}
+
+    fm.open(1, 'PACKED')
+    fm.open(2, 'PACKEDLOG')
+    assert fm.read(1, key='K0123') == [f'123: {text}', 123, 'kort']
+    assert fm.read(1, key='SMALL') == ['x']
+    assert fm.read(2, ind=199) == [f'199: {text}']
+    fm.write(1, key='K0123', values=['veranderd ' + text]) # Appended compressed too
+    fm.close(1)
+    fm.close(2)
+    assert _ops(path)[-1] == COMPRESS_OPS[compress]
+
+    packed = os.path.getsize(path)
+    report = fm.compact('PACKED', compress=None)
+    assert set(_ops(path)) == {storage_format.OP_PUT}
+    assert report['new_size'] > packed * 2
+    fm.compact('PACKED', compress=compress)
+    assert os.path.getsize(path) < packed # Also drops the overwritten record
+    fm.open(1, 'PACKED')
+    assert fm.read(1, key='K0123') == ['veranderd ' + text]
+    assert fm.read(1, key='K0199') == [f'199: {text}', 199, 'kort']
+
+
+def test_unknown_compression_is_refused(make_fm):
+    fm = make_fm(FORMAT='BINARY')
+    with pytest.raises(ValueError):
+        fm.create('BADPACK', 'DIRECT', key_len=10, disk_num=0, compress='gzip')
+
+
+# --- CREATE over a cached file ---
+
+def test_create_replaces_a_file_kept_in_the_cache(make_fm):
+    fm = make_fm(FLUSH='EXPLICIT')
+    fm.create('RECREATE', 'DIRECT', key_len=10, disk_num=0)
+    fm.open(1, 'RECREATE')
+    fm.write(1, key='OLD', values=['old'])
+    with pytest.raises(RuntimeError):
+        fm.create('RECREATE', 'DIRECT', key_len=10, disk_num=0) # Still open
+    fm.close(1) # FLUSH=EXPLICIT: stays cached, unflushed
+    fm.create('RECREATE', 'SORT', key_len=10, disk_num=0)
+    fm.open(1, 'RECREATE')
+    assert fm.channels[1]['type'] == 'SORT'
+    assert fm.read(1, key='OLD') is None
+    fm.close(1)
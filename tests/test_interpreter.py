@@ -0,0 +1,93 @@
+"""Interpreter checks that need more than one program run in a session.
+Run with: python -m pytest tests"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interpreter import ThoroughbredBasicInterpreter # noqa: E402
+
+
+class CaptureIO:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(str(text))
+
+    def print(self, text=""):
+        self.lines.append(str(text) + "\n")
+
+    def input(self, prompt=""):
+        return ""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    @property
+    def text(self):
+        return ''.join(self.lines)
+
+
+@pytest.fixture
+def basic(tmp_path, monkeypatch):
+    """Runs BASIC source in one interpreter (one session) on fresh disks."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'IPLINPUT').write_text(f"D0 = {tmp_path}/d0\n")
+    io = CaptureIO()
+    interp = ThoroughbredBasicInterpreter(io)
+
+    def run(source):
+        io.lines.clear()
+        interp.load_program(source)
+        interp.execute()
+        return io.text
+    run.interp = interp
+    return run
+
+
+SETUP = '10 DIRECT "TXSTOP", 10, 64, 0\n20 END\n'
+CHECK = '''10 OPEN (1) "TXSTOP"
+20 READ (1, KEY="K", DOM=50) A$
+30 PRINT "FOUND ", A$
+40 GOTO 60
+50 PRINT "NOT FOUND"
+60 BEGIN
+70 PRINT "BEGIN OK"
+80 COMMIT
+90 END
+'''
+
+
+@pytest.mark.parametrize('ending', ['STOP', 'EXIT', 'REM runs off the end'])
+def test_program_ending_without_end_rolls_back(basic, ending):
+    basic(SETUP)
+    basic(f'10 OPEN (1) "TXSTOP"\n20 BEGIN\n30 WRITE (1, KEY="K") "UNCOMMITTED"\n40 {ending}\n')
+    assert basic.interp.file_manager.transaction is None
+    assert basic.interp.file_manager.channels == {}
+    assert basic(CHECK) == "NOT FOUND\nBEGIN OK\n"
+
+
+def test_reset_rolls_back_aborted_run(basic):
+    basic(SETUP)
+    basic('10 OPEN (1) "TXSTOP"\n20 BEGIN\n30 WRITE (1, KEY="K") "UNCOMMITTED"\n40 LET A = 1 / 0\n')
+    assert basic(CHECK) == "NOT FOUND\nBEGIN OK\n"
+
+
+def test_call_import_and_export(basic, tmp_path):
+    (tmp_path / 'in.csv').write_text("A1,JANSEN,42\nA2,PIETERS,7\n")
+    out = basic(f'''10 DIRECT "BULKCALL", 10, 64, 0
+20 CALL "*IMPORT", "BULKCALL", "{tmp_path}/in.csv", "CSV", N, R
+30 PRINT "IMPORTED ", N
+40 OPEN (1) "BULKCALL"
+50 READ (1, KEY="A2") NAAM$, LEEFTIJD
+60 PRINT NAAM$, " ", LEEFTIJD + 1
+70 CLOSE (1)
+80 CALL "*EXPORT", "BULKCALL", "{tmp_path}/out.jsonl", "JSONL", N, R
+90 PRINT "EXPORTED ", N
+100 END
+''')
+    assert out == "IMPORTED  2\nPIETERS   8\nEXPORTED  2\n" # Numbers print with a sign position
+    assert (tmp_path / 'out.jsonl').read_text() == '["A1", "JANSEN", 42]\n["A2", "PIETERS", 7]\n'
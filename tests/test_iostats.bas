@@ -0,0 +1,19 @@
+10 REM I/O statistics: CALL "*IOSTATS", chn lists them on a channel
+20 DIRECT "STATFILE", 10, 64
+30 OPEN (1) "STATFILE"
+40 WRITE (1, KEY="A") "ONE"
+50 WRITE (1, KEY="B") "TWO"
+60 READ (1, KEY="A") X$
+70 READ (1, KEY="C", DOM=80) X$
+80 REMOVE (1, KEY="B")
+90 CALL "*IOSTATS", 2
+100 READ (2, END=200) F$, C, O, R, H, M, W, D
+110 IF F$ = "STATFILE" THEN 130
+120 GOTO 100
+130 PRINT "FILE ", F$, " CHANNEL ", C
+140 PRINT "READS ", R, " HITS ", H, " MISSES ", M
+150 PRINT "WRITES ", W, " REMOVES ", D
+160 GOTO 100
+200 CLOSE (1)
+210 ERASE "STATFILE"
+220 END
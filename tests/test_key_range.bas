@@ -0,0 +1,26 @@
+10 REM TEST PARTIAL KEY POSITIONING AND PREFIX SCAN
+20 ERASE "test_range", ERR=30
+30 DIRECT "test_range", 10, 20
+40 OPEN (1) "test_range"
+50 WRITE (1, KEY="C01M001") "OK"
+60 WRITE (1, KEY="C02M001") "OK"
+70 WRITE (1, KEY="C02M007") "OK"
+80 WRITE (1, KEY="C03M002") "OK"
+90 REM POSITION ON THE FIRST KEY OF COURSE C02
+100 READ (1, KEY="C02", DOM=110) X$
+110 LET K$ = KEY(1, END=160)
+115 LET P = POS("C02"=K$)
+120 IF P = 0 THEN 160
+130 PRINT "IN RANGE: "; K$
+140 READ (1, KEY=K$) X$
+150 GOTO 110
+160 PRINT "PREFIX SCAN DONE"
+170 REM SEQUENTIAL READ WITH END=
+180 READ (1, KEY="C03", DOM=190) X$
+190 READ (1, END=220) X$
+200 PRINT "READ AFTER C03: "; X$
+210 GOTO 190
+220 PRINT "PASS: END= TAKEN AT END OF FILE"
+230 CLOSE (1)
+240 ERASE "test_range"
+250 END
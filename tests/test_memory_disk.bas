@@ -0,0 +1,27 @@
+10 REM Work files on the memory disk D9 (IPLINPUT: D9 = :memory:)
+20 DIRECT "WORKFILE", 10, 64, 9
+30 SORT "WORKSORT", 10, 0, 9
+40 OPEN (1) "WORKFILE"
+50 OPEN (2) "WORKSORT"
+60 WRITE (1, KEY="K1") 10
+70 WRITE (1, KEY="K3") 30
+80 WRITE (2, KEY="S2")
+90 WRITE (2, KEY="S1")
+100 CLOSE (1)
+110 CLOSE (2)
+120 REM Closed files stay in memory until ERASE
+130 OPEN (1) "WORKFILE"
+140 READ (1, KEY="K3") V
+150 PRINT "K3 = ", V
+160 OPEN (2) "WORKSORT"
+170 K$ = KEY(2)
+180 PRINT "FIRST SORT KEY: ", K$
+190 CLOSE (1)
+200 CLOSE (2)
+210 ERASE "WORKFILE"
+220 ERASE "WORKSORT"
+230 OPEN (1, ERR=260) "WORKFILE"
+240 PRINT "FAILURE: WORKFILE still there"
+250 GOTO 270
+260 PRINT "ERASED"
+270 END
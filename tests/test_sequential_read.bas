@@ -0,0 +1,25 @@
+10 REM TEST SEQUENTIAL READ IN KEY ORDER ON A DIRECT FILE
+20 ERASE "test_seq", ERR=30
+30 DIRECT "test_seq", 10, 20
+40 OPEN (1) "test_seq"
+50 WRITE (1, KEY="C") "THIRD"
+60 WRITE (1, KEY="A") "FIRST"
+70 WRITE (1, KEY="B") "SECOND"
+80 CLOSE (1)
+90 OPEN (1) "test_seq"
+100 LET L$ = ""
+110 READ (1, ERR=140) V$
+120 LET L$ = L$ + V$ + " "
+130 GOTO 110
+140 PRINT "READ ORDER: "; L$
+150 IF L$ = "FIRST SECOND THIRD " THEN 156
+152 PRINT "FAIL: WRONG ORDER"
+154 GOTO 160
+156 PRINT "PASS: RECORDS IN KEY ORDER"
+160 READ (1, KEY="A") V$
+170 LET K$ = KEY(1)
+180 READ (1) W$
+190 PRINT "AFTER KEY=A, KEY(1)="; K$; " AND READ GIVES "; W$
+200 CLOSE (1)
+210 ERASE "test_seq"
+220 END
@@ -0,0 +1,29 @@
+10 REM TEST SERIAL RECORD NUMBERS SURVIVE REMOVE + REOPEN
+20 ERASE "test_serial_reopen"
+30 SERIAL "test_serial_reopen", 64
+40 OPEN (1) "test_serial_reopen", SERIAL
+50 PRINT "WRITING RECORDS 0..3, REMOVING 2 AND 3"
+60 WRITE (1) "RECORD 0"
+70 WRITE (1) "RECORD 1"
+80 WRITE (1) "RECORD 2"
+90 WRITE (1) "RECORD 3"
+100 REMOVE (1, KEY="2")
+110 REMOVE (1, KEY="3")
+120 CLOSE (1)
+130 OPEN (1) "test_serial_reopen", SERIAL
+140 WRITE (1) "NEW RECORD"
+150 READ (1, IND=2, DOM=170) A$
+160 PRINT "FAIL: RECORD 2 REUSED: "; A$
+165 GOTO 180
+170 PRINT "PASS: RECORD 2 STAYS REMOVED"
+180 READ (1, IND=3, DOM=200) A$
+190 PRINT "FAIL: RECORD 3 REUSED: "; A$
+195 GOTO 210
+200 PRINT "PASS: RECORD 3 STAYS REMOVED"
+210 READ (1, IND=4, DOM=240) A$
+220 PRINT "NEW RECORD IS NUMBER 4: "; A$
+230 GOTO 250
+240 PRINT "FAIL: NEW RECORD NOT AT NUMBER 4"
+250 CLOSE (1)
+260 ERASE "test_serial_reopen"
+270 END
@@ -0,0 +1,22 @@
+10 REM TEST SAME FILE OPEN ON TWO CHANNELS
+20 ERASE "test_shared", ERR=30
+30 DIRECT "test_shared", 10, 40
+40 OPEN (1) "test_shared"
+50 OPEN (2) "test_shared"
+60 WRITE (1, KEY="A") "FROM CHANNEL 1"
+70 WRITE (2, KEY="B") "FROM CHANNEL 2"
+80 READ (2, KEY="A", ERR=110) X$
+90 PRINT "PASS: CHANNEL 2 SEES "; X$
+100 GOTO 120
+110 PRINT "FAIL: WRITE ON CHANNEL 1 NOT VISIBLE ON CHANNEL 2"
+120 CLOSE (2)
+130 CLOSE (1)
+140 OPEN (1) "test_shared"
+150 READ (1, KEY="A", ERR=180) A$
+160 READ (1, KEY="B", ERR=180) B$
+170 PRINT "PASS: BOTH WRITES SURVIVED CLOSE"
+175 GOTO 190
+180 PRINT "FAIL: A WRITE WAS LOST ON CLOSE"
+190 CLOSE (1)
+200 ERASE "test_shared"
+210 END
@@ -0,0 +1,37 @@
+10 REM Transactions: BEGIN / COMMIT / ROLLBACK over several channels
+20 DIRECT "TXMEMBER", 10, 64
+30 SERIAL "TXLOG", 64
+40 OPEN (1) "TXMEMBER"
+50 OPEN (2) "TXLOG"
+60 BEGIN
+70 WRITE (1, KEY="M1") "JANSEN"
+80 WRITE (2) "ENROL M1"
+90 COMMIT
+100 READ (1, KEY="M1", DOM=900) N$
+110 PRINT "COMMITTED: ", N$
+120 BEGIN
+130 WRITE (1, KEY="M2") "PIETERS"
+140 WRITE (1, KEY="M1") "CHANGED"
+150 REMOVE (2, KEY="0")
+160 READ (1, KEY="M2", DOM=900) N$
+170 PRINT "INSIDE: ", N$
+180 ROLLBACK
+190 READ (1, KEY="M1") N$
+200 PRINT "AFTER ROLLBACK: ", N$
+210 READ (1, KEY="M2", DOM=300) N$
+220 PRINT "FAILURE: M2 still there"
+230 GOTO 310
+300 PRINT "M2 GONE"
+310 READ (2, IND=0, DOM=900) L$
+320 PRINT "LOG: ", L$
+330 COMMIT ERR=400
+340 PRINT "FAILURE: COMMIT without BEGIN"
+350 GOTO 410
+400 PRINT "NO TRANSACTION: OK"
+410 CLOSE (1)
+420 CLOSE (2)
+430 ERASE "TXMEMBER"
+440 ERASE "TXLOG"
+450 END
+900 PRINT "FAILURE: record missing"
+910 END
@@ -0,0 +1,32 @@
+10 PRINT "--- TYPED KEYS TEST ---"
+20 ERASE "test_tkeys", ERR=30
+30 DIRECT "test_tkeys", 8, 64
+40 OPEN (1) "test_tkeys"
+50 WRITE (1, KEY=10) "TIEN"
+60 WRITE (1, KEY=9) "NEGEN"
+70 WRITE (1, KEY=-2.5) "MIN"
+80 WRITE (1, KEY=100) "HONDERD"
+90 WRITE (1, KEY="ABC") "TEKST"
+100 REM 5 en 5.0 zijn dezelfde sleutel
+110 WRITE (1, KEY=5) "VIJF"
+120 WRITE (1, KEY=5.0) "VIJF PUNT NUL"
+130 CLOSE (1)
+140 OPEN (1) "test_tkeys"
+150 PRINT "VOLGORDE:"
+160 LET K = KEY(1, END=200)
+170 READ (1, KEY=K) D$
+180 PRINT K, " ", D$
+190 GOTO 160
+200 READ (1, KEY="ABC") D$
+210 PRINT "ABC: ", D$
+220 REM Een te lange sleutel wordt niet geschreven
+230 WRITE (1, KEY="VEEL TE LANG", ERR=260) "X"
+240 PRINT "FOUT: TE LANGE SLEUTEL GESCHREVEN"
+250 GOTO 270
+260 PRINT "OK: TE LANGE SLEUTEL GEWEIGERD"
+270 READ (1, KEY="VEEL TE LANG", DOM=290) D$
+280 PRINT "FOUT: TE LANGE SLEUTEL GEVONDEN"
+290 CLOSE (1)
+300 ERASE "test_tkeys"
+310 PRINT "--- TYPED KEYS TEST VOLTOOID ---"
+320 END
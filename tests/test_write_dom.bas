@@ -0,0 +1,20 @@
+10 REM TEST WRITE WITH DOM= (INSERT IF ABSENT) AND PLAIN WRITE (UPSERT)
+20 ERASE "test_write_dom", ERR=30
+30 DIRECT "test_write_dom", 10, 64
+40 OPEN (1) "test_write_dom"
+50 WRITE (1, KEY="A", DOM=80) "EERSTE"
+60 PRINT "PASS: NEW KEY WRITTEN"
+70 GOTO 90
+80 PRINT "FAIL: DOM TAKEN FOR A NEW KEY"
+90 WRITE (1, KEY="A", DOM=120) "TWEEDE"
+100 PRINT "FAIL: EXISTING KEY OVERWRITTEN DESPITE DOM="
+110 GOTO 130
+120 PRINT "PASS: DOM TAKEN FOR EXISTING KEY"
+130 READ (1, KEY="A") A$
+140 PRINT "VALUE AFTER DOM: "; A$
+150 WRITE (1, KEY="A") "DERDE"
+160 READ (1, KEY="A") A$
+170 PRINT "VALUE AFTER PLAIN WRITE: "; A$
+180 CLOSE (1)
+190 ERASE "test_write_dom"
+200 END